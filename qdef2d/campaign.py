@@ -0,0 +1,327 @@
+import os
+import re
+from qdef2d.io import compressed
+
+
+## subdirectory that a calculation is restarted in
+RESTART = 'restart'
+
+re_charge = re.compile(r'charge_(-?\d+)$')
+re_vacuum = re.compile(r'vac_\d+$')
+
+
+def is_variant(dirname):
+
+    ## the soc/dos calculations are set up in a subdirectory named "dos" or "*soc*"
+    return dirname == 'dos' or 'soc' in dirname
+
+
+def matches_variant(dirname, variant):
+
+    ## "soc" stands for any "*soc*" subdirectory, any other variant for the subdirectory of that name
+    if variant == 'soc':
+        return 'soc' in dirname
+    else:
+        return dirname == variant
+
+
+def _scan(path):
+
+    ## list the subdirectories and files in path with a single scandir call
+    dirs, files = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+
+    return sorted(dirs), files
+
+
+def find_initdef(directory):
+
+    """
+    Find the initdef*.json file (details to initialize the defect) in a directory.
+
+    Parameters
+    ----------
+    directory (str): path to the main defect directory
+
+    Returns
+    -------
+    (str) Filename of the initdef file, or None if there is not exactly one.
+
+    """
+
+    with os.scandir(directory) as it:
+        files = [entry.name for entry in it if entry.name.startswith("initdef")]
+
+    if len(files) == 1:
+        return files[0]
+    else:
+        return None
+
+
+class Leaf(object):
+
+    """
+    A single calculation in a defect campaign,
+    i.e. one charge/supercell/vacuum(/variant) combination.
+
+    Attributes
+    ----------
+    base (str): path to the charge/supercell/vacuum(/variant) directory
+    path (str): path to the directory containing the latest outputs,
+                i.e. base or its (nested) restart subdirectory
+    charge (int): charge state
+    supercell (str): supercell size as n1xn2xn3
+    vacuum (str): vacuum subdirectory name, e.g. vac_20 (None if there is no vacuum level)
+    variant (str): name of the soc/dos subdirectory (None for the main calculation)
+    restart (int): depth of restart subdirectories, 0 if there are none
+    files (set): names of all files in path
+
+    """
+
+    def __init__(self, base, path, charge, supercell, vacuum, variant, restart, files):
+
+        self.base = base
+        self.path = path
+        self.charge = charge
+        self.supercell = supercell
+        self.vacuum = vacuum
+        self.variant = variant
+        self.restart = restart
+        self.files = set(files)
+
+
+    def __repr__(self):
+
+        return "Leaf(%s)"%self.path
+
+
+    def find(self, filename):
+
+        """
+        Get the path to a (possibly compressed) output file in this calculation,
+        or None if it isn't present.
+
+        """
+
+        for ext in [''] + compressed.COMPRESSED_EXTS:
+            if filename + ext in self.files:
+                return os.path.join(self.path, filename + ext)
+
+        return None
+
+
+    def has(self, filename):
+
+        return self.find(filename) is not None
+
+
+    def as_dict(self):
+
+        return {"base": self.base, "path": self.path,
+                "charge": self.charge, "supercell": self.supercell,
+                "vacuum": self.vacuum, "variant": self.variant,
+                "restart": self.restart, "files": sorted(self.files)}
+
+
+class Manifest(object):
+
+    """
+    Index of all the calculations in a defect campaign directory tree
+    with the layout charge_<q>/<n1xn2xn3>/<vac_xx>/[<soc|dos>]/[restart/...]
+
+    """
+
+    def __init__(self, root, leaves, initdef=None):
+
+        self.root = root
+        self.initdef = initdef
+        self._leaves = list(leaves)
+        self._index = {}
+        self._variants = {}
+        for leaf in self._leaves:
+            key = (leaf.charge, leaf.supercell, leaf.vacuum)
+            if leaf.variant is None:
+                self._index[key] = leaf
+            else:
+                self._variants.setdefault(key, []).append(leaf)
+
+
+    def __len__(self):
+
+        return len(self._leaves)
+
+
+    def __iter__(self):
+
+        return iter(self._leaves)
+
+
+    def charges(self):
+
+        return sorted(set(leaf.charge for leaf in self._leaves))
+
+
+    def leaves(self, charge=None, supercell=None, vacuum=None, variant=None):
+
+        """
+        Get all main calculations (or their soc/dos counterparts if a variant is given),
+        optionally filtered by charge, supercell and vacuum.
+        Calculations without a (unique) subdirectory of the variant are left out.
+
+        """
+
+        found = []
+        for leaf in self._leaves:
+            if leaf.variant is not None:
+                continue
+            if ((charge is None or leaf.charge == charge) and
+                (supercell is None or leaf.supercell == supercell) and
+                (vacuum is None or leaf.vacuum == vacuum)):
+                if variant:
+                    leaf = self.get(leaf.charge, leaf.supercell, leaf.vacuum, variant)
+                    if leaf is None:
+                        continue
+                found.append(leaf)
+
+        return found
+
+
+    def get(self, charge, supercell, vacuum, variant=None):
+
+        """
+        Get a single calculation.
+
+        Parameters
+        ----------
+        charge (int): charge state
+        supercell (str): supercell size as n1xn2xn3
+        vacuum (str): vacuum subdirectory name, e.g. vac_20
+        [optional] variant (str): get the calculation in this subdirectory instead:
+                                  soc (any *soc* subdirectory) or dos. Default=None.
+
+        Returns
+        -------
+        (Leaf) The calculation, or None if it doesn't exist
+               (or if there are multiple possible subdirectories of the variant).
+
+        """
+
+        if not variant:
+            return self._index.get((charge, supercell, vacuum))
+
+        variants = [leaf for leaf in self._variants.get((charge, supercell, vacuum), [])
+                    if matches_variant(leaf.variant, variant)]
+        if len(variants) == 1:
+            return variants[0]
+        else:
+            return None
+
+
+    def as_dict(self):
+
+        return {"root": self.root, "initdef": self.initdef,
+                "leaves": [leaf.as_dict() for leaf in self._leaves]}
+
+
+def get_leaf(manifest, q, cell, vac, variant, myLogger):
+
+    """
+    Look up a calculation in a campaign manifest
+    and report to the logger where its outputs will be read from.
+
+    Parameters
+    ----------
+    manifest (Manifest): index of the campaign directory tree
+    q (int): charge state
+    cell (str): supercell size as n1xn2xn3
+    vac (str): vacuum subdirectory name
+    variant (str): soc/dos subdirectory to look in, or None for the main calculation
+    myLogger (Logger): logger to report to
+
+    Returns
+    -------
+    (Leaf) The calculation, or None if it can't be found.
+
+    """
+
+    leaf = manifest.get(q, cell, vac, variant)
+    path = os.path.join(manifest.root, 'charge_%d'%q, cell, vac or '')
+    if leaf is None:
+        if variant:
+            myLogger.warning("cannot find a (unique) %s subdirectory in %s"%(variant,path))
+        else:
+            myLogger.warning("cannot find %s"%path)
+    else:
+        if leaf.variant:
+            myLogger.info("parsing %s subdirectory"%leaf.variant)
+        if leaf.restart:
+            myLogger.info("parsing restart subdirectory")
+
+    return leaf
+
+
+def _make_leaf(base, charge, supercell, vacuum, variant, scan=None):
+
+    ## follow any (nested) restart subdirectories down to the latest outputs
+    path, restart = base, 0
+    dirs, files = scan if scan else _scan(path)
+    while RESTART in dirs:
+        path = os.path.join(path, RESTART)
+        restart += 1
+        dirs, files = _scan(path)
+
+    return Leaf(base, path, charge, supercell, vacuum, variant, restart, files)
+
+
+def index(root):
+
+    """
+    Walk through a defect campaign directory tree once
+    and classify every calculation in it.
+
+    Parameters
+    ----------
+    root (str): path to the main defect (or reference) directory
+
+    Returns
+    -------
+    (Manifest) Index of all the calculations.
+
+    """
+
+    leaves = []
+    dirs_q, _ = _scan(root)
+    for dir_q in dirs_q:
+        match = re_charge.match(dir_q)
+        if not match:
+            continue
+        q = int(match.group(1))
+
+        dirs_cell, _ = _scan(os.path.join(root, dir_q))
+        for cell in dirs_cell:
+            dir_cell = os.path.join(root, dir_q, cell)
+            scan_cell = _scan(dir_cell)
+            ## only the vac_<n> subdirectories are vacuum levels, not e.g. correction or dos
+            vacs = [d for d in scan_cell[0] if re_vacuum.match(d)]
+            if not vacs:
+                ## no vacuum level, e.g. for bulk calculations
+                vacs = [None]
+
+            for vac in vacs:
+                if vac is None:
+                    base, scan = dir_cell, scan_cell
+                else:
+                    base = os.path.join(dir_cell, vac)
+                    scan = _scan(base)
+                leaves.append(_make_leaf(base, q, cell, vac, None, scan))
+                ## soc/dos calculations live in a subdirectory of the main calculation
+                for variant in [d for d in scan[0] if is_variant(d)]:
+                    leaves.append(_make_leaf(os.path.join(base, variant), q, cell, vac, variant))
+
+    return Manifest(root, leaves, find_initdef(root))
+
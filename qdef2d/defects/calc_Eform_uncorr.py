@@ -2,7 +2,8 @@ import os
 import json
 import argparse
 import pandas as pd
-from qdef2d import osutils, logging
+from qdef2d import campaign, logging
+from qdef2d.io.database import local_database
 
     
 def get_i_ni(defect):
@@ -56,10 +57,8 @@ def calc(main_system,dir_db,dir_def,xlfile,mu_limit,functional="GGA",soc=False,l
     
  
     ## find initdef.json file
-    if osutils.check_file_exists(dir_def,"initdef") == True:
-        for file in os.listdir(dir_def): 
-            if file.startswith("initdef"):
-                file_initdef = file
+    file_initdef = campaign.find_initdef(dir_def)
+    if file_initdef:
         ##  get species i and ni from initdefect.json file           
         with open(os.path.join(dir_def,file_initdef), 'r') as file:
             initdef = json.loads(file.read())
@@ -72,46 +71,41 @@ def calc(main_system,dir_db,dir_def,xlfile,mu_limit,functional="GGA",soc=False,l
                      ", ".join([str(n)+"*"+i for n,i in zip(ni_list,species_list)]))
 
    
+    ## load the database once
+    db = local_database.load(dir_db)
+    
+    ## get the relevant chemical potentials
+    found_mu = True
+    mus = {}
+    for species in species_list:
+        mu_val, mu_key = db.get_mu(species, functional, mu_limit)
+        if mu_val is None:
+            myLogger.info("Cannot find the database entry for " + species)
+            found_mu = False
+        else:
+            myLogger.info("Using chemical potential " + mu_key + " from " + species + ".json")
+            mus["mu_%s_%s"%(species,mu_limit)] = mu_val
+    
+    ## check if the database entry for the host exists
+    found_host = (db.entry(main_system) is not None)
+    if not found_host:
+        myLogger.info("Cannot find the database entry for " + main_system)
+        
+   
     for q in [qi for qi in df.keys()]:
         
-        ## get the relevant chemical potentials
-        found_mu = True
-        for species in species_list:
-            mu = "mu_%s_%s"%(species,mu_limit)
-            
-            ## check if the relevant database entry exists
-            if osutils.check_file_exists(dir_db,"%s.json"%species) == True:
-                dbentry_file = "%s.json"%species
-                with open(os.path.join(dir_db, dbentry_file), 'r') as file:
-                    mater = json.loads(file.read())
-                ## search for appropriate mu entry
-                mu_key = "mu"
-                for key in mater[functional].keys():
-                    if key.startswith("mu_%s"%mu_limit):
-                        mu_key = key
-                myLogger.info("Using chemical potential " + mu_key + " from " + dbentry_file)                    
-                ## input the corresponding mus into the dataframe
-                df[q][mu] = mater[functional][mu_key]
-                
-            else:
-                myLogger.info("Cannot find the database entry for " + species)
-                found_mu = False
-    
-    
-        ## get the VBMs
-        ## check if the relevant database entry exists
-        if osutils.check_file_exists(dir_db,"%s.json"%main_system) == True:
-            dbentry_file = "%s.json"%(main_system)
-            with open(os.path.join(dir_db, dbentry_file), 'r') as file:
-                mater = json.loads(file.read())   
-                
+        ## input the corresponding mus into the dataframe
+        for mu,mu_val in mus.items():
+            df[q][mu] = mu_val
+    
+        if found_host:
             ## input the VBMs corresponding to each vacuum spacing into the dataframe
-            for rowind in df[q].index.values:
-                vac = df[q].loc[rowind].vacuum
-                if vac in mater[functional].keys():
-                    df[q].at[rowind,'VBM'] = mater[functional][vac]["VBM"]
-                else:
+            vbms = {vac: db.get_vbm(main_system, functional, vac) 
+                    for vac in df[q]['vacuum'].unique()}
+            for vac,vbm in vbms.items():
+                if vbm is None:
                     myLogger.info("Cannot find the VBM entry for " + vac) 
+            df[q]['VBM'] = df[q]['vacuum'].map(vbms).astype(float)
                   
             ## Finally, we can compute the uncorrected defect formation energy:
             ## Eform = Etot(def) - Etot(pristine) - sum(n_i*mu_i) + q*E_Fermi
@@ -129,9 +123,6 @@ def calc(main_system,dir_db,dir_def,xlfile,mu_limit,functional="GGA",soc=False,l
                                  - df[q].loc[:,'E_bulk'] \
                                  - sum_mu \
                                  + int(q.split("_")[-1]) * df[q].loc[:,'VBM']                                  
-         
-        else:
-            myLogger.info("Cannot find the database entry for " + main_system)
 
 
     ## write the updated excel file
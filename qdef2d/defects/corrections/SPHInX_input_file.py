@@ -58,21 +58,21 @@ def isolated_grp(slabmin,slabmax):
     return s
 
     
-def generate(eps,slab_d):
+def render(defprop,eps,slab_d):
     
     """
-    Generate SPHInX input file.
+    Contents of the SPHInX input file for a defect calculation.
     
+    defprop (dict): contents of the defectproperty.json file of the calculation
     eps (float): averaged dielectric constant
     slab_d (float): corresponding slab thickness (Angstroms)
     
+    Returns
+    -------
+    (str) The input file.
+    
     """
-
-    ## the main script should have put us in the appropriate subdirectory
-    dir_sub = os.getcwd()
-              
-    with open(os.path.join(dir_sub,"defectproperty.json"), 'r') as file:
-        defprop = json.loads(file.read())
+    
     lattice = Lattice.from_dict(defprop["lattice"])
     
     ## STRUCTURE GROUP
@@ -90,11 +90,88 @@ def generate(eps,slab_d):
     
     ## ISOLATED GROUP
     s += isolated_grp(slabmin,slabmax)
+    
+    return s
 
+
+def _write(s,dir_sub):
+    
+    ## write the input file to the correction subdirectory,
+    ## unless it's already there with the same contents
+    ## (leaving it untouched keeps any saved alignment valid)
+    sxfile = os.path.join(dir_sub,"correction","system.sx")
+    if os.path.exists(sxfile):
+        with open(sxfile,'r') as f:
+            if f.read() == s:
+                return False
+    
     if not os.path.exists(os.path.join(dir_sub,"correction")):
-            os.makedirs(os.path.join(dir_sub,"correction"))
-    with open(os.path.join(dir_sub,"correction","system.sx"),'w') as f:
+        os.makedirs(os.path.join(dir_sub,"correction"))
+    with open(sxfile,'w') as f:
         f.write(s)
+    
+    return True
+
+    
+def generate(eps,slab_d,dir_sub=None):
+    
+    """
+    Generate SPHInX input file.
+    
+    eps (float): averaged dielectric constant
+    slab_d (float): corresponding slab thickness (Angstroms)
+    [optional] dir_sub (str): calculation directory containing defectproperty.json;
+                              the input file is written to its correction subdirectory.
+                              Default=current working directory.
+    
+    Returns
+    -------
+    (bool) Whether or not the file was (re)written, i.e. it was missing or out of date.
+    
+    """
+
+    if dir_sub is None:
+        dir_sub = os.getcwd()
+              
+    with open(os.path.join(dir_sub,"defectproperty.json"), 'r') as file:
+        defprop = json.loads(file.read())
+    
+    return _write(render(defprop,eps,slab_d),dir_sub)
+
+
+def generate_all(manifest,eps,slab_d,soc=False):
+    
+    """
+    Generate the SPHInX input files of all charged defect calculations in a campaign in one pass.
+    Files that are already up to date are left untouched, and a calculation 
+    whose input file can't be generated doesn't stop the others.
+    
+    manifest (Manifest): index of the defect campaign directory tree (see campaign.index)
+    eps (float): averaged dielectric constant
+    slab_d (float): corresponding slab thickness (Angstroms)
+    [optional] soc (bool): whether or not to use the soc(dos) subdirectories. Default=False.
+    
+    Returns
+    -------
+    (dict) {path: status} for the directory of each charged calculation,
+           where the status is "written", "unchanged" or "failed: <reason>"
+           (e.g. if its defectproperty.json file is missing)
+    
+    """
+    
+    statuses = {}
+    for leaf in manifest.leaves(variant='dos' if soc else None):
+        if leaf.charge == 0:
+            continue
+        try:
+            with open(os.path.join(leaf.path,"defectproperty.json"), 'r') as file:
+                defprop = json.loads(file.read())
+            written = _write(render(defprop,eps,slab_d),leaf.path)
+            statuses[leaf.path] = "written" if written else "unchanged"
+        except (OSError, ValueError, KeyError) as err:
+            statuses[leaf.path] = "failed: %s"%err
+    
+    return statuses
         
         
 if __name__ == '__main__':
@@ -1,20 +1,28 @@
 import os
+import json
 import time
 import argparse
+import subprocess
 import numpy as np
-import matplotlib.pyplot as plt
-plt.switch_backend('agg')
 from qdef2d import logging
+from qdef2d.io import compressed
+from qdef2d.defects.corrections import gaussian_model_2d, plot_alignment, sxdefectalign_output
+
+
+## file in the correction directory that the alignment state is saved to
+STATEFILE = 'alignment.json'
 
 
 def calc(vref,vdef,encut,q,threshold_slope=1e-3,threshold_C=1e-3,max_iter=20,
-         vfile='vline-eV.dat',noplots=False,allplots=False,logfile=None):
+         vfile='vline-eV.dat',noplots=False,allplots=False,logfile=None,
+         solver='sxdefectalign2d',sxfile='system.sx',dir_corr=None,guess=None,width=0.5,
+         nscan=0,render=True):
     
     """
     Estimate alignment correction.
     
-    vref (str): path to bulk LOCPOT file
-    vdef (str): path to defect LOCPOT file
+    vref (str): path to bulk LOCPOT file (may be compressed)
+    vdef (str): path to defect LOCPOT file (may be compressed)
     encut (int): cutoff energy (eV)
     q (int): charge (conventional units)
     [optional] threshold_slope (float): threshold for determining if potential is flat
@@ -25,119 +33,392 @@ def calc(vref,vdef,encut,q,threshold_slope=1e-3,threshold_C=1e-3,max_iter=20,
     [optional] vfile (str): vline .dat file. Default='vline-eV.dat'
     [optional] noplots (bool): do not generate plots. Defaule=False.
     [optional] allplots (bool): save all plots. Default=False.
+    [optional] render (bool): plot the saved profiles at the end. Default=True.
+                              Otherwise they are left (as alignment*.npz) 
+                              for plot_alignment to plot later.
     [optional] logfile (str): logfile to save output to 
+    [optional] solver (str): 'sxdefectalign2d' (default) to run the external ~/sxdefectalign2d,
+                             or 'native' to solve the same Gaussian model in-process
+    [optional] sxfile (str): SPHInX input file with the model parameters. Default='system.sx'.
+    [optional] dir_corr (str): directory to run the correction in; vfile, sxfile, logfile,
+                               the plots and the correction file are all relative to this.
+                               Default=current working directory.
+    [optional] guess (float): initial guess for the shift (bohr), e.g. the converged shift
+                              of a neighbouring supercell/vacuum. Default=start from the
+                              defect position, bracketed by the slab boundaries.
+    [optional] width (float): half-width of the initial bracket around the guess (bohr).
+                              Default=0.5.
+    [optional] nscan (int): with the native solver, first evaluate this many shifts
+                            across the initial bracket all at once, and start the search
+                            from the root of the slope curve (saved to shift_scan.dat).
+                            Default=0 (no scan).
+    
+    Every evaluated shift is saved to alignment.json in dir_corr as it is done,
+    so an interrupted run picks up where it left off (as long as the LOCPOTs,
+    the SPHInX input file and the settings haven't changed), and the converged shift
+    is kept there for warm-starting neighbouring calculations.
+    
+    Returns
+    -------
+    (bool) Whether the optimal shift was found and the correction evaluated.
     
     """
     
+    if dir_corr is None:
+        dir_corr = os.getcwd()
+    vref, vdef = os.path.abspath(vref), os.path.abspath(vdef)
+    vfile, sxfile = os.path.join(dir_corr,vfile), os.path.join(dir_corr,sxfile)
+    
     ## set up logging
     if logfile:
-        myLogger = logging.setup_logging(os.path.join(os.getcwd(),logfile))
+        logfile = os.path.join(dir_corr,logfile)
+        myLogger = logging.setup_logging(logfile)
     else:
         myLogger = logging.setup_logging()
     
+    ## resume from any previous run with the same inputs
+    state = AlignmentState(os.path.join(dir_corr,STATEFILE),
+                           _inputs(vref,vdef,sxfile,encut,q,solver))
+    if state.shift is not None:
+        start, bracket = state.shift, (state.shift-width, state.shift+width)
+    elif guess is not None:
+        start, bracket = guess, (guess-width, guess+width)
+    else:
+        start, bracket = 0.0, _bracket(sxfile)
+    
+    
+    if solver == 'native':
+        ## the native solver reads the (possibly compressed) LOCPOTs itself
+        model = gaussian_model_2d.GaussianModel2D.from_sphinx(sxfile,encut)
+        z, dV = gaussian_model_2d.planar_average_difference(vref,vdef)
+        
+        def profile(shift):
+            data = model.profile(shift,z,dV)
+            np.savetxt(vfile,data)
+            return data
+        
+        def finish(shift,C_ave):
+            E_corr = model.write_correction(shift,C_ave,q,os.path.join(dir_corr,'correction'))
+            myLogger.info("correction energy = %.8f eV"%E_corr)
+        
+        if nscan > 1 and state.shift is None:
+            ## the scan replaces the initial bracket by the grid points around the root
+            out = scan(model,z,dV,np.linspace(bracket[0],bracket[1],nscan))
+            np.savetxt(os.path.join(dir_corr,'shift_scan.dat'),
+                       np.column_stack([out[key] for key in ['shift','m1','m2','C1','C2']]),
+                       header='shift m1 m2 C1 C2')
+            start, bracket = _scan_root(out,q,start,bracket)
+            myLogger.info("shift scan: start from shift = %.8f in [%.8f, %.8f]"
+                          %(start,bracket[0],bracket[1]))
+            
+        done = _calc(profile,finish,q,threshold_slope,threshold_C,max_iter,
+                     noplots,allplots,start,bracket,state,dir_corr,myLogger)
+        
+    elif solver == 'sxdefectalign2d':
+        ## sxdefectalign2d can't read compressed LOCPOTs,
+        ## so these are temporarily decompressed for the duration of the run
+        with compressed.uncompressed(vref,dir_corr) as vref, \
+             compressed.uncompressed(vdef,dir_corr) as vdef:
+            
+            ## basic command to run sxdefectalign2d (in dir_corr, where it finds system.sx)
+            command = [os.path.expanduser('~/sxdefectalign2d'), '--vasp',
+                       '--ecut', str(encut/13.6057), ## convert eV to Ry
+                       '--vref', vref,
+                       '--vdef', vdef]
+            
+            def profile(shift):
+                ## run sxdefectalign2d with --shift <shift>, appending its output to the logfile
+                with open(logfile if logfile else os.devnull, 'a') as f:
+                    subprocess.run(command + ['--shift', str(shift), '--onlyProfile'],
+                                   cwd=dir_corr, stdout=f, stderr=subprocess.STDOUT, check=True)
+                ## read in the potential profiles from vline-eV.dat
+                return sxdefectalign_output.read_vline(vfile)
+            
+            def finish(shift,C_ave):
+                ## run sxdefectalign2d with --shift <shift> -C <C_ave> > correction
+                with open(os.path.join(dir_corr,'correction'), 'w') as f:
+                    subprocess.run(command + ['--shift', str(shift), '-C', str(C_ave)],
+                                   cwd=dir_corr, stdout=f, check=True)
+                
+            done = _calc(profile,finish,q,threshold_slope,threshold_C,max_iter,
+                         noplots,allplots,start,bracket,state,dir_corr,myLogger)
+            
+    else:
+        raise ValueError("unknown solver %s"%solver)
+    
+    if render and not noplots:
+        plot_alignment.render(dir_corr)
     
-    ## basic command to run sxdefectalign2d
-    command = ['~/sxdefectalign2d', '--vasp',
-               '--ecut', str(encut/13.6057), ## convert eV to Ry
-               '--vref', vref,
-               '--vdef', vdef]
+    return done
     
+
+def _inputs(vref,vdef,sxfile,encut,q,solver):
     
-    ## initialize the range of shift values bracketing the optimal shift
-    smin, smax = -np.inf, np.inf
-    shift = 0.0
-    shifting = 'right'
-    done = False
-    counter = -1
+    ## everything the potential profiles depend on; 
+    ## LOCPOTs are identified by their modification time and size
+    inputs = {"encut": encut, "q": q, "solver": solver}
+    for key,filename in [("vref",vref),("vdef",vdef)]:
+        st = os.stat(filename)
+        inputs[key] = [filename, st.st_mtime_ns, st.st_size]
+    if os.path.exists(sxfile):
+        with open(sxfile) as f:
+            inputs["system.sx"] = f.read()
+    
+    return inputs
 
 
-    time0 = time.time()
-    while not done and counter < max_iter:
-        counter += 1
-        ## run sxdefectalign2d with --shift <shift>
-        if logfile:
-            command1 = command + ['--shift', str(shift), '--onlyProfile', '>> %s'%logfile]
-        else:
-            command1 = command + ['--shift', str(shift), '--onlyProfile']
-        os.system(' '.join(command1))
+class AlignmentState(object):
+    
+    """
+    Slopes and intercepts of every shift tried so far, and the converged shift,
+    kept in a json file in the correction directory.
+    Anything saved for different inputs is discarded.
+    
+    Parameters
+    ----------
+    filename (str): path to the json file
+    inputs (dict): the inputs the potential profiles depend on
+    
+    """
+    
+    def __init__(self,filename,inputs):
+        
+        self.filename = filename
+        self.inputs = inputs
+        self.evaluations = {}
+        self.shift, self.C_ave = None, None
+        
+        saved = load_state(os.path.dirname(filename),os.path.basename(filename))
+        if saved and saved.get("inputs") == inputs:
+            self.evaluations = {"%.8f"%e[0]: e[1:] for e in saved["evaluations"]}
+            if saved["converged"]:
+                self.shift, self.C_ave = saved["shift"], saved["C_ave"]
+        
+        return
+    
+    
+    def get(self,shift):
+        
+        return self.evaluations.get("%.8f"%shift)
+    
+    
+    def add(self,shift,m1,m2,C1,C2):
+        
+        self.evaluations["%.8f"%shift] = [m1,m2,C1,C2]
+        self.save()
+        
         
-        ## read in the potential profiles from vline-eV.dat
-        ## z  V^{model}  \DeltaV^{DFT}  V^{sr}
-        data = np.loadtxt(vfile)
+    def converged(self,shift,C_ave):
         
-        ## plot potential profiles
-        if not noplots:
-            plt.figure()
-            plt.plot(data[:,0],data[:,2],'r',label=r'$V_{def}-V_{bulk}$')
-            plt.plot(data[:,0],data[:,1],'g',label=r'$V_{model}$')
-            plt.plot(data[:,0],data[:,-1],'b',label=r'$V_{def}-V_{bulk}-V_{model}$')
-            plt.xlabel("distance along z axis (bohr)")
-            plt.ylabel("potential (eV)")
-            plt.xlim(data[0,0],data[-1,0])
-            plt.legend() 
-            if allplots:
-                plt.savefig(os.getcwd()+'/alignment_%d.png'%counter)
-            else:
-                plt.savefig(os.getcwd()+'/alignment.png')
-            plt.close()
+        self.shift, self.C_ave = shift, C_ave
+        self.save()
         
-        ## assumes that the slab is in the center of the cell vertically!
-        ## select datapoints corresponding to 2 bohrs at the top and bottom of the supercell 
-        ## (i.e. a total of 4 bohrs in the middle of vacuum)
-        z1 = np.min([i for i,z in enumerate(data[:,0]) if z > 2.])
-        z2 = np.min([i for i,z in enumerate(data[:,0]) if z > (data[-1,0]-2.)])
         
-        ## fit straight lines through each subset of datapoints
-        m1,C1 = np.polyfit(data[:z1,0],data[:z1,-1],1)
-        m2,C2 = np.polyfit(data[z2:,0],data[z2:,-1],1)
-        myLogger.debug("Slopes: %.8f %.8f; Intercepts: %.8f %.8f"%(m1,m2,C1,C2))
+    def save(self):
         
-        ## check the slopes and intercepts of the lines
-        ## and shift the charge along z until the lines are flat
-        if (abs(m1) < threshold_slope and abs(m2) < threshold_slope
-            and abs(C1-C2) < threshold_C):
-            done = True
+        ## write to a temporary file first so that an interrupted write doesn't lose the state
+        state = {"inputs": self.inputs, "converged": self.shift is not None,
+                 "shift": self.shift, "C_ave": self.C_ave,
+                 "evaluations": [[float(shift)] + vals for shift,vals in self.evaluations.items()]}
+        with open(self.filename+'.tmp','w') as f:
+            json.dump(state,f,indent=1)
+        os.replace(self.filename+'.tmp',self.filename)
+    
+    
+def load_state(dir_corr,statefile=STATEFILE):
+    
+    """
+    Load the alignment state saved by calc().
+    
+    Parameters
+    ----------
+    dir_corr (str): correction directory
+    [optional] statefile (str): name of the json file. Default=alignment.json.
+    
+    Returns
+    -------
+    (dict) with the keys inputs, converged, shift, C_ave, evaluations,
+           or None if there is no (readable) saved state.
+    
+    """
+    
+    try:
+        with open(os.path.join(dir_corr,statefile)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _vacuum_fit(z,V):
+    
+    ## assumes that the slab is in the center of the cell vertically!
+    ## select datapoints corresponding to 2 bohrs at the top and bottom of the supercell 
+    ## (i.e. a total of 4 bohrs in the middle of vacuum),
+    ## and fit straight lines through each subset of datapoints
+    ## (for every row of V at once)
+    fits = []
+    for window in sxdefectalign_output.vacuum_windows(z,2.):
+        zw, Vw = z[window], V[...,window]
+        dz = zw - zw.mean()
+        m = np.sum(dz*(Vw - Vw.mean(axis=-1,keepdims=True)),axis=-1)/np.sum(dz**2)
+        fits.append((m, Vw.mean(axis=-1) - m*zw.mean()))
+    
+    return fits[0][0], fits[1][0], fits[0][1], fits[1][1]
+    
+
+def scan(model,z,dV,shifts):
+    
+    """
+    Evaluate the slopes and intercepts of dV - V_model in both vacuum regions
+    for a whole array of shifts of the model charge at once.
+    
+    Parameters
+    ----------
+    model (GaussianModel2D): the model charge
+    z (array): z positions of the DFT potential (bohr)
+    dV (array): planar-averaged DFT potential difference V_def - V_bulk (eV)
+    shifts (array): shifts of the charge along z (bohr)
+    
+    Returns
+    -------
+    (dict) with the keys shift, m1, m2, C1, C2, each an array of the same shape as shifts
+    
+    """
+    
+    shifts = np.asarray(shifts, dtype=float)
+    m1, m2, C1, C2 = _vacuum_fit(z, dV - model.model_on_grid(shifts,z))
+    
+    return {"shift": shifts, "m1": m1, "m2": m2, "C1": C1, "C2": C2}
+
+
+def _scan_root(out,q,start,bracket):
+    
+    ## (m1+m2)*sign(q) decreases with the shift; take the first sign change on the grid
+    ## and interpolate linearly between its two grid points
+    f = (out["m1"]+out["m2"])*np.sign(q)
+    shifts = out["shift"]
+    i = np.flatnonzero((f[:-1] > 0) & (f[1:] <= 0))
+    if len(i) == 0:
+        ## the root is outside the scanned range; start from the end that is closest
+        return (shifts[-1], bracket) if f[-1] > 0 else (shifts[0], bracket)
+    i = i[0]
+    root = shifts[i] - f[i]*(shifts[i+1]-shifts[i])/(f[i+1]-f[i])
+    
+    return root, (shifts[i], shifts[i+1])
+
+
+def _bracket(sxfile):
+    
+    ## the model charge should stay inside the slab,
+    ## so the slab boundaries relative to the defect position bound the shift
+    if not os.path.exists(sxfile):
+        return (-1.0, 1.0)
+    system = gaussian_model_2d.read_system(sxfile)
+    if not system["slabs"]:
+        return (-1.0, 1.0)
+    fromZ = min([slab[0] for slab in system["slabs"]])
+    toZ = max([slab[1] for slab in system["slabs"]])
+    
+    return (fromZ-system["posZ"], toZ-system["posZ"])
+
+
+def _evaluate(profile,shift,counter,noplots,allplots,dir_corr,myLogger):
+    
+    ## get the potential profiles for this shift
+    ## z  V^{model}  \DeltaV^{DFT}  V^{sr}
+    data = profile(shift)
+    
+    ## save the potential profiles; they are plotted afterwards, all at once
+    if not noplots:
+        if allplots:
+            plot_alignment.save_profile(data,shift,os.path.join(dir_corr,'alignment_%d.npz'%counter))
+        else:
+            plot_alignment.save_profile(data,shift,os.path.join(dir_corr,'alignment.npz'))
+    
+    ## fit straight lines through the potential in the middle of the vacuum
+    m1,m2,C1,C2 = _vacuum_fit(data[:,0],data[:,-1])
+    myLogger.debug("shift = %.8f; Slopes: %.8f %.8f; Intercepts: %.8f %.8f"
+                   %(shift,m1,m2,C1,C2))
+    
+    return m1,m2,C1,C2
+
+
+def _calc(profile,finish,q,threshold_slope,threshold_C,max_iter,
+          noplots,allplots,start,bracket,state,dir_corr,myLogger):
+    
+    ## profile(shift) returns the potential profiles for a given shift of the model charge,
+    ## finish(shift,C_ave) evaluates the final correction.
+    ## The optimal shift is where the potential in the vacuum is flat on both sides;
+    ## (m1+m2)*sign(q) decreases as the charge is shifted in +z, 
+    ## so its root is found with a bracketed secant (Illinois) method,
+    ## starting from the initial guess and bracket.
+    
+    time0 = time.time()
+    counter = 0
+    done = False
+    
+    def f(shift):
+        ## shifts that have been tried before (e.g. by an interrupted run) aren't re-evaluated
+        if state.get(shift):
+            m1,m2,C1,C2 = state.get(shift)
+            myLogger.debug("shift = %.8f; Slopes: %.8f %.8f; Intercepts: %.8f %.8f (saved)"
+                           %(shift,m1,m2,C1,C2))
+        else:
+            m1,m2,C1,C2 = _evaluate(profile,shift,counter,noplots,allplots,dir_corr,myLogger)
+            state.add(shift,m1,m2,C1,C2)
+        converged = (abs(m1) < threshold_slope and abs(m2) < threshold_slope
+                     and abs(C1-C2) < threshold_C)
+        return (m1+m2)*np.sign(q), converged, (C1+C2)/2
+    
+    ## start with the charge at the initial guess
+    a = start
+    fa, done, C_ave = f(a)
+    shift = a
+    
+    ## then find a bracket, starting from the end of the initial bracket 
+    ## on the side indicated by the slopes
+    if not done:
+        width = bracket[1]-bracket[0]
+        b = bracket[1] if fa > 0 else bracket[0]
+        while counter < max_iter:
+            counter += 1
+            fb, done, C_ave = f(b)
+            shift = b
+            if done or fa*fb <= 0:
+                break
+            myLogger.info("optimal shift is beyond %.8f"%b)
+            a, fa = b, fb
+            b += width*np.sign(fa)
+        myLogger.debug("optimal shift is in [%.8f, %.8f]"%(min(a,b),max(a,b)))
+    
+    ## Illinois iterations: secant steps within the bracket, halving the weight of
+    ## the retained endpoint whenever it is kept, so that the bracket keeps shrinking from both sides
+    while not done and counter < max_iter and fa*fb <= 0 and abs(b-a) > 1e-8:
+        counter += 1
+        shift = (a*fb - b*fa)/(fb - fa)
+        myLogger.info("try shift = %.8f"%shift)
+        fc, done, C_ave = f(shift)
+        if done or fc == 0:
             break
-        elif m1*m2 < 0:
-            myLogger.info("undetermined...make a tiny shift and try again")
-            if shifting == 'right':
-                shift += 0.01
-            else: 
-                shift -= 0.01
-            myLogger.info("try shift = %.8f"%shift)
-        elif (m1+m2)*np.sign(q) > 0:
-            smin = shift
-            if smax == np.inf:
-                shift += 1.0
-            else:
-                shift = (smin+smax)/2.0
-            shifting = 'right'
-            myLogger.debug("optimal shift is in [%.8f, %.8f]"%(smin,smax))
-            myLogger.info("shift charge in +z direction; try shift = %.8f"%shift)
-        elif (m1+m2)*np.sign(q) < 0:
-            smax = shift
-            if smin == -np.inf:
-                shift -= 1.0
-            else:
-                shift = (smin+smax)/2.0
-            shifting = 'left'
-            myLogger.debug("optimal shift is in [%.8f, %.8f]"%(smin,smax))
-            myLogger.info("shift charge in -z direction; try shift = %.8f"%shift)
+        if fc*fb < 0:
+            a, fa = b, fb
+        else:
+            fa /= 2
+        b, fb = shift, fc
+        myLogger.debug("optimal shift is in [%.8f, %.8f]"%(min(a,b),max(a,b)))
     
                        
     if done:
-        C_ave = (C1+C2)/2
         myLogger.info("DONE! shift = %.8f & alignment correction = %.8f"%(shift,C_ave))
-        ## run sxdefectalign2d with --shift <shift> -C <C_ave> > correction
-        command2 = command + ['--shift', str(shift),
-                              '-C', str(C_ave),
-                              '> correction']
-        os.system(' '.join(command2))
+        finish(shift,C_ave)
+        state.converged(shift,C_ave)
     else:
-        myLogger.info("Could not find optimal shift after %d tries :("%max_iter)
+        myLogger.info("Could not find optimal shift after %d tries :("%(counter+1))
     
     myLogger.debug("Total time taken (s): %.2f"%(time.time()-time0))
     
+    return done
+    
     
 if __name__ == '__main__':
     
@@ -158,11 +439,17 @@ if __name__ == '__main__':
     parser.add_argument('--noplots',help='do not generate plots',default=False,action='store_true')
     parser.add_argument('--allplots',help='save all plots',default=False,action='store_true')
     parser.add_argument('--logfile',help='logfile to save output to')
+    parser.add_argument('--native',help='solve the model in-process instead of running sxdefectalign2d',
+                        default=False,action='store_true')
+    parser.add_argument('--sxfile',help='SPHInX input file',default='system.sx')
+    parser.add_argument('--nscan',type=int,default=0,
+                        help='no. of shifts to scan at once before the search (native solver only)')
        
     ## read in the above arguments from command line
     args = parser.parse_args()
     
     calc(args.vref, args.vdef, args.encut, args.q, 
          args.threshold_slope, args.threshold_C, args.max_iter,
-         args.vfile, args.noplots, args.allplots, args.logfile) 
+         args.vfile, args.noplots, args.allplots, args.logfile,
+         'native' if args.native else 'sxdefectalign2d', args.sxfile, nscan=args.nscan) 
     
\ No newline at end of file
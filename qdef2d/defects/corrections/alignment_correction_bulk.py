@@ -0,0 +1,209 @@
+import os
+import json
+import argparse
+import subprocess
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from qdef2d import logging
+from qdef2d.io import compressed
+from qdef2d.defects.corrections import apply_corrections_2d, sxdefectalign_output
+
+
+## profiles along each lattice vector, as written by sxdefectalign
+VFILES = ['vline-eV-a0.dat', 'vline-eV-a1.dat', 'vline-eV-a2.dat']
+
+
+def plateau_averages(profiles, defpos, width=1.):
+
+    """
+    Alignment constants from the plateau of the short-range potential
+    V_def - V_bulk - V^LR along each lattice vector, i.e. its average within
+    a given distance of the point farthest away from the defect, for all axes at once.
+
+    Parameters
+    ----------
+    profiles (list of arrays): potential profiles along each lattice vector
+                               (columns x (bohr), V^LR, V_def - V_bulk - V^LR, ...)
+    defpos (array): position of the defect (relative coords)
+    [optional] width (float): half-width of the plateau (bohr). Default=1.
+
+    Returns
+    -------
+    (array) Alignment constant along each lattice vector (eV).
+
+    """
+
+    ## pad the profiles to the same length so that all axes are treated together
+    n = max(len(data) for data in profiles)
+    x = np.full((len(profiles),n), np.nan)
+    v = np.full((len(profiles),n), np.nan)
+    for i,data in enumerate(profiles):
+        x[i,:len(data)], v[i,:len(data)] = data[:,0], data[:,2]
+
+    L = np.array([data[-1,0] for data in profiles])
+    plat_pos = (np.asarray(defpos, dtype=float) + 0.5) % 1 * L
+    mask = np.abs(x - plat_pos[:,None]) < width
+
+    return np.sum(np.where(mask, v, 0.), axis=1) / np.sum(mask, axis=1)
+
+
+def _defect_position(folder):
+
+    ## average position of the defect site(s) in relative coords
+    with open(os.path.join(folder,"defectproperty.json"), 'r') as file:
+        defprop = json.loads(file.read())
+
+    return np.mean(defprop["defect_site"], axis=0)
+
+
+def calc(vref, vdef, encut, q, eps, defpos, dir_corr=None, width=1., logfile=None):
+
+    """
+    Estimate the alignment correction of a charged defect in a bulk (3D) cell with sxdefectalign,
+    and evaluate the correction with it.
+    sxdefectalign is run once to get the potential profiles along each lattice vector,
+    the alignment constant is averaged over the plateaus of the three profiles,
+    and sxdefectalign is run again with it, writing the correction file.
+
+    Parameters
+    ----------
+    vref (str): path to bulk LOCPOT file (may be compressed)
+    vdef (str): path to defect LOCPOT file (may be compressed)
+    encut (int): cutoff energy (eV)
+    q (int): charge (conventional units)
+    eps (float): dielectric constant
+    defpos (array): position of the defect (relative coords)
+    [optional] dir_corr (str): directory to run the correction in. Default=current working directory.
+    [optional] width (float): half-width of the plateaus (bohr). Default=1.
+    [optional] logfile (str): logfile (in dir_corr) to save output to
+
+    Returns
+    -------
+    (float) Averaged alignment constant (eV).
+
+    """
+
+    if dir_corr is None:
+        dir_corr = os.getcwd()
+    vref, vdef = os.path.abspath(vref), os.path.abspath(vdef)
+
+    ## set up logging
+    if logfile:
+        logfile = os.path.join(dir_corr,logfile)
+        myLogger = logging.setup_logging(logfile)
+    else:
+        myLogger = logging.setup_logging()
+
+
+    ## sxdefectalign can't read compressed LOCPOTs either
+    with compressed.uncompressed(vref,dir_corr) as vref, \
+         compressed.uncompressed(vdef,dir_corr) as vdef:
+
+        ## the charge is given in units of -e, as in system.sx for the 2D case
+        command = [os.path.expanduser('~/sxdefectalign'), '--vasp',
+                   '--ecut', str(encut/13.6057), ## convert eV to Ry
+                   '--charge', str(-q),
+                   '--eps', str(eps),
+                   '--center', ','.join([str(x) for x in defpos]), '--relative',
+                   '--vref', vref,
+                   '--vdef', vdef]
+
+        ## first run to get the potential profiles
+        with open(logfile if logfile else os.devnull, 'a') as f:
+            subprocess.run(command, cwd=dir_corr, stdout=f, stderr=subprocess.STDOUT, check=True)
+
+        profiles = [sxdefectalign_output.read_vline(os.path.join(dir_corr,vfile))
+                    for vfile in VFILES]
+        C = plateau_averages(profiles, defpos, width)
+        C_ave = np.mean(C)
+        myLogger.info("alignment correction along a0, a1, a2: %.8f %.8f %.8f"%tuple(C))
+        myLogger.info("averaged alignment correction: %.8f"%C_ave)
+
+        ## run again with -C <C_ave> > correction
+        with open(os.path.join(dir_corr,'correction'), 'w') as f:
+            subprocess.run(command + ['-C', str(C_ave)], cwd=dir_corr, stdout=f, check=True)
+
+    return C_ave
+
+
+def _apply(task):
+
+    ## apply the correction for a single calculation and report how it went
+    try:
+        dir_corr = os.path.join(task["folder"],'correction')
+        if not os.path.exists(dir_corr):
+            os.makedirs(dir_corr)
+        calc(task["locpot_ref"], task["locpot"], task["encut"], task["q"], task["eps"],
+             _defect_position(task["folder"]), dir_corr, task["width"], logfile='getalign.log')
+        return "done"
+
+    except Exception as err:
+        return "failed: %s"%err
+
+
+def apply_all(dir_def, dir_ref, eps, encut=520, soc=False, width=1., nprocs=1, logfile=None):
+
+    """
+    Apply the sxdefectalign correction to all charged defect calculations in bulk (3D) cells.
+    The results are written to the correction file of each calculation,
+    where parse_corrections picks them up in the same way as the 2D corrections.
+
+    Parameters
+    ----------
+    dir_def (str): path to the main defect directory
+    dir_ref (str): path to the pristine reference directory
+    eps (float): dielectric constant
+    [optional] encut (int): cutoff energy (eV). Default=520.
+    [optional] soc (bool): whether or not to look in soc(dos) subdirectory. Default=False.
+    [optional] width (float): half-width of the plateaus (bohr). Default=1.
+    [optional] nprocs (int): no. of corrections to run in parallel. Default=1.
+    [optional] logfile (str): logfile to save output to
+
+    Returns
+    -------
+    (DataFrame) Status of the correction of each charged defect calculation,
+                with the columns charge, supercell, vacuum, status
+
+    """
+
+    ## set up logging
+    if logfile:
+        myLogger = logging.setup_logging(logfile)
+    else:
+        myLogger = logging.setup_logging()
+
+
+    tasks, statuses = apply_corrections_2d.collect_tasks(dir_def,dir_ref,soc,myLogger)
+    for task in tasks:
+        task.update({"eps": eps, "encut": encut, "width": width})
+
+    with ProcessPoolExecutor(max_workers=nprocs) as executor:
+        results = list(executor.map(_apply, tasks))
+
+    return apply_corrections_2d.status_table(statuses,results,myLogger)
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Apply sxdefectalign correction \
+                                     to all charged defect calculations in bulk cells.')
+    parser.add_argument('dir_def', help='path to the main defect directory')
+    parser.add_argument('dir_ref', help='path to the pristine reference directory')
+    parser.add_argument('eps', type=float, help='dielectric constant')
+    parser.add_argument('--encut', type=int, default=520, help='cutoff energy (eV)')
+    parser.add_argument('--soc', default=False,action='store_true',
+                        help='whether or not to look in soc(dos) subdirectory')
+    parser.add_argument('--width', type=float, default=1.,
+                        help='half-width of the plateaus (bohr)')
+    parser.add_argument('--nprocs', type=int, default=1,
+                        help='no. of corrections to run in parallel')
+    parser.add_argument('--logfile', help='logfile to save output to')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    apply_all(args.dir_def, args.dir_ref, args.eps, args.encut, args.soc,
+              args.width, args.nprocs, args.logfile)
+
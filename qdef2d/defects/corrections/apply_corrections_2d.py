@@ -1,16 +1,23 @@
 import os
-import json
 import errno
 import argparse
-from qdef2d import osutils, logging
-from qdef2d.defects.corrections import SPHInX_input_file, alignment_correction_2d
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from qdef2d import campaign, logging
+from qdef2d.io.vasp import locpot
+from qdef2d.io.database import local_database
+from qdef2d.defects.corrections import SPHInX_input_file, alignment_correction_2d, plot_alignment
 
 
 def apply_all(dir_def,dir_ref,eps_slab=None,d_slab=None,dbentry=None,
-              functional="GGA",encut=520,soc=False,logfile=None):
+              functional="GGA",encut=520,soc=False,native=False,nscan=0,nprocs=1,plots=True,
+              logfile=None):
     
     """
     Apply sxdefectalign2d correction to all charged defect calulations.
+    Calculations with missing input files are skipped (and reported),
+    and a failure in one correction doesn't stop the others.
     
     dir_def (str): path to the main defect directory
     dir_ref (str): path to the pristine reference directory
@@ -21,8 +28,24 @@ def apply_all(dir_def,dir_ref,eps_slab=None,d_slab=None,dbentry=None,
     [optional] functionl (str): functional used for this set of calculations. Default=GGA.
     [optional] encut (int): cutoff energy (eV). Default=520.
     [optional] soc (bool): whether or not to look in soc(dos) subdirectory. Default=False.
+    [optional] native (bool): solve the model in-process instead of running sxdefectalign2d.
+                              Default=False.
+    [optional] nscan (int): with the native solver, first evaluate this many shifts
+                            across the initial bracket of each alignment all at once,
+                            and start the search from the root of the scan
+                            (see alignment_correction_2d.calc). Default=0 (no scan).
+    [optional] nprocs (int): no. of corrections to run in parallel. Default=1.
+    [optional] plots (bool): plot the potential profiles of every alignment iteration
+                             once all the corrections are done. Default=True.
+                             The profiles are saved either way, and can be plotted 
+                             later with plot_alignment.
     [optional] logfile (str): logfile to save output to                              
 
+    Returns
+    -------
+    (DataFrame) Status of the correction of each charged defect calculation,
+                with the columns charge, supercell, vacuum, status
+    
     """
     
     ## set up logging
@@ -40,62 +63,190 @@ def apply_all(dir_def,dir_ref,eps_slab=None,d_slab=None,dbentry=None,
         ## extract the eps_slab and d_slab from the relevant dbentry file
         if os.path.exists(dbentry):
             myLogger.info("Using slab properties from " + dbentry)
-            with open(dbentry, 'r') as file:
-                mater = json.loads(file.read())
-                eps_slab = mater[functional]["eps_ave"]
-                d_slab = mater[functional]["d_slab"]
-                myLogger.info("eps_slab: %.2f ; d_slab: %.2f"%(eps_slab,d_slab))
+            db = local_database.load(os.path.dirname(os.path.abspath(dbentry)))
+            system = os.path.splitext(os.path.basename(dbentry))[0]
+            eps_slab, d_slab = db.get_slab(system, functional)
+            myLogger.info("eps_slab: %.2f ; d_slab: %.2f"%(eps_slab,d_slab))
         else:
             ## if can't find a dbentry file
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), dbentry)
             
     else:
-        myLogger.info("Insufficient information provided about the slab dielectric profile")
-
-
-    qs = osutils.listdironly(dir_def)
-    for q in [qi for qi in qs if qi != 'charge_0']:      
-        for cell in osutils.listdironly(os.path.join(dir_def,q,'')):
-            for vac in osutils.listdironly(os.path.join(dir_def,q,cell,'')):
-                folder = os.path.join(dir_def,q,cell,vac,'')
-                folder_ref = os.path.join(dir_ref,'charge_0',cell,vac,'')
-
-                if soc:  
-                    folder = os.path.join(folder,'dos','')
-                    folder_ref = os.path.join(folder_ref,'dos','')
-                if os.path.exists(folder) and 'restart' in osutils.listdironly(folder):
-                    folder = os.path.join(folder,'restart','')
-                
-                ## check if defectproperty.json file is present in current directory
-                if not os.path.exists(os.path.join(folder,'defectproperty.json')):
-                    raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), 
-                                            os.path.join(folder,'defectproperty.json'))
-                    
-                else:
-                    os.chdir(folder)
-                    ## generate SPHInX input file
-                    SPHInX_input_file.generate(eps_slab,d_slab)
-                    
-                    if (os.path.exists(os.path.join(folder,'LOCPOT')) and 
-                        os.path.exists(os.path.join(folder_ref,'LOCPOT'))):
-                        
-                        os.chdir(os.path.join(folder,'correction'))
-                        myLogger.info("applying correction to calculations in %s"%folder) 
-                        
-                        ## apply correction
-                        alignment_correction_2d.calc(os.path.join(folder_ref,'LOCPOT'),
-                                                     os.path.join(folder,'LOCPOT'),
-                                                     encut, int(q.split('_')[-1]),
-                                                     allplots=True, logfile='getalign.log')
-    
-                    elif not os.path.exists(os.path.join(folder,'LOCPOT')):
-                        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), 
-                                                os.path.join(folder,'LOCPOT'))
-
-                        
-                    elif not os.path.exists(os.path.join(folder_ref,'LOCPOT')):
-                        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), 
-                                                os.path.join(folder_ref,'LOCPOT'))   
+        ## the SPHInX input files can't be generated without them
+        raise ValueError("insufficient information provided about the slab dielectric profile: "
+                         "supply either eps_slab and d_slab, or dbentry")
+
+
+    if nscan > 1 and not native:
+        myLogger.warning("the shift scan only works with the native solver, nscan is ignored")
+
+    ## collect all the corrections to apply
+    manifest_def = campaign.index(dir_def)
+    tasks, statuses = collect_tasks(dir_def,dir_ref,soc,myLogger,manifest_def)
+    
+    ## generate all the SPHInX input files in one pass, before any of the corrections are run
+    generated = SPHInX_input_file.generate_all(manifest_def,eps_slab,d_slab,soc)
+    counts = list(generated.values())
+    myLogger.info("SPHInX input files: %d written, %d unchanged"
+                  %(counts.count("written"),counts.count("unchanged")))
+    for task in tasks:
+        task.update({"encut": encut,
+                     "solver": 'native' if native else 'sxdefectalign2d',
+                     "nscan": nscan})
+    
+    ## start each alignment from the converged shift of the nearest calculation
+    ## that has already been done (including an earlier run of the same one)
+    done = []
+    for task in tasks:
+        state = alignment_correction_2d.load_state(os.path.join(task["folder"],'correction'))
+        if state and state["converged"]:
+            done.append((task["q"],task["supercell"],task["vacuum"],state["shift"]))
+    for task in tasks:
+        task["guess"] = _nearest(done,task["q"],task["supercell"],task["vacuum"])
+        task["sxstatus"] = generated.get(task["folder"],"failed: no SPHInX input file")
+    
+    
+    ## each correction runs in its own correction subdirectory, in a bounded pool of processes;
+    ## with the native solver, every bulk reference is read once and shared between the processes
+    shared = None
+    if native and tasks:
+        shared = locpot.SharedAverages([task["locpot_ref"] for task in tasks])
+    try:
+        with ProcessPoolExecutor(max_workers=nprocs,
+                                 initializer=locpot.attach if shared else None,
+                                 initargs=(shared.handle,) if shared else ()) as executor:
+            results = list(executor.map(_apply, tasks))
+    finally:
+        if shared:
+            shared.close()
+    
+    if plots and tasks:
+        plot_alignment.render_all([os.path.join(task["folder"],'correction') for task in tasks],
+                                  nprocs)
+    
+    return status_table(statuses,results,myLogger)
+
+
+def collect_tasks(dir_def,dir_ref,soc,myLogger,manifest_def=None):
+    
+    """
+    Collect the charged defect calculations to correct, together with their bulk references.
+    Anything missing is recorded against its calculation instead of stopping the whole sweep.
+    
+    Parameters
+    ----------
+    dir_def (str): path to the main defect directory
+    dir_ref (str): path to the pristine reference directory
+    soc (bool): whether or not to look in soc(dos) subdirectory
+    myLogger (Logger): logger to report missing files to
+    [optional] manifest_def (Manifest): index of dir_def, if it has been indexed already
+    
+    Returns
+    -------
+    (list of dict) One task per calculation that can be corrected, with the keys
+                   q, supercell, vacuum, folder, locpot, locpot_ref
+    (list of dict) Status of every charged calculation, with the keys
+                   charge, supercell, vacuum and, for those that can't be corrected, status
+    
+    """
+    
+    ## index the defect and reference directory trees;
+    ## the corrections for soc are applied in the dos subdirectories
+    variant = 'dos' if soc else None
+    if manifest_def is None:
+        manifest_def = campaign.index(dir_def)
+    manifest_ref = campaign.index(dir_ref)
+    
+    tasks, statuses = [], []
+    for leaf in [l for l in manifest_def.leaves() if l.charge != 0]:
+        q, cell, vac = leaf.charge, leaf.supercell, leaf.vacuum
+        leaf_def = campaign.get_leaf(manifest_def,q,cell,vac,variant,myLogger)
+        leaf_ref = campaign.get_leaf(manifest_ref,0,cell,vac,variant,myLogger)
+        status = {"charge": q, "supercell": cell, "vacuum": vac}
+        
+        if leaf_def is None:
+            status["status"] = "missing " + leaf.base
+        elif not leaf_def.has('defectproperty.json'):
+            status["status"] = "missing " + os.path.join(leaf_def.path,'defectproperty.json')
+        elif not leaf_def.find('LOCPOT'):
+            status["status"] = "missing " + os.path.join(leaf_def.path,'LOCPOT')
+        elif leaf_ref is None or not leaf_ref.find('LOCPOT'):
+            status["status"] = "missing " + os.path.join(dir_ref,'charge_0',cell,vac or '','LOCPOT')
+        else:
+            tasks.append({"q": q, "supercell": cell, "vacuum": vac, "folder": leaf_def.path,
+                          "locpot": leaf_def.find('LOCPOT'), "locpot_ref": leaf_ref.find('LOCPOT')})
+            
+        if "status" in status:
+            myLogger.warning("skipping charge_%d/%s/%s: %s"%(q,cell,vac,status["status"]))
+        statuses.append(status)
+    
+    return tasks, statuses
+
+
+def status_table(statuses,results,myLogger):
+    
+    """
+    Combine the statuses from collect_tasks() with the results of the tasks.
+    
+    Parameters
+    ----------
+    statuses (list of dict): statuses as returned by collect_tasks()
+    results (list of str): status of each task, in the same order as the tasks
+    myLogger (Logger): logger to report the statuses to
+    
+    Returns
+    -------
+    (DataFrame) with the columns charge, supercell, vacuum, status
+    
+    """
+    
+    results = iter(results)
+    for status in [status for status in statuses if "status" not in status]:
+        status["status"] = next(results)
+    statuses = pd.DataFrame(statuses, columns=["charge","supercell","vacuum","status"])
+    
+    for row in statuses.itertuples():
+        myLogger.info("charge_%d/%s/%s: %s"%(row.charge,row.supercell,row.vacuum,row.status))
+    
+    return statuses
+
+
+def _nearest(done, q, cell, vac):
+    
+    ## converged shift of the closest calculation: 
+    ## the same charge state if possible, then the closest supercell size and vacuum spacing
+    if not done:
+        return None
+    size = lambda cell: np.prod([int(n) for n in cell.split('x')])
+    spacing = lambda vac: float(vac.split('_')[-1])
+    def vac_dist(vac2):
+        ## bulk calculations have no vacuum level
+        if vac is None or vac2 is None:
+            return 0. if vac == vac2 else np.inf
+        return abs(np.log(spacing(vac2)/spacing(vac)))
+    dist = [(q2 != q, abs(np.log(size(cell2)/size(cell))) + vac_dist(vac2))
+            for q2,cell2,vac2,shift in done]
+    
+    return done[min(range(len(done)), key=lambda i: dist[i])][3]
+
+
+def _apply(task):
+    
+    ## apply the correction for a single calculation and report how it went
+    folder = task["folder"]
+    if task["sxstatus"].startswith("failed"):
+        return task["sxstatus"]
+    try:
+        done = alignment_correction_2d.calc(task["locpot_ref"],task["locpot"],
+                                            task["encut"],task["q"],
+                                            allplots=True, render=False, logfile='getalign.log',
+                                            solver=task["solver"],
+                                            dir_corr=os.path.join(folder,'correction'),
+                                            guess=task["guess"], nscan=task["nscan"])
+        return "done" if done else "not converged"
+    
+    except Exception as err:
+        return "failed: %s"%err
                     
 
 if __name__ == '__main__':
@@ -117,11 +268,20 @@ if __name__ == '__main__':
     parser.add_argument('--encut', type=int, default=520, help='cutoff energy (eV)')
     parser.add_argument('--soc', default=False,action='store_true',
                         help='whether or not to look in soc(dos) subdirectory')
+    parser.add_argument('--native', default=False,action='store_true',
+                        help='solve the model in-process instead of running sxdefectalign2d')
+    parser.add_argument('--nscan', type=int, default=0,
+                        help='with --native, scan this many shifts at once before the search')
+    parser.add_argument('--nprocs', type=int, default=1,
+                        help='no. of corrections to run in parallel')
+    parser.add_argument('--noplots', default=False,action='store_true',
+                        help='only save the potential profiles, do not plot them')
     parser.add_argument('--logfile', help='logfile to save output to')
        
     ## read in the above arguments from command line
     args = parser.parse_args()
     
     apply_all(args.dir_def, args.dir_ref, args.eps_slab, args.d_slab, args.dbentry,
-              args.functional, args.encut, args.soc, args.logfile)
+              args.functional, args.encut, args.soc, args.native, args.nscan, args.nprocs,
+              not args.noplots, args.logfile)
 
@@ -0,0 +1,470 @@
+import re
+import ast
+import argparse
+import numpy as np
+from scipy.special import erf
+from qdef2d.io.vasp import locpot
+from qdef2d.defects.corrections.SPHInX_input_file import Ang_to_bohr
+
+
+## Hartree to eV
+HARTREE = 27.211386
+## Rydberg to eV
+RYDBERG = 13.6057
+
+re_group = re.compile(r'(\w+)\s*\{([^{}]*)\}')
+re_value = re.compile(r'(\w+)\s*=\s*([^;]+);')
+
+
+def read_system(sxfile):
+
+    """
+    Read the model parameters from a SPHInX input file (as written by SPHInX_input_file.generate).
+
+    Parameters
+    ----------
+    sxfile (str): path to the system.sx file
+
+    Returns
+    -------
+    (dict) with the keys
+           cell (array): lattice vectors (bohr), shape (3,3)
+           slabs (list of tuples): (fromZ, toZ, epsilon) of each slab (bohr)
+           posZ (float): position of the charge along z (bohr)
+           Q (float): model charge (no. of excess electrons, i.e. -q)
+           isolated (tuple): (fromZ, toZ) of the isolated region (bohr)
+
+    """
+
+    with open(sxfile, 'r') as f:
+        s = f.read()
+
+    system = {"slabs": []}
+    for name,body in re_group.findall(s):
+        values = dict(re_value.findall(body))
+        if name == 'structure':
+            ## the cell is written as a (nested) python list
+            system["cell"] = np.array(ast.literal_eval(values['cell'].strip()), dtype=float)
+        elif name == 'slab':
+            system["slabs"].append((float(values['fromZ']), float(values['toZ']),
+                                    float(values['epsilon'])))
+        elif name == 'charge':
+            system["posZ"] = float(values['posZ'])
+            system["Q"] = float(values['Q'])
+        elif name == 'isolated':
+            system["isolated"] = (float(values['fromZ']), float(values['toZ']))
+
+    return system
+
+
+def _thomas(a, b, c, d):
+
+    ## solve a batch of tridiagonal systems (sub-diagonal a, diagonal b, super-diagonal c)
+    ## along the last axis, all at once
+    n = d.shape[-1]
+    cp = np.empty(np.broadcast(a, b, c, d).shape)
+    dp = np.empty(cp.shape)
+    a, b, c, d = [np.broadcast_to(x, cp.shape) for x in (a, b, c, d)]
+    cp[...,0] = c[...,0]/b[...,0]
+    dp[...,0] = d[...,0]/b[...,0]
+    for i in range(1, n):
+        denom = b[...,i] - a[...,i]*cp[...,i-1]
+        cp[...,i] = c[...,i]/denom
+        dp[...,i] = (d[...,i] - a[...,i]*dp[...,i-1])/denom
+    x = np.empty(cp.shape)
+    x[...,-1] = dp[...,-1]
+    for i in range(n-2, -1, -1):
+        x[...,i] = dp[...,i] - cp[...,i]*x[...,i+1]
+
+    return x
+
+
+def _cyclic_thomas(a, b, c, d):
+
+    ## periodic tridiagonal systems, where a[0] and c[-1] couple the first and last points,
+    ## via the Sherman-Morrison formula on top of two ordinary tridiagonal solves
+    gamma = -b[...,:1]
+    bb = np.array(np.broadcast_to(b, np.broadcast(a, b, c, d).shape))
+    bb[...,0] -= gamma[...,0]
+    bb[...,-1] -= c[...,-1]*a[...,0]/gamma[...,0]
+    u = np.zeros(bb.shape)
+    u[...,0] = gamma[...,0]
+    u[...,-1] = c[...,-1]
+    x = _thomas(a, bb, c, np.stack(np.broadcast_arrays(d, u)))
+    y, z = x[0], x[1]
+    fact = ((y[...,0] + a[...,0]*y[...,-1]/gamma[...,0]) /
+            (1. + z[...,0] + a[...,0]*z[...,-1]/gamma[...,0]))
+
+    return y - fact[...,None]*z
+
+
+def _inplane_G(cell, Gmax):
+
+    ## in-plane reciprocal lattice vectors within the cutoff;
+    ## the potential only depends on |G|, so only the distinct |G| are solved for
+    recip = 2*np.pi*np.linalg.inv(cell).T
+    nmax = [int(Gmax*np.linalg.norm(a)/(2*np.pi)) + 1 for a in cell]
+    n1, n2 = np.meshgrid(np.arange(-nmax[0],nmax[0]+1), np.arange(-nmax[1],nmax[1]+1))
+    G = np.linalg.norm(np.outer(n1.ravel(),recip[0]) + np.outer(n2.ravel(),recip[1]), axis=1)
+    G = G[(G > 0) & (G <= Gmax)]
+
+    return np.unique(np.round(G, 10), return_counts=True)
+
+
+class GaussianModel2D(object):
+
+    """
+    Gaussian model charge in a slab dielectric profile, as in sxdefectalign2d
+    (Freysoldt & Neugebauer, Phys. Rev. B 97, 205425 (2018)),
+    solved in-process. Atomic units (bohr, Hartree) are used internally.
+    The potential is expanded in in-plane plane waves; for every in-plane wavevector
+    the remaining 1D Poisson equation along z
+    d/dz (eps(z) dV/dz) - eps(z) G^2 V = -4 pi rho(G,z)
+    is discretized with finite differences and solved for all wavevectors at once.
+    The periodic model uses cyclic boundary conditions along z and a compensating background;
+    the isolated model is embedded in vacuum along z (exact exponential decay outside the cell)
+    and integrated over in-plane wavevectors with Gauss-Legendre quadrature.
+    The potentials are potential energies for electrons (as in LOCPOT), and
+    Q is the no. of excess electrons (-q).
+
+    Parameters
+    ----------
+    cell (array): lattice vectors (bohr), shape (3,3), with the third one along z
+    slabs (list of tuples): (fromZ, toZ, epsilon) of each slab (bohr),
+                            or (fromZ, toZ, eps_parallel, eps_perpendicular) for an anisotropic slab
+    posZ (float): position of the charge along z (bohr)
+    Q (float): model charge (no. of excess electrons, i.e. -q)
+    encut (float): cutoff energy (eV)
+    [optional] beta (float): width of the Gaussian charge (bohr). Default=1.
+    [optional] smoothing (float): width over which the slab boundaries are smoothed (bohr). Default=0.5.
+    [optional] dz (float): max. grid spacing along z (bohr). Default=0.1.
+    [optional] nk (int): no. of quadrature points for the isolated model. Default=200.
+
+    """
+
+    def __init__(self, cell, slabs, posZ, Q, encut, beta=1., smoothing=0.5, dz=0.1, nk=200):
+
+        self.cell = np.asarray(cell, dtype=float)
+        self.slabs = slabs
+        self.posZ = posZ
+        self.Q = Q
+        self.beta = beta
+        self.smoothing = smoothing
+
+        ## z grid covering the cell
+        self.L = self.cell[2,2]
+        self.nz = int(np.ceil(self.L/dz))
+        self.h = self.L/self.nz
+        self.z = np.arange(self.nz)*self.h
+        ## the out-of-plane component enters the derivatives along z,
+        ## the in-plane component the G^2 terms
+        self.eps = self.epsilon(self.z, 'perp')
+        self.eps_half = self.epsilon(self.z + self.h/2, 'perp')
+        self.eps_par = self.epsilon(self.z, 'par')
+
+        ## in-plane reciprocal lattice vectors within the cutoff
+        self.area = abs(np.linalg.det(self.cell[:2,:2]))
+        self.Gmax = np.sqrt(encut/RYDBERG)
+        self.G, self.G_mult = _inplane_G(self.cell[:2,:2], self.Gmax)
+
+        ## Gauss-Legendre quadrature over |k| for the isolated model
+        x, w = np.polynomial.legendre.leggauss(nk)
+        self.k = 0.5*self.Gmax*(x + 1)
+        self.k_weights = 0.5*self.Gmax*w
+
+        return
+
+
+    @classmethod
+    def from_sphinx(cls, sxfile, encut, **kwargs):
+
+        """
+        Set up the model from a SPHInX input file (as written by SPHInX_input_file.generate),
+        i.e. from exactly the same inputs as sxdefectalign2d.
+
+        """
+
+        system = read_system(sxfile)
+
+        return cls(system["cell"], system["slabs"], system["posZ"], system["Q"], encut, **kwargs)
+
+
+    def epsilon(self, z, component='perp'):
+
+        ## dielectric profile: vacuum plus smoothed slabs;
+        ## component is 'par' (in-plane) or 'perp' (out-of-plane)
+        eps = np.ones_like(z)
+        for slab in self.slabs:
+            fromZ, toZ = slab[:2]
+            eps_slab = slab[2] if len(slab) == 3 or component == 'par' else slab[3]
+            eps += (eps_slab-1) * 0.5*(erf((z-fromZ)/self.smoothing) - erf((z-toZ)/self.smoothing))
+        return eps
+
+
+    def _gaussian_z(self, shift, periodic):
+
+        ## normalized Gaussian along z, using the nearest periodic image in the periodic model;
+        ## an array of shifts gives one Gaussian per shift
+        dz = self.z - (self.posZ + np.asarray(shift, dtype=float)[...,None])
+        if periodic:
+            dz -= self.L*np.round(dz/self.L)
+        return np.exp(-dz**2/(2*self.beta**2)) / (np.sqrt(2*np.pi)*self.beta)
+
+
+    def _operator(self, G):
+
+        ## finite-difference coefficients of d/dz (eps d/dz) - eps G^2 for every G
+        a = np.roll(self.eps_half, 1)/self.h**2
+        c = self.eps_half/self.h**2
+        b = -(a + c) - self.eps_par*np.asarray(G)[:,None]**2
+
+        return np.broadcast_to(a, b.shape), b, np.broadcast_to(c, b.shape)
+
+
+    def _potential_G0(self, rho):
+
+        ## the G=0 (planar average) part of the periodic model is integrated exactly:
+        ## eps dV/dz = -4 pi int rho dz + C, with C such that V is periodic
+        ## (for every row of rho at once)
+        rho = rho - np.mean(rho, axis=-1, keepdims=True)
+        Qcum = np.cumsum(rho, axis=-1)*self.h
+        C = 4*np.pi*np.sum(Qcum/self.eps_half, axis=-1, keepdims=True)/np.sum(1/self.eps_half)
+        V = np.cumsum((-4*np.pi*Qcum + C)/self.eps_half, axis=-1)*self.h
+        V = np.roll(V, 1, axis=-1)
+        V[...,0] = 0.
+
+        return V - np.mean(V, axis=-1, keepdims=True)
+
+
+    def potential(self, shift=0.):
+
+        """
+        Planar-averaged potential of the periodic model.
+
+        Parameters
+        ----------
+        [optional] shift (float or array): shift(s) of the charge along z (bohr). Default=0.
+
+        Returns
+        -------
+        (array) z (bohr)
+        (array) potential energy for electrons (eV), shape shift.shape + z.shape
+
+        """
+
+        rho = self.Q*self._gaussian_z(shift, periodic=True)
+        return self.z, self._potential_G0(rho)/self.area*HARTREE
+
+
+    def energy_periodic(self, shift=0.):
+
+        """
+        Electrostatic energy of the periodic model (eV).
+
+        """
+
+        gz = self._gaussian_z(shift, periodic=True)
+        rho = self.Q*gz
+        E = 0.5*np.sum(rho*self._potential_G0(rho))*self.h
+
+        ## every other in-plane wavevector, with cyclic boundary conditions along z
+        rho_G = self.Q*np.exp(-0.5*self.beta**2*self.G**2)[:,None]*gz[None,:]
+        a, b, c = self._operator(self.G)
+        V_G = _cyclic_thomas(a, b, c, -4*np.pi*rho_G)
+        E += 0.5*np.sum(self.G_mult[:,None]*rho_G*V_G)*self.h
+
+        return E/self.area*HARTREE
+
+
+    def energy_periodic_supercells(self, ns, shift=0.):
+
+        """
+        Electrostatic energy of the periodic model (eV) in in-plane supercells of the model cell,
+        for all the supercells at once: the wavevectors of every supercell
+        are solved for in a single batch.
+
+        Parameters
+        ----------
+        ns (array): in-plane supercell sizes [n1,n2], shape (n_cells, 2)
+        [optional] shift (float): shift of the charge along z (bohr). Default=0.
+
+        Returns
+        -------
+        (array) Energy of the periodic model in each supercell, shape (n_cells,)
+
+        """
+
+        ns = np.atleast_2d(np.asarray(ns, dtype=int))
+        gz = self._gaussian_z(shift, periodic=True)
+        rho = self.Q*gz
+        E0 = 0.5*np.sum(rho*self._potential_G0(rho))*self.h
+
+        G, G_mult, index = [], [], []
+        for i,(n1,n2) in enumerate(ns):
+            Gi, mult = _inplane_G(self.cell[:2,:2]*np.array([[n1],[n2]]), self.Gmax)
+            G.append(Gi)
+            G_mult.append(mult)
+            index.append(np.full(len(Gi), i))
+        G, G_mult, index = np.concatenate(G), np.concatenate(G_mult), np.concatenate(index)
+
+        rho_G = self.Q*np.exp(-0.5*self.beta**2*G**2)[:,None]*gz[None,:]
+        a, b, c = self._operator(G)
+        V_G = _cyclic_thomas(a, b, c, -4*np.pi*rho_G)
+        E_G = np.bincount(index, 0.5*G_mult*np.sum(rho_G*V_G, axis=1)*self.h, minlength=len(ns))
+
+        return (E0 + E_G)/(self.area*np.prod(ns, axis=1))*HARTREE
+
+
+    def energy_isolated(self, shift=0.):
+
+        """
+        Electrostatic energy of the isolated model (eV).
+
+        """
+
+        gz = self._gaussian_z(shift, periodic=False)
+        rho_k = self.Q*np.exp(-0.5*self.beta**2*self.k**2)[:,None]*gz[None,:]
+
+        ## outside the cell there is only vacuum, where V ~ exp(-k|z|),
+        ## so the ghost points beyond either end are fixed exactly
+        a, b, c = self._operator(self.k)
+        b = b.copy()
+        decay = np.exp(-self.k*self.h)
+        b[:,0] += a[:,0]*decay
+        b[:,-1] += c[:,-1]*decay
+        a, c = a.copy(), c.copy()
+        a[:,0] = 0.
+        c[:,-1] = 0.
+        V_k = _thomas(a, b, c, -4*np.pi*rho_k)
+
+        E = np.sum(self.k_weights*self.k*np.sum(rho_k*V_k, axis=1))*self.h/(4*np.pi)
+
+        return E*HARTREE
+
+
+    def profile(self, shift, z, dV):
+
+        """
+        Compare the model potential with the DFT potential difference.
+
+        Parameters
+        ----------
+        shift (float): shift of the charge along z (bohr)
+        z (array): z positions of the DFT potential (bohr)
+        dV (array): planar-averaged DFT potential difference V_def - V_bulk (eV)
+
+        Returns
+        -------
+        (array) columns z, V_model, dV, dV - V_model, as in the vline-eV.dat file
+                written by sxdefectalign2d
+
+        """
+
+        V_model = self.model_on_grid(shift, z)
+
+        return np.column_stack([z, V_model, dV, dV-V_model])
+
+
+    def model_on_grid(self, shift, z):
+
+        """
+        Planar-averaged potential of the periodic model, interpolated onto the DFT grid.
+
+        Parameters
+        ----------
+        shift (float or array): shift(s) of the charge along z (bohr)
+        z (array): z positions of the DFT potential (bohr)
+
+        Returns
+        -------
+        (array) potential energy for electrons (eV), shape shift.shape + z.shape
+
+        """
+
+        zm, Vm = self.potential(shift)
+
+        ## linear interpolation with the same weights for every shift
+        x = np.mod(z, self.L)/self.h
+        i = np.floor(x).astype(int)
+        w = x - i
+
+        return (1-w)*Vm[...,i % self.nz] + w*Vm[...,(i+1) % self.nz]
+
+
+    def write_correction(self, shift, C, q, filename='correction'):
+
+        """
+        Evaluate the correction energy and write it to a file
+        in the same format as the sxdefectalign2d output,
+        i.e. with the total correction on the line starting with 'iso - periodic energy'.
+
+        Parameters
+        ----------
+        shift (float): shift of the charge along z (bohr)
+        C (float): alignment constant, the average of dV - V_model in the vacuum (eV)
+        q (int): charge (conventional units)
+        [optional] filename (str): file to write to. Default='correction'.
+
+        Returns
+        -------
+        (float) The correction energy E_iso - E_per + q*C (eV).
+
+        """
+
+        E_iso = self.energy_isolated(shift)
+        E_per = self.energy_periodic(shift)
+        E_corr = E_iso - E_per + q*C
+
+        with open(filename, 'w') as f:
+            f.write("isolated energy = %.8f eV\n"%E_iso)
+            f.write("periodic energy = %.8f eV\n"%E_per)
+            f.write("alignment q*C = %.8f eV\n"%(q*C))
+            f.write("iso - periodic energy = %.8f eV\n"%E_corr)
+
+        return E_corr
+
+
+def planar_average_difference(vref, vdef):
+
+    """
+    Planar-averaged potential difference between the defect and bulk LOCPOTs along z.
+
+    Parameters
+    ----------
+    vref (str): path to bulk LOCPOT file (may be compressed)
+    vdef (str): path to defect LOCPOT file (may be compressed)
+
+    Returns
+    -------
+    (array) z (bohr)
+    (array) V_def - V_bulk (eV)
+
+    """
+
+    ## only the planar averages are needed, and they are cached next to each LOCPOT
+    avg_ref = locpot.load_averages(vref)
+    avg_def = locpot.load_averages(vdef)
+    dV = avg_def['average_c'] - avg_ref['average_c']
+    c = np.linalg.norm(avg_def['lattice'][2])
+    z = Ang_to_bohr(np.arange(len(dV))*c/len(dV))
+
+    return z, dV
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Evaluate the Gaussian model charge correction \
+                                     for a charged defect in a slab.')
+    parser.add_argument('encut',type=float,help='cutoff energy (eV)')
+    parser.add_argument('--sxfile',help='SPHInX input file',default='system.sx')
+    parser.add_argument('--shift',type=float,default=0.,help='shift of the charge along z (bohr)')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    model = GaussianModel2D.from_sphinx(args.sxfile, args.encut)
+    print("isolated energy = %.8f eV"%model.energy_isolated(args.shift))
+    print("periodic energy = %.8f eV"%model.energy_periodic(args.shift))
+
@@ -0,0 +1,229 @@
+import os
+import json
+import errno
+import argparse
+import numpy as np
+import pandas as pd
+from pymatgen.core.lattice import Lattice
+from pymatgen.io.vasp.inputs import Poscar
+from qdef2d import campaign, logging
+from qdef2d.io.database import local_database
+from qdef2d.defects.corrections.gaussian_model_2d import GaussianModel2D
+from qdef2d.defects.corrections.SPHInX_input_file import Ang_to_bohr
+
+
+def image_energies(lattice, eps_slab, d_slab, cells, dz=0., encut=520, eps_perp=None):
+
+    """
+    Estimate the image-interaction error E_iso - E_per of a unit point charge (q=1)
+    in a set of supercells of a 2D unit cell, from the Gaussian model charge
+    in the slab dielectric profile (the same model as the sxdefectalign2d correction).
+    The isolated energy is solved for once, and the periodic energy of all supercells
+    with the same out-of-plane size in a single batch.
+    The error scales as q^2 for other charge states.
+
+    Parameters
+    ----------
+    lattice (array): lattice vectors of the unit cell (Angstroms), shape (3,3)
+    eps_slab (float): ave. slab dielectric constant (in-plane component if eps_perp is given)
+    d_slab (float): slab thickness in Angstroms
+    cells (list of tuples of ints): list of [n1,n2,n3] supercell sizes
+    [optional] dz (float): height of the defect above the middle of the slab (Angstroms).
+                           Default=0, the middle of the slab.
+    [optional] encut (int): cutoff energy (eV). Default=520.
+    [optional] eps_perp (float): out-of-plane slab dielectric constant,
+                                 for an anisotropic slab. Default=eps_slab.
+
+    Returns
+    -------
+    (array) Image-interaction error (eV) in each supercell.
+
+    """
+
+    lattice = np.asarray(lattice, dtype=float)
+    cells = np.atleast_2d(np.asarray(cells, dtype=int))
+    slab = (eps_slab,) if eps_perp is None else (eps_slab, eps_perp)
+
+    E = np.zeros(len(cells))
+    for n3 in np.unique(cells[:,2]):
+        ## as in SPHInX_input_file, the slab is assumed to be centered in the cell vertically
+        cell = Ang_to_bohr(lattice*np.array([[1],[1],[n3]]))
+        c = cell[2,2]
+        d = Ang_to_bohr(d_slab)
+        model = GaussianModel2D(cell, [((c-d)/2, (c+d)/2) + slab], c/2 + Ang_to_bohr(dz),
+                                -1., encut)
+        i = np.where(cells[:,2] == n3)[0]
+        E[i] = model.energy_isolated() - model.energy_periodic_supercells(cells[i,:2])
+
+    return E
+
+
+def _unit_cell(dir_def_main, vac):
+
+    ## lattice of the unit cell, from the POSCAR used to set up the supercells
+    pos_file = os.path.join(dir_def_main,"POSCAR_vac_%d"%vac)
+    if not os.path.exists(pos_file):
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), pos_file)
+
+    return Poscar.from_file(pos_file).structure.lattice.matrix
+
+
+def _defect_height(manifest, vac):
+
+    ## height of the defect above the middle of the slab (Angstroms) in a calculation
+    ## that has already been set up with this vacuum spacing (the same in all its supercells),
+    ## with the charge placed as in SPHInX_input_file.render, if there is one
+    for leaf in manifest.leaves(vacuum="vac_%d"%vac):
+        if leaf.charge != 0 and leaf.has('defectproperty.json'):
+            with open(leaf.find('defectproperty.json'), 'r') as file:
+                defprop = json.loads(file.read())
+            c = Lattice.from_dict(defprop["lattice"]).c
+            return (np.mean([def_site[2] for def_site in defprop["defect_site"]]) - 0.5)*c
+
+    return 0.
+
+
+def estimate(dir_def_main,qs,cells,vacs,eps_slab=None,d_slab=None,dbentry=None,
+             functional="GGA",encut=520,eps_perp=None,logfile=None,myLogger=None):
+
+    """
+    Estimate the image-interaction error of every (charge, supercell, vacuum) combination
+    of a defect campaign before setting it up, to pre-screen the charge corrections.
+    The unit cells are read from the POSCAR_vac_<vac> files in dir_def_main,
+    and the height of the defect above the middle of the slab from any defectproperty.json
+    already set up with the same vacuum spacing (otherwise the middle of the slab).
+
+    Parameters
+    ----------
+    dir_def_main (str): path to the main defect directory
+    qs (list of ints): list of charge states
+    cells (list of tuples of ints): list of [n1,n2,n3] supercell sizes
+    vacs (list of ints): list of vacuum spacings
+    [optional] eps_slab (float): ave. slab dielectric constant (supply this or dbentry)
+    [optional] d_slab (float): slab thickness in Angstroms (supply this or dbentry)
+    [optional] dbentry (str): path to the relevant database entry .json file
+                              (supply this or eps_slab and d_slab)
+    [optional] functional (str): functional used for this set of calculations. Default=GGA.
+    [optional] encut (int): cutoff energy (eV). Default=520.
+    [optional] eps_perp (float): out-of-plane slab dielectric constant. Default=eps_slab.
+    [optional] logfile (str): logfile to save output to
+    [optional] myLogger (Logger): logger to report to, when called from another script
+                                  (instead of setting up a new one)
+
+    Returns
+    -------
+    (DataFrame) with the columns charge, supercell, vacuum, E_image (eV)
+
+    """
+
+    ## set up logging, unless reporting to the logger of a calling script
+    if not myLogger and logfile:
+        myLogger = logging.setup_logging(logfile)
+    elif not myLogger:
+        myLogger = logging.setup_logging()
+
+
+    if not (eps_slab and d_slab):
+        if not dbentry:
+            raise ValueError("supply either eps_slab and d_slab, or dbentry")
+        if not os.path.exists(dbentry):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), dbentry)
+        ## extract the eps_slab and d_slab from the relevant dbentry file
+        db = local_database.load(os.path.dirname(os.path.abspath(dbentry)))
+        system = os.path.splitext(os.path.basename(dbentry))[0]
+        eps_slab, d_slab = db.get_slab(system, functional)
+    myLogger.info("eps_slab: %.2f ; d_slab: %.2f"%(eps_slab,d_slab))
+
+    manifest = campaign.index(dir_def_main)
+
+    rows = []
+    for vac in vacs:
+        E = image_energies(_unit_cell(dir_def_main,vac), eps_slab, d_slab, cells,
+                           _defect_height(manifest,vac), encut, eps_perp)
+        for cell,E_cell in zip(cells,E):
+            for q in qs:
+                rows.append({"charge": q, "supercell": "%dx%dx%d"%tuple(cell),
+                             "vacuum": "vac_%d"%vac, "E_image": q**2*E_cell})
+                myLogger.info("charge_%d/%dx%dx%d/vac_%d: image interaction %.4f eV"
+                              %((q,)+tuple(cell)+(vac,q**2*E_cell)))
+
+    return pd.DataFrame(rows, columns=["charge","supercell","vacuum","E_image"])
+
+
+def select(estimates, tol):
+
+    """
+    Choose which configurations are worth setting up, given the estimated image errors:
+    for each charge state and vacuum spacing, once the image error is below tolerance
+    in a supercell and in all the larger ones (the error can change sign
+    with the supercell size), the larger supercells add nothing to the convergence
+    of the correction, and are dropped. Neutral defects are always kept.
+
+    Parameters
+    ----------
+    estimates (DataFrame): as returned by estimate()
+    tol (float): tolerance on the image-interaction error (eV)
+
+    Returns
+    -------
+    (array of bool) Whether or not to set up each configuration.
+
+    """
+
+    size = np.array([np.prod([int(n) for n in cell.split('x')])
+                     for cell in estimates["supercell"]])
+    converged = np.abs(estimates["E_image"].values) < tol
+
+    keep = np.ones(len(estimates), dtype=bool)
+    for (q,vac),group in estimates.groupby(["charge","vacuum"]).indices.items():
+        if q == 0:
+            continue
+        i = np.asarray(group)
+        ## smallest supercell from which on the error stays below tolerance
+        i = i[np.argsort(size[i], kind='stable')]
+        tail = np.logical_and.accumulate(converged[i][::-1])[::-1]
+        if tail.any():
+            keep[i] = size[i] <= size[i][tail].min()
+
+    return keep
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Estimate the image-interaction error \
+                                     of charged defect calculations before setting them up.')
+    parser.add_argument('dir_def_main', help='path to main defect directory')
+    parser.add_argument('--qs', nargs='+', help='(required) charge states; \
+                        list each charge state separated by a space', type=int)
+    parser.add_argument('--cells', nargs='+', help='(required) supercell sizes; \
+                        list each supercell size as n1xn2xn3 separated by a space')
+    parser.add_argument('--vacs', nargs='+', help='(required) vacuum spacings; \
+                        list each vacuum spacing separated by a space', type=int)
+    parser.add_argument('--eps_slab', type=float,
+                        help='average slab dielectric constant (supply this or --dbentry)')
+    parser.add_argument('--d_slab', type=float,
+                        help='slab thickness in Angstroms (supply this or --dbentry)')
+    parser.add_argument('--dbentry', help='path to the relevant database entry .json file \
+                        (supply this or --eps_slab and --d_slab)')
+    parser.add_argument('--functional',  default='GGA',
+                        help='functional that was used for this set of calculations')
+    parser.add_argument('--encut', type=int, default=520, help='cutoff energy (eV)')
+    parser.add_argument('--eps_perp', type=float,
+                        help='out-of-plane slab dielectric constant (default: eps_slab)')
+    parser.add_argument('--tol', type=float,
+                        help='also list the configurations to set up for this tolerance (eV)')
+    parser.add_argument('--logfile', help='logfile to save output to')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    estimates = estimate(args.dir_def_main, args.qs,
+                         [[int(n) for n in cell.split('x')] for cell in args.cells],
+                         args.vacs, args.eps_slab, args.d_slab, args.dbentry,
+                         args.functional, args.encut, args.eps_perp, args.logfile)
+    if args.tol:
+        estimates["setup"] = select(estimates, args.tol)
+    print(estimates.to_string(index=False))
+
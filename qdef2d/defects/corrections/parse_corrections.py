@@ -3,7 +3,9 @@ import sys
 import argparse
 import numpy as np
 import pandas as pd
-from qdef2d import logging, osutils
+from qdef2d import campaign, logging
+from qdef2d.io import compressed
+from qdef2d.defects.corrections import sxdefectalign_output
 
 
 def parse(dir_def,xlfile,soc=False,logfile=None):
@@ -32,38 +34,42 @@ def parse(dir_def,xlfile,soc=False,logfile=None):
         df[q]['E_corr'] = np.nan
 
 
-    for q in osutils.listdironly(os.path.join(dir_def,'')):
-        if q != 'charge_0':
-            for cell in osutils.listdironly(os.path.join(dir_def,q,'')): 
-                for vac in osutils.listdironly(os.path.join(dir_def,q,cell,'')): 
-                    myLogger.info("parsing %s %s %s"%(q,cell,vac))
-                    
-                    folder = os.path.join(dir_def,q,cell,vac,'')
-                    
-                    if soc: 
-                        myLogger.info("parsing dos subdirectory")
-                        folder = os.path.join(folder,'dos','')     
-                    if os.path.exists(folder) and 'restart' in osutils.listdironly(folder):
-                        folder = os.path.join(folder,'restart','')
-                        myLogger.info("parsing restart subdirectory")
+    ## index the defect directory tree; the corrections for soc are in the dos subdirectories
+    variant = 'dos' if soc else None
+    manifest = campaign.index(dir_def)
     
-                    if not os.path.exists(os.path.join(folder,'correction','correction')):
-                        myLogger.warning("correction file does not exist")
-                    else:
-                        with open(os.path.join(folder,'correction','correction')) as f:
-                            lines = f.readlines()
-                            for line in lines:
-                                if line[:21] == 'iso - periodic energy':
-                                    E_corr = float(line.split()[-2])
-                        df[q].loc[(df[q]['vacuum'] == vac) & 
-                                  (df[q]['supercell'] == cell),'E_corr'] = E_corr
+    ## find all the correction files first, then read them all at once
+    found = []
+    for leaf in [l for l in manifest.leaves() if l.charge != 0]:
+        q, cell, vac = leaf.charge, leaf.supercell, leaf.vacuum
+        sheet = 'charge_%d'%q
+        myLogger.info("parsing %s %s %s"%(sheet,cell,vac))
+        
+        leaf = campaign.get_leaf(manifest,q,cell,vac,variant,myLogger)
+        if leaf is None:
+            continue
+
+        file_corr = compressed.find_file(os.path.join(leaf.path,'correction'),'correction')
+        if not file_corr:
+            myLogger.warning("correction file does not exist")
+        else:
+            found.append((sheet,cell,vac,file_corr))
+            
+    terms = sxdefectalign_output.read_corrections([file_corr for _,_,_,file_corr in found])
+    for (sheet,cell,vac,file_corr),term in zip(found,terms):
+        if term['E_corr'] is None:
+            myLogger.warning("cannot find correction energy in %s"%file_corr)
+            continue
+        ## bulk calculations have no vacuum level (an empty cell in the excel file)
+        same_vac = df[sheet]['vacuum'].isna() if vac is None else (df[sheet]['vacuum'] == vac)
+        df[sheet].loc[same_vac & (df[sheet]['supercell'] == cell),'E_corr'] = term['E_corr']
 
 
     ## write the updated excel file
     writer = pd.ExcelWriter(os.path.join(dir_def,xlfile))
     for q in df.keys():  
-        df[q].to_excel(writer, q, index=False)
-    writer.save()    
+        df[q].to_excel(writer, sheet_name=q, index=False)
+    writer.close()    
        
     
 if __name__ == '__main__':
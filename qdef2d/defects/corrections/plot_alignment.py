@@ -0,0 +1,118 @@
+import os
+import glob
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+def save_profile(data, shift, filename):
+
+    """
+    Save the potential profiles of one alignment iteration for plotting later.
+
+    Parameters
+    ----------
+    data (array): columns z, V_model, dV, dV - V_model (as in vline-eV.dat)
+    shift (float): shift of the charge along z (bohr)
+    filename (str): .npz file to save to
+
+    """
+
+    np.savez(filename, data=np.asarray(data, dtype=np.float32), shift=shift)
+
+
+def plot_profile(filename, pngfile=None):
+
+    """
+    Plot the potential profiles saved by save_profile().
+
+    Parameters
+    ----------
+    filename (str): .npz file with the profiles
+    [optional] pngfile (str): image file to save to. Default=same name as filename, as .png.
+
+    """
+
+    ## matplotlib is only imported when something is actually plotted
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+
+    if pngfile is None:
+        pngfile = os.path.splitext(filename)[0] + '.png'
+    with np.load(filename) as npz:
+        data, shift = npz['data'], float(npz['shift'])
+
+    plt.figure()
+    plt.plot(data[:,0],data[:,2],'r',label=r'$V_{def}-V_{bulk}$')
+    plt.plot(data[:,0],data[:,1],'g',label=r'$V_{model}$')
+    plt.plot(data[:,0],data[:,-1],'b',label=r'$V_{def}-V_{bulk}-V_{model}$')
+    plt.xlabel("distance along z axis (bohr)")
+    plt.ylabel("potential (eV)")
+    plt.title("shift = %.4f bohr"%shift)
+    plt.xlim(data[0,0],data[-1,0])
+    plt.legend()
+    plt.savefig(pngfile)
+    plt.close()
+
+
+def render(dir_corr):
+
+    """
+    Plot all the saved alignment profiles in a correction directory
+    that haven't been plotted yet (or have changed since).
+
+    Parameters
+    ----------
+    dir_corr (str): correction directory
+
+    Returns
+    -------
+    (int) No. of plots made.
+
+    """
+
+    count = 0
+    for filename in sorted(glob.glob(os.path.join(dir_corr,'alignment*.npz'))):
+        pngfile = os.path.splitext(filename)[0] + '.png'
+        if (not os.path.exists(pngfile)
+            or os.path.getmtime(pngfile) < os.path.getmtime(filename)):
+            plot_profile(filename, pngfile)
+            count += 1
+
+    return count
+
+
+def render_all(dirs_corr, nprocs=1):
+
+    """
+    Plot the saved alignment profiles of many correction directories in a pool of processes.
+
+    Parameters
+    ----------
+    dirs_corr (list of str): correction directories
+    [optional] nprocs (int): no. of processes. Default=1.
+
+    Returns
+    -------
+    (int) No. of plots made.
+
+    """
+
+    with ProcessPoolExecutor(max_workers=nprocs) as executor:
+        return sum(executor.map(render, dirs_corr))
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Plot the saved alignment profiles.')
+    parser.add_argument('dirs_corr', nargs='+', help='correction directories')
+    parser.add_argument('--nprocs', type=int, default=1, help='no. of processes')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    render_all(args.dirs_corr, args.nprocs)
+
@@ -0,0 +1,145 @@
+import re
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from qdef2d.io import compressed
+
+
+## lines of the form <name> = <value> [eV] or <name> (eV): <value>,
+## as printed by sxdefectalign2d and sxdefectalign
+re_term = re.compile(rb'^[ \t]*([A-Za-z][^=:\n]*?)[ \t]*(?:\(eV\))?[ \t]*[=:][ \t]*'
+                     rb'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eEdD][-+]?\d+)?)', re.MULTILINE)
+
+## names of the total correction energy in the sxdefectalign2d and sxdefectalign outputs
+CORRECTION_KEYS = ['iso - periodic energy', 'Defect correction']
+
+
+def read_vline(filename, block=-1):
+
+    """
+    Read the potential profiles written by sxdefectalign2d/sxdefectalign (vline-eV.dat)
+    with a single call to the numeric reader, rather than line by line.
+    sxdefectalign writes several data sets separated by lines starting with '&'.
+
+    Parameters
+    ----------
+    filename (str): path to the (possibly compressed) vline-eV.dat file
+    [optional] block (int): which data set to return. Default=-1 (the last one).
+
+    Returns
+    -------
+    (array) The data set, one row per z, with the same columns as the file.
+
+    """
+
+    with compressed.zopen(filename, 'rb') as f:
+        data = f.read()
+
+    blocks = re.split(rb'^&.*$', data, flags=re.MULTILINE)
+    text = [b for b in blocks if b.strip()][block]
+    ncols = len(text.strip().split(b'\n', 1)[0].split())
+    values = np.fromstring(text.decode(), dtype=np.float64, sep=' ')
+
+    return values.reshape(-1, ncols)
+
+
+def vacuum_windows(z, width=2.):
+
+    """
+    Indices of the points within a given distance of either end of the cell,
+    i.e. in the middle of the vacuum when the slab is in the center of the cell vertically.
+
+    Parameters
+    ----------
+    z (array): z positions (bohr), in ascending order
+    [optional] width (float): width of each window (bohr). Default=2.
+
+    Returns
+    -------
+    (slice) points at the bottom of the cell
+    (slice) points at the top of the cell
+
+    """
+
+    z1 = np.searchsorted(z, z[0]+width, side='right')
+    z2 = np.searchsorted(z, z[-1]-width, side='right')
+
+    return slice(None, z1), slice(z2, None)
+
+
+def parse_terms(text):
+
+    """
+    Extract all the energy terms from the output of sxdefectalign2d/sxdefectalign.
+
+    Parameters
+    ----------
+    text (bytes): contents of the correction file
+
+    Returns
+    -------
+    (dict) {name: value} of every term, the last occurrence of each.
+
+    """
+
+    return {name.decode().strip(): float(value.replace(b'D',b'E').replace(b'd',b'e'))
+            for name,value in re_term.findall(text)}
+
+
+def read_correction(filename):
+
+    """
+    Read the energy terms and the total correction from a correction file.
+
+    Parameters
+    ----------
+    filename (str): path to the (possibly compressed) correction file
+
+    Returns
+    -------
+    (dict) Energy terms as returned by parse_terms(), together with the key E_corr
+           for the total correction energy (None if it can't be found).
+
+    """
+
+    with compressed.zopen(filename, 'rb') as f:
+        terms = parse_terms(f.read())
+    terms['E_corr'] = next((terms[key] for key in CORRECTION_KEYS if key in terms), None)
+
+    return terms
+
+
+def read_corrections(filenames, nthreads=None):
+
+    """
+    Read many correction files concurrently (see read_correction).
+
+    Parameters
+    ----------
+    filenames (list of str): paths to the (possibly compressed) correction files
+    [optional] nthreads (int): no. of threads. Default=chosen by ThreadPoolExecutor.
+
+    Returns
+    -------
+    (list of dict) Energy terms of each file, in the same order.
+
+    """
+
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        return list(executor.map(read_correction, filenames))
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Read the energy terms from sxdefectalign2d \
+                                     correction files.')
+    parser.add_argument('files', nargs='+', help='correction files')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    for filename,terms in zip(args.files, read_corrections(args.files)):
+        print("%s: %s"%(filename,terms['E_corr']))
+
@@ -0,0 +1,254 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from qdef2d import logging
+
+
+def design_matrix(N, Lz, form):
+
+    """
+    Set up the design matrix for the finite-size scaling of the formation energy.
+    For the corrected formation energies only the residual (e.g. elastic) interactions
+    between periodic images remain:
+    E(N) = E_inf + a/N
+    For the uncorrected formation energies of charged defects in 2D,
+    the electrostatic interactions scale with the in-plane size L ~ sqrt(N)
+    and with the vacuum spacing Lz as
+    E(N,Lz) = E_inf + a/sqrt(N) + b*Lz/N
+
+    Parameters
+    ----------
+    N (array): no. of atoms in the (pristine) supercell
+    Lz (array): vacuum spacing (Angstroms), same shape as N
+    form (str): 'corrected' or 'uncorrected'
+
+    Returns
+    -------
+    (array) Design matrix, shape N.shape + (n_params,).
+
+    """
+
+    N = np.asarray(N, dtype=float)
+    Lz = np.asarray(Lz, dtype=float)
+    if form == 'corrected':
+        return np.stack([np.ones_like(N), 1/N], axis=-1)
+    elif form == 'uncorrected':
+        return np.stack([np.ones_like(N), 1/np.sqrt(N), Lz/N], axis=-1)
+    else:
+        raise ValueError("unknown scaling form %s"%form)
+
+
+def _solve(X, y, w):
+
+    ## weighted normal equations for a whole batch of fits at once;
+    ## fits without enough (distinct) points to fix every parameter are set to NaN
+    A = np.einsum('...n,...np,...nq->...pq', w, X, X)
+    rhs = np.einsum('...n,...np,...n->...p', w, X, y)
+    beta = np.einsum('...pq,...q->...p', np.linalg.pinv(A), rhs)
+    singular = np.linalg.matrix_rank(A) < X.shape[-1]
+    beta[singular] = np.nan
+
+    return beta
+
+
+def fit(N, Lz, y, form, n_boot=1000, seed=None):
+
+    """
+    Fit the finite-size scaling of many sets of formation energies at once
+    (e.g. every charge state of every defect) by least squares,
+    with bootstrap estimates of the uncertainty in the extrapolated value.
+
+    Parameters
+    ----------
+    N (array): no. of atoms in the supercell, shape (n_sets, n_rows)
+    Lz (array): vacuum spacing (Angstroms), shape (n_sets, n_rows)
+    y (array): formation energies, shape (n_sets, n_rows), NaN where missing
+    form (str): 'corrected' or 'uncorrected', see design_matrix()
+    [optional] n_boot (int): no. of bootstrap resamples. Default=1000.
+    [optional] seed (int): seed for the random number generator
+
+    Returns
+    -------
+    (dict) with the keys
+           params (array): fitted parameters (E_inf, a[, b]), shape (n_sets, n_params)
+           E_inf (array): extrapolated formation energy, shape (n_sets,)
+           E_inf_err (array): bootstrap standard deviation of E_inf, shape (n_sets,)
+           residuals (array): fit residuals, shape (n_sets, n_rows), NaN where missing
+           rms (array): root mean square residual, shape (n_sets,)
+           n_points (array): no. of points in each fit, shape (n_sets,)
+
+    """
+
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    mask = ~np.isnan(y) & ~np.isnan(N) & ~np.isnan(Lz)
+    X = np.nan_to_num(design_matrix(np.where(mask,N,1.), np.where(mask,Lz,0.), form))
+    y0 = np.where(mask, y, 0.)
+    w = mask.astype(float)
+    n_points = mask.sum(axis=-1)
+
+    params = _solve(X, y0, w)
+    residuals = np.where(mask, y0 - np.einsum('bnp,bp->bn', X, params), np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rms = np.sqrt(np.nansum(residuals**2, axis=-1)/n_points)
+    rms[np.isnan(params[:,0])] = np.nan
+
+    ## resample the points of every fit with replacement, all resamples at once
+    rng = np.random.default_rng(seed)
+    pvals = w / np.maximum(n_points, 1)[:,None]
+    counts = np.zeros((n_boot,) + y.shape)
+    ok = n_points > 0
+    if ok.any() and n_boot > 0:
+        counts[:,ok] = rng.multinomial(n_points[ok], pvals[ok], size=(n_boot,ok.sum()))
+    boot = _solve(X[None], y0[None], counts)[...,0]
+    ## fits with too few points have no (or a single) valid resample
+    n_valid = np.sum(~np.isnan(boot), axis=0)
+    E_inf_err = np.full(len(y), np.nan)
+    E_inf_err[n_valid > 1] = np.nanstd(boot[:,n_valid > 1], axis=0)
+
+    return {"params": params, "E_inf": params[:,0], "E_inf_err": E_inf_err,
+            "residuals": residuals, "rms": rms, "n_points": n_points}
+
+
+def _vacuum(vac):
+
+    ## vacuum subdirectory names are of the form vac_<spacing>
+    return float(str(vac).split("_")[-1])
+
+
+def read_energies(dirs_def, xlfile):
+
+    """
+    Read the formation energies of every charge state of every defect
+    from their excel files (as written by calc_Eform_uncorr/calc_Eform_corr)
+    into a single table.
+
+    Parameters
+    ----------
+    dirs_def (list of str): paths to the defect directories containing the excel files
+    xlfile (str): excel filename to read the dataframes from
+
+    Returns
+    -------
+    (DataFrame) One row per (defect, charge, supercell, vacuum) with the columns
+                defect, charge, vacuum, supercell, N, Lz, E_form_uncorr, E_form_corr
+
+    """
+
+    rows = []
+    for dir_def in dirs_def:
+        defect = os.path.basename(os.path.normpath(dir_def))
+        df = pd.read_excel(os.path.join(dir_def,xlfile),sheet_name=None)
+        for sheet in [s for s in df.keys() if s.startswith("charge_")]:
+            q = int(sheet.split("_")[-1])
+            dfq = df[sheet]
+            ## the neutral formation energy doesn't need correcting
+            uncorr = dfq['E_form_uncorr'] if 'E_form_uncorr' in dfq else dfq.get('E_form_corr')
+            corr = dfq.get('E_form_corr')
+            rows.append(pd.DataFrame({'defect': defect, 'charge': q,
+                                      'vacuum': dfq['vacuum'], 'supercell': dfq['supercell'],
+                                      'N': dfq['N'].astype(float),
+                                      'Lz': [_vacuum(vac) for vac in dfq['vacuum']],
+                                      'E_form_uncorr': np.nan if uncorr is None else uncorr,
+                                      'E_form_corr': np.nan if corr is None else corr}))
+
+    return pd.concat(rows, ignore_index=True)
+
+
+def _batch(data, colname):
+
+    ## pad the rows of every (defect, charge) into (n_sets, n_rows) arrays
+    groups = list(data.groupby(['defect','charge'], sort=True))
+    n_rows = max(len(g) for _,g in groups)
+    N, Lz, y = [np.full((len(groups),n_rows), np.nan) for i in range(3)]
+    for i,(key,g) in enumerate(groups):
+        N[i,:len(g)] = g['N'].values
+        Lz[i,:len(g)] = g['Lz'].values
+        y[i,:len(g)] = g[colname].values
+
+    return [key for key,g in groups], [g.index.values for _,g in groups], N, Lz, y
+
+
+def calc(dirs_def, xlfile, outfile, n_boot=1000, seed=None, logfile=None):
+
+    """
+    Extrapolate the corrected and uncorrected formation energies of every charge state
+    of every defect to the dilute, infinite-vacuum limit.
+
+    Parameters
+    ----------
+    dirs_def (list of str): paths to the defect directories containing the excel files
+    xlfile (str): excel filename to read the dataframes from
+    outfile (str): excel filename to save the extrapolated energies and residuals to
+    [optional] n_boot (int): no. of bootstrap resamples. Default=1000.
+    [optional] seed (int): seed for the random number generator
+    [optional] logfile (str): logfile to save output to
+
+    Returns
+    -------
+    (dict) of DataFrames with the keys corrected, uncorrected, residuals.
+
+    """
+
+    ## set up logging
+    if logfile:
+        myLogger = logging.setup_logging(logfile)
+    else:
+        myLogger = logging.setup_logging()
+
+
+    data = read_energies(dirs_def, xlfile)
+    results = {}
+    residuals = data[['defect','charge','vacuum','supercell','N','Lz']].copy()
+
+    for form,colname in [('corrected','E_form_corr'), ('uncorrected','E_form_uncorr')]:
+        keys, inds, N, Lz, y = _batch(data, colname)
+        out = fit(N, Lz, y, form, n_boot, seed)
+
+        df = pd.DataFrame(keys, columns=['defect','charge'])
+        df['E_inf'] = out['E_inf']
+        df['E_inf_err'] = out['E_inf_err']
+        for j,name in enumerate(['a','b'][:out['params'].shape[1]-1]):
+            df[name] = out['params'][:,j+1]
+        df['rms'] = out['rms']
+        df['n_points'] = out['n_points']
+        results[form] = df
+
+        residuals['res_'+form] = np.nan
+        for i,ind in enumerate(inds):
+            residuals.loc[ind,'res_'+form] = out['residuals'][i,:len(ind)]
+
+        for row in df.itertuples():
+            myLogger.info("%s charge_%d (%s): E_inf = %.4f +/- %.4f eV (%d points)"
+                          %(row.defect,row.charge,form,row.E_inf,row.E_inf_err,row.n_points))
+    results['residuals'] = residuals
+
+
+    ## write the results to a separate excel file
+    writer = pd.ExcelWriter(outfile)
+    for sheet,df in results.items():
+        df.to_excel(writer, sheet_name=sheet, index=False)
+    writer.close()
+
+    return results
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Extrapolate defect formation energies to the \
+                                     dilute, infinite-vacuum limit.')
+    parser.add_argument('xlfile',help='excel filename to read the dataframes from')
+    parser.add_argument('outfile',help='excel filename to save the extrapolated energies to')
+    parser.add_argument('--dirs_def', nargs='+', required=True,
+                        help='paths to the defect directories; list each separated by a space')
+    parser.add_argument('--n_boot', type=int, default=1000, help='no. of bootstrap resamples')
+    parser.add_argument('--seed', type=int, help='seed for the random number generator')
+    parser.add_argument('--logfile',help='logfile to save output to')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    calc(args.dirs_def, args.xlfile, args.outfile, args.n_boot, args.seed, args.logfile)
+
@@ -0,0 +1,419 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from qdef2d import logging
+
+
+## Boltzmann constant (eV/K)
+KB = 8.617333262e-5
+## hbar^2/(2 m0) (eV Angstrom^2)
+HBAR2_2M0 = 3.80998212
+## Angstrom^-2 to cm^-2
+A2_TO_CM2 = 1e16
+## largest exponent we allow before exp() overflows
+EXP_MAX = 500.
+
+
+class EffectiveMassModel(object):
+
+    """
+    Parabolic-band (effective mass) model of the carriers in a 2D host.
+    In 2D the density of states is a step function, so the Fermi-Dirac integrals
+    have the closed form
+    n = g_e m_e kT/(pi hbar^2) ln(1 + exp((E_F - E_CBM)/kT))
+    p = g_h m_h kT/(pi hbar^2) ln(1 + exp((E_VBM - E_F)/kT))
+    All energies are relative to the VBM.
+
+    Parameters
+    ----------
+    Egap (float): band gap (eV)
+    m_e (float): electron effective mass (in units of m0)
+    m_h (float): hole effective mass (in units of m0)
+    [optional] g_e (int): conduction band valley degeneracy. Default=1.
+    [optional] g_h (int): valence band valley degeneracy. Default=1.
+
+    """
+
+    def __init__(self, Egap, m_e, m_h, g_e=1, g_h=1):
+
+        self.vbm = 0.
+        self.cbm = float(Egap)
+        ## m/(pi hbar^2) including spin degeneracy, in cm^-2 eV^-1
+        self.Nc = g_e * m_e / (2*np.pi*HBAR2_2M0) * A2_TO_CM2
+        self.Nv = g_h * m_h / (2*np.pi*HBAR2_2M0) * A2_TO_CM2
+
+        return
+
+
+    def carriers(self, efermi, kT):
+
+        """
+        Evaluate the free electron and hole densities.
+
+        Parameters
+        ----------
+        efermi (array): Fermi levels relative to the VBM (eV)
+        kT (array): thermal energies (eV), same shape as efermi
+
+        Returns
+        -------
+        (array) electron densities n (cm^-2)
+        (array) hole densities p (cm^-2)
+
+        """
+
+        n = self.Nc * kT * np.logaddexp(0, (efermi-self.cbm)/kT)
+        p = self.Nv * kT * np.logaddexp(0, (self.vbm-efermi)/kT)
+
+        return n, p
+
+
+class DOSModel(object):
+
+    """
+    Model of the carriers in a host based on a tabulated (e.g. VASP) density of states.
+    The occupations are integrated over the DOS for all Fermi levels at once,
+    in chunks to keep the memory use bounded.
+
+    Parameters
+    ----------
+    energies (array): energy grid (eV)
+    dos (array): total density of states (states/eV/cm^2, including spin)
+    vbm (float): valence band maximum on the same energy scale
+    cbm (float): conduction band minimum on the same energy scale
+    [optional] chunksize (int): max. no. of Fermi levels x energies to evaluate at once.
+
+    """
+
+    def __init__(self, energies, dos, vbm, cbm, chunksize=2**22):
+
+        energies = np.asarray(energies, dtype=float) - vbm
+        dos = np.asarray(dos, dtype=float)
+        self.vbm = 0.
+        self.cbm = float(cbm - vbm)
+        self.chunksize = chunksize
+
+        ## integration weights dos*dE on the (possibly non-uniform) energy grid
+        weights = dos * np.gradient(energies)
+        cond = energies >= self.cbm
+        val = energies <= self.vbm
+        self._e_cond, self._w_cond = energies[cond], weights[cond]
+        self._e_val, self._w_val = energies[val], weights[val]
+
+        return
+
+
+    @classmethod
+    def from_vasprun(cls, filename, area=None):
+
+        """
+        Set up the DOS model from the total DOS in a vasprun.xml file.
+
+        Parameters
+        ----------
+        filename (str): path to vasprun.xml
+        [optional] area (float): in-plane cell area (Angstrom^2). Default=read from the structure.
+
+        """
+
+        from pymatgen.io.vasp.outputs import Vasprun
+
+        vasprun = Vasprun(filename, parse_potcar_file=False)
+        dos = vasprun.tdos
+        if area is None:
+            lattice = vasprun.final_structure.lattice.matrix
+            area = np.linalg.norm(np.cross(lattice[0], lattice[1]))
+        densities = np.sum([d for d in dos.densities.values()], axis=0)
+        gap, cbm, vbm, _ = vasprun.eigenvalue_band_properties
+
+        return cls(dos.energies, densities/area*A2_TO_CM2, vbm, cbm)
+
+
+    def _integrate(self, x, weights):
+
+        ## sum_E w(E) f(x) with f = 1/(1+exp(x)), chunked over the rows of x
+        out = np.empty(len(x))
+        step = max(self.chunksize//max(weights.size,1), 1)
+        for i in range(0, len(x), step):
+            occ = 1. / (1. + np.exp(np.clip(x[i:i+step], -EXP_MAX, EXP_MAX)))
+            out[i:i+step] = occ @ weights
+        return out
+
+
+    def carriers(self, efermi, kT):
+
+        """
+        Evaluate the free electron and hole densities.
+
+        Parameters
+        ----------
+        efermi (array): Fermi levels relative to the VBM (eV)
+        kT (array): thermal energies (eV), same shape as efermi
+
+        Returns
+        -------
+        (array) electron densities n (cm^-2)
+        (array) hole densities p (cm^-2)
+
+        """
+
+        shape = np.shape(efermi)
+        ef = np.ravel(efermi)[:,None]
+        kT = np.ravel(kT)[:,None]
+        n = self._integrate((self._e_cond[None,:]-ef)/kT, self._w_cond)
+        p = self._integrate((ef-self._e_val[None,:])/kT, self._w_val)
+
+        return n.reshape(shape), p.reshape(shape)
+
+
+def defect_concentrations(eform_vbm, charges, efermi, kT, nsites, g=None):
+
+    """
+    Evaluate the Boltzmann concentrations of all defects in all charge states,
+    c(d,q) = N_sites(d) g(d,q) exp(-(Eform(d,q) + q*E_F)/kT)
+
+    Parameters
+    ----------
+    eform_vbm (array): formation energies with the Fermi level at the VBM,
+                       shape (n_pts, n_def, n_q), NaN for charge states that weren't calculated
+    charges (array): charge states, shape (n_q,) or (n_def, n_q)
+    efermi (array): Fermi levels relative to the VBM, shape (n_pts,)
+    kT (array): thermal energies (eV), shape (n_pts,)
+    nsites (array): densities of defect sites (cm^-2), shape (n_def,)
+    [optional] g (array): degeneracies, shape (n_def, n_q). Default=1.
+
+    Returns
+    -------
+    (array) Concentrations (cm^-2), shape (n_pts, n_def, n_q).
+
+    """
+
+    charges = np.asarray(charges, dtype=float)
+    exponent = -(eform_vbm + charges*efermi[:,None,None]) / kT[:,None,None]
+    conc = np.exp(np.clip(exponent, -EXP_MAX, EXP_MAX)) * np.asarray(nsites)[:,None]
+    if g is not None:
+        conc = conc * g
+
+    return np.nan_to_num(conc, nan=0.)
+
+
+def solve(eform_vbm, charges, T, host, nsites, g=None, tol=1e-6, max_iter=200):
+
+    """
+    Solve the charge neutrality condition
+    sum_{d,q} q c(d,q) + p - n = 0
+    for the self-consistent Fermi level at every temperature and every set of formation energies,
+    all at once with a vectorized bisection.
+
+    Parameters
+    ----------
+    eform_vbm (array): formation energies with the Fermi level at the VBM,
+                       shape (..., n_def, n_q), NaN for charge states that weren't calculated.
+                       Any leading dimensions (e.g. chemical potential points) are solved for in one go.
+    charges (array): charge states, shape (n_q,) or (n_def, n_q)
+    T (array): temperatures (K), shape (n_T,)
+    host (EffectiveMassModel or DOSModel): model for the free carriers in the host
+    nsites (array): densities of defect sites (cm^-2), shape (n_def,)
+    [optional] g (array): degeneracies, shape (n_def, n_q). Default=1.
+    [optional] tol (float): tolerance on the Fermi level (eV). Default=1e-6.
+    [optional] max_iter (int): max. no. of bisections. Default=200.
+
+    Returns
+    -------
+    (dict) with the keys
+           efermi (array): Fermi level relative to the VBM, shape (n_T, ...)
+           n, p (array): free electron and hole densities (cm^-2), shape (n_T, ...)
+           conc (array): defect concentrations (cm^-2), shape (n_T, ..., n_def, n_q)
+
+    """
+
+    eform_vbm = np.asarray(eform_vbm, dtype=float)
+    T = np.atleast_1d(np.asarray(T, dtype=float))
+    n_def, n_q = eform_vbm.shape[-2:]
+    shape = (len(T),) + eform_vbm.shape[:-2]
+
+    ## flatten all the (T, ...) points into a single axis
+    npts = int(np.prod(shape))
+    E = np.broadcast_to(eform_vbm, shape + (n_def,n_q)).reshape(npts, n_def, n_q)
+    kT = KB * np.broadcast_to(T.reshape((-1,)+(1,)*(len(shape)-1)), shape).ravel()
+    q = np.broadcast_to(np.asarray(charges, dtype=float), (n_def,n_q))
+
+    def net_charge(ef, E, kT):
+        conc = defect_concentrations(E, q, ef, kT, nsites, g)
+        n, p = host.carriers(ef, kT)
+        return np.sum(q*conc, axis=(1,2)) + p - n
+
+    ## the net charge decreases monotonically with the Fermi level,
+    ## so start from the band edges and widen the bracket wherever it doesn't straddle the root
+    width = max(host.cbm - host.vbm, 1.)
+    lo = np.full(len(kT), host.vbm - 0.5)
+    hi = np.full(len(kT), host.cbm + 0.5)
+    for i in range(max_iter):
+        bad_lo = net_charge(lo, E, kT) < 0
+        bad_hi = net_charge(hi, E, kT) > 0
+        if not (bad_lo.any() or bad_hi.any()):
+            break
+        lo[bad_lo] -= width
+        hi[bad_hi] += width
+    else:
+        raise ValueError("could not bracket the Fermi level")
+
+    ## bisect all points at once; the points that have converged drop out
+    active = np.arange(len(kT))
+    for i in range(max_iter):
+        active = active[hi[active] - lo[active] > tol]
+        if len(active) == 0:
+            break
+        mid = 0.5 * (lo[active] + hi[active])
+        positive = net_charge(mid, E[active], kT[active]) > 0
+        lo[active[positive]] = mid[positive]
+        hi[active[~positive]] = mid[~positive]
+
+    efermi = 0.5 * (lo + hi)
+    n, p = host.carriers(efermi, kT)
+    conc = defect_concentrations(E, q, efermi, kT, nsites, g)
+
+    return {"efermi": efermi.reshape(shape), "n": n.reshape(shape), "p": p.reshape(shape),
+            "conc": conc.reshape(shape + (n_def,n_q))}
+
+
+def read_eform(dir_def, xlfile, supercell, vacuum, colname="E_form_corr"):
+
+    """
+    Read the formation energies of all charge states of a defect
+    for a given supercell and vacuum spacing from the excel file (as written by calc_Eform_corr).
+
+    Parameters
+    ----------
+    dir_def (str): path to the defect directory containing the excel file
+    xlfile (str): excel filename to read the dataframe from
+    supercell (str): supercell size as n1xn2xn3
+    vacuum (str): vacuum subdirectory name, e.g. vac_20 (None for bulk calculations)
+    [optional] colname (str): column to read. Default=E_form_corr.
+
+    Returns
+    -------
+    (array) Charge states.
+    (array) Formation energies with the Fermi level at the VBM (NaN if missing).
+
+    """
+
+    df = pd.read_excel(os.path.join(dir_def,xlfile),sheet_name=None)
+    charges, eform = [], []
+    for sheet in sorted([s for s in df.keys() if s.startswith("charge_")],
+                        key=lambda s: int(s.split("_")[-1])):
+        ## bulk calculations have no vacuum level (an empty cell in the excel file)
+        same_vac = df[sheet]['vacuum'].isna() if pd.isna(vacuum) else (df[sheet]['vacuum'] == vacuum)
+        row = df[sheet][(df[sheet]['supercell'] == supercell) & same_vac]
+        charges.append(int(sheet.split("_")[-1]))
+        if len(row) == 1 and colname in row:
+            eform.append(float(row[colname].values[0]))
+        else:
+            eform.append(np.nan)
+
+    return np.array(charges), np.array(eform)
+
+
+def calc(dirs_def, xlfile, supercell, vacuum, nsites, T, Egap=None, m_e=1., m_h=1.,
+         vasprun=None, outfile=None, logfile=None):
+
+    """
+    Evaluate the self-consistent Fermi level and the equilibrium defect and carrier concentrations
+    for a set of defects over a range of temperatures.
+
+    Parameters
+    ----------
+    dirs_def (list of str): paths to the defect directories containing the excel files
+    xlfile (str): excel filename to read the formation energies from
+    supercell (str): supercell size as n1xn2xn3 to take the formation energies from
+    vacuum (str): vacuum subdirectory name to take the formation energies from
+    nsites (list of float): densities of defect sites for each defect (cm^-2)
+    T (array): temperatures (K)
+    [optional] Egap (float): band gap for the effective mass model (eV)
+    [optional] m_e, m_h (float): effective masses for the effective mass model. Default=1.
+    [optional] vasprun (str): vasprun.xml of the host to use its DOS instead of the effective mass model
+    [optional] outfile (str): excel filename to save the results to
+    [optional] logfile (str): logfile to save output to
+
+    Returns
+    -------
+    (dict) As returned by solve(), plus the keys T, charges.
+
+    """
+
+    ## set up logging
+    if logfile:
+        myLogger = logging.setup_logging(logfile)
+    else:
+        myLogger = logging.setup_logging()
+
+
+    if vasprun:
+        myLogger.info("Using the DOS from " + vasprun)
+        host = DOSModel.from_vasprun(vasprun)
+    elif Egap is not None:
+        myLogger.info("Using the effective mass model with Egap=%.3f, m_e=%.3f, m_h=%.3f"
+                      %(Egap,m_e,m_h))
+        host = EffectiveMassModel(Egap, m_e, m_h)
+    else:
+        raise ValueError("supply either a vasprun.xml file or Egap for the host")
+
+
+    ## line up the charge states of all the defects
+    data = [read_eform(dir_def, xlfile, supercell, vacuum) for dir_def in dirs_def]
+    charges = sorted(set(q for qs,_ in data for q in qs))
+    eform = np.full((len(dirs_def),len(charges)), np.nan)
+    for i,(qs,E) in enumerate(data):
+        eform[i,[charges.index(q) for q in qs]] = E
+        myLogger.info("%s: charge states %s"%(dirs_def[i],
+                      ", ".join([str(q) for q,e in zip(qs,E) if not np.isnan(e)])))
+
+    results = solve(eform, charges, T, host, nsites)
+    results["T"], results["charges"] = np.asarray(T), charges
+
+
+    if outfile:
+        df = pd.DataFrame({"T": results["T"], "E_Fermi": results["efermi"],
+                           "n": results["n"], "p": results["p"]})
+        for i,dir_def in enumerate(dirs_def):
+            name = os.path.basename(os.path.normpath(dir_def))
+            for j,q in enumerate(charges):
+                if not np.isnan(eform[i,j]):
+                    df["%s_charge_%d"%(name,q)] = results["conc"][:,i,j]
+        writer = pd.ExcelWriter(outfile)
+        df.to_excel(writer, sheet_name='fermi_level', index=False)
+        writer.close()
+
+    return results
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Evaluate the self-consistent Fermi level and \
+                                     equilibrium defect and carrier concentrations.')
+    parser.add_argument('xlfile',help='excel filename to read the formation energies from')
+    parser.add_argument('supercell',help='supercell size to take the formation energies from')
+    parser.add_argument('vacuum',help='vacuum subdirectory to take the formation energies from')
+    parser.add_argument('outfile',help='excel filename to save the results to')
+    parser.add_argument('--dirs_def', nargs='+', required=True,
+                        help='paths to the defect directories; list each separated by a space')
+    parser.add_argument('--nsites', nargs='+', type=float, required=True,
+                        help='densities of defect sites (cm^-2) for each defect directory')
+    parser.add_argument('--T', nargs=3, type=float, default=[300,1500,100],
+                        help='temperature grid (K) as: min max step')
+    parser.add_argument('--Egap', type=float, help='band gap for the effective mass model (eV)')
+    parser.add_argument('--m_e', type=float, default=1., help='electron effective mass')
+    parser.add_argument('--m_h', type=float, default=1., help='hole effective mass')
+    parser.add_argument('--vasprun', help='vasprun.xml of the host to use its DOS instead')
+    parser.add_argument('--logfile',help='logfile to save output to')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    T = np.arange(args.T[0], args.T[1]+args.T[2]/2, args.T[2])
+    calc(args.dirs_def, args.xlfile, args.supercell, args.vacuum, args.nsites, T,
+         args.Egap, args.m_e, args.m_h, args.vasprun, args.outfile, args.logfile)
+
@@ -0,0 +1,275 @@
+import os
+import json
+import errno
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from qdef2d import campaign, logging
+from qdef2d.io.database import local_database
+from qdef2d.defects.calc_Eform_uncorr import get_i_ni
+
+
+def eform(E_def, E_bulk, q, ni, mu, vbm, efermi=None, E_corr=None):
+
+    """
+    Evaluate the defect formation energy for all charge states, all rows
+    (supercell/vacuum combinations), all chemical potential limits and all Fermi levels at once:
+    Eform = Etot(def) - Etot(pristine) - sum(n_i*mu_i) + q*(VBM + E_Fermi) [+ E_corr]
+
+    Parameters
+    ----------
+    E_def (array): total energies of the defect supercells, shape (n_q, n_rows)
+    E_bulk (array): total energies of the pristine supercells, shape (n_rows,) or (n_q, n_rows)
+    q (array): charge states, shape (n_q,)
+    ni (array): no. of atoms of each species added(+)/removed(-), shape (n_species,)
+    mu (array): chemical potentials of each species at each limit, shape (n_mu, n_species)
+    vbm (array): VBM for each row, shape (n_rows,)
+    [optional] efermi (array): Fermi levels relative to the VBM, shape (n_ef,). Default=[0].
+    [optional] E_corr (array): charge corrections, shape (n_q, n_rows). Default=no correction.
+
+    Returns
+    -------
+    (array) Formation energies, shape (n_mu, n_q, n_rows, n_ef).
+
+    """
+
+    E_def = np.atleast_2d(np.asarray(E_def, dtype=float))
+    q = np.asarray(q, dtype=float)
+    mu = np.atleast_2d(np.asarray(mu, dtype=float))
+    vbm = np.asarray(vbm, dtype=float)
+    if efermi is None:
+        efermi = np.zeros(1)
+    efermi = np.atleast_1d(np.asarray(efermi, dtype=float))
+
+    ## (n_q, n_rows) part which doesn't depend on mu or E_Fermi
+    E0 = E_def - np.asarray(E_bulk, dtype=float) + q[:,None]*vbm[None,:]
+    if E_corr is not None:
+        E0 = E0 + np.asarray(E_corr, dtype=float)
+
+    ## (n_mu,) chemical potential term
+    sum_mu = mu @ np.asarray(ni, dtype=float)
+
+    return (E0[None,:,:,None]
+            - sum_mu[:,None,None,None]
+            + q[None,:,None,None]*efermi[None,None,None,:])
+
+
+def transition_levels(eform_vbm, q):
+
+    """
+    Evaluate the charge transition levels e(q1/q2) for every pair of charge states,
+    i.e. the Fermi level at which the formation energies of q1 and q2 are equal.
+
+    Parameters
+    ----------
+    eform_vbm (array): formation energies with the Fermi level at the VBM,
+                       shape (n_q, ...) e.g. (n_q, n_rows)
+    q (array): charge states, shape (n_q,)
+
+    Returns
+    -------
+    (list of tuples) Pairs of charge states (q1,q2) with q1 > q2.
+    (array) Transition levels relative to the VBM, shape (n_pairs, ...).
+
+    """
+
+    q = np.asarray(q)
+    eform_vbm = np.asarray(eform_vbm, dtype=float)
+    inds = [(i,j) for i,j in itertools.permutations(range(len(q)),2) if q[i] > q[j]]
+    i1 = np.array([i for i,j in inds], dtype=int)
+    i2 = np.array([j for i,j in inds], dtype=int)
+    dq = (q[i1] - q[i2]).reshape((-1,) + (1,)*(eform_vbm.ndim-1))
+    pairs = [(int(q[i]),int(q[j])) for i,j in inds]
+
+    return pairs, (eform_vbm[i2] - eform_vbm[i1])/dq
+
+
+def stable_charge(eform_all, q, axis=1):
+
+    """
+    Find the lowest-energy charge state at each point.
+
+    Parameters
+    ----------
+    eform_all (array): formation energies, e.g. as returned by eform()
+    q (array): charge states
+    [optional] axis (int): axis of eform_all corresponding to the charge states. Default=1.
+
+    Returns
+    -------
+    (array) Charge state with the lowest formation energy.
+    (array) The lowest formation energy.
+
+    """
+
+    ## rows with missing energies shouldn't be picked as the most stable
+    masked = np.where(np.isnan(eform_all), np.inf, eform_all)
+    ind = np.argmin(masked, axis=axis)
+
+    return np.asarray(q)[ind], np.min(masked, axis=axis)
+
+
+def calc_all(main_system,dir_db,dir_def,xlfile,mu_limits=None,functional="GGA",
+             efermi=None,corrected=True,outfile=None,logfile=None):
+
+    """
+    Evaluate defect formation energies for every charge state, supercell/vacuum,
+    chemical potential limit and Fermi level, together with the charge transition levels.
+
+    Parameters
+    ----------
+    main_system (str): the main system e.g. MoS2, WSe2
+    dir_db (str): path to the database directory
+    dir_def (str): path to the defect directory containing the excel, initdefect.json files
+    xlfile (str): excel filename to read the total energies (and corrections) from
+    [optional] mu_limits (list of str): chemical potential limits to consider, e.g. Mo-rich.
+                                        Default=all limits found in the database.
+    [optional] functional (str): functional used for this set of calculations. Default=GGA.
+    [optional] efermi (array): Fermi levels relative to the VBM. Default=0 to Egap in 0.01 eV steps.
+    [optional] corrected (bool): add the E_corr charge corrections if available. Default=True.
+    [optional] outfile (str): filename prefix to save the results to
+                              (outfile.npz with the full tensor, outfile.xlsx with summary tables).
+                              Default=results are only returned.
+    [optional] logfile (str): logfile to save output to
+
+    Returns
+    -------
+    (dict) with the keys
+           mu_limits, charges, vacuum, supercell, efermi: the axes of the formation energy tensor
+           eform (array): formation energies, shape (n_mu, n_q, n_rows, n_ef)
+           pairs (list): charge state pairs (q1,q2)
+           ctl (array): charge transition levels e(q1/q2), shape (n_pairs, n_rows)
+
+    """
+
+    ## set up logging
+    if logfile:
+        myLogger = logging.setup_logging(logfile)
+    else:
+        myLogger = logging.setup_logging()
+
+
+    ## load list of dataframes from sheets from excel file
+    df = pd.read_excel(os.path.join(dir_def,xlfile),sheet_name=None)
+    qs = sorted([int(sheet.split("_")[-1]) for sheet in df.keys() if sheet.startswith("charge_")])
+    if 0 not in qs:
+        raise ValueError("can't find the neutral defect sheet charge_0 in %s"%xlfile)
+
+
+    ## get species i and ni from initdefect.json file
+    file_initdef = campaign.find_initdef(dir_def)
+    if not file_initdef:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), 
+                                os.path.join(dir_def,"initdefect.json"))
+    with open(os.path.join(dir_def,file_initdef), 'r') as file:
+        initdef = json.loads(file.read())
+    species_list, ni_list = [],[]
+    for defect in initdef:
+        species, ni = get_i_ni(initdef[defect])
+        species_list += species
+        ni_list += ni
+    myLogger.info("Atoms added/removed: " + \
+                  ", ".join([str(n)+"*"+i for n,i in zip(ni_list,species_list)]))
+
+
+    ## all database entries are read (once) through the database layer
+    db = local_database.load(dir_db)
+    for system in set(species_list + [main_system]):
+        if db.entry(system) is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), 
+                                    os.path.join(dir_db,"%s.json"%system))
+
+    if mu_limits is None:
+        mu_limits = sorted(set(mu_limit for species in species_list
+                               for mu_limit in db.mu_limits(species,functional)))
+        myLogger.info("Using chemical potential limits: " + ", ".join(mu_limits))
+    mu = np.array([[db.get_mu(species,functional,mu_limit)[0] for species in species_list]
+                   for mu_limit in mu_limits], dtype=float)
+
+
+    ## the neutral sheet defines the rows; line up the charged sheets to it
+    rows = df['charge_0'][['vacuum','supercell']]
+    E_def = np.full((len(qs),len(rows)), np.nan)
+    E_corr = np.zeros((len(qs),len(rows)))
+    for i,q in enumerate(qs):
+        sheet = rows.merge(df['charge_%d'%q], on=['vacuum','supercell'], how='left')
+        E_def[i] = sheet['E_def'].values
+        if corrected and q != 0:
+            if 'E_corr' in sheet:
+                E_corr[i] = sheet['E_corr'].values
+            else:
+                myLogger.warning("no E_corr column for charge_%d, using uncorrected energies"%q)
+    E_bulk = df['charge_0']['E_bulk'].values
+
+    vbms = {vac: db.get_vbm(main_system,functional,vac) for vac in rows['vacuum'].unique()}
+    vbm = rows['vacuum'].map(vbms).values.astype(float)
+    for vac in set(rows['vacuum'][np.isnan(vbm)]):
+        myLogger.info("Cannot find the VBM entry for " + vac)
+
+    if efermi is None:
+        egap = (db.lookup(main_system,functional) or {}).get("Egap",0)
+        efermi = np.arange(0, egap+0.005, 0.01)
+
+
+    ## finally, we can compute everything in one go
+    eform_all = eform(E_def, E_bulk, qs, ni_list, mu, vbm, efermi, E_corr)
+    eform_vbm = eform(E_def, E_bulk, qs, ni_list, mu, vbm, 0., E_corr)[...,0]
+    ## the chemical potentials cancel out in the transition levels
+    pairs, ctl = transition_levels(eform_vbm[0], qs)
+
+    results = {"mu_limits": list(mu_limits), "charges": qs,
+               "vacuum": list(rows['vacuum']), "supercell": list(rows['supercell']),
+               "efermi": efermi, "eform": eform_all, "pairs": pairs, "ctl": ctl}
+
+
+    if outfile:
+        np.savez(os.path.join(dir_def,outfile+".npz"),
+                 **{key: np.asarray(val) for key,val in results.items()})
+        writer = pd.ExcelWriter(os.path.join(dir_def,outfile+".xlsx"))
+        df_ctl = rows.copy()
+        for (q1,q2),level in zip(pairs,ctl):
+            df_ctl["e(%+d/%+d)"%(q1,q2)] = level
+        df_ctl.to_excel(writer, sheet_name='transition_levels', index=False)
+        for mu_limit,eform_mu in zip(mu_limits,eform_vbm):
+            df_mu = rows.copy()
+            for q,eform_q in zip(qs,eform_mu):
+                df_mu["charge_%d"%q] = eform_q
+            df_mu.to_excel(writer, sheet_name=mu_limit[:31], index=False)
+        writer.close()
+
+    return results
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Evaluate defect formation energies and \
+                                     charge transition levels for all chemical potential limits.')
+    parser.add_argument('main_system',help='the main system e.g. MoS2, WSe2')
+    parser.add_argument('dir_db',help='path to the database directory')
+    parser.add_argument('dir_def',help='path to the defect directory containing the \
+                                        excel, initdefect.json files')
+    parser.add_argument('xlfile',help='excel filename to read the dataframe from')
+    parser.add_argument('outfile',help='filename prefix to save the results to')
+    parser.add_argument('--mu_limits', nargs='+', help='chemical potential limits to consider; \
+                        list each limit separated by a space. Default=all limits in the database')
+    parser.add_argument('--functional',help='functional used for this set of calculations',
+                        default='GGA')
+    parser.add_argument('--efermi', nargs=3, type=float,
+                        help='Fermi level grid relative to the VBM as: min max step')
+    parser.add_argument('--uncorrected',help='do not add the charge corrections',
+                        default=False,action='store_true')
+    parser.add_argument('--logfile',help='logfile to save output to')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    efermi = None
+    if args.efermi:
+        efermi = np.arange(args.efermi[0], args.efermi[1]+args.efermi[2]/2, args.efermi[2])
+
+    calc_all(args.main_system, args.dir_db, args.dir_def, args.xlfile, args.mu_limits,
+             args.functional, efermi, not args.uncorrected, args.outfile, args.logfile)
+
@@ -0,0 +1,273 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from pymatgen.io.vasp.inputs import Poscar
+from qdef2d import campaign, logging
+from qdef2d.defects import extrapolate, setup_defect_calcs
+
+
+def cost(cells, vacs):
+
+    """
+    Relative cost of a set of supercell calculations.
+    Plane-wave DFT scales roughly as the cube of the no. of atoms,
+    and linearly with the vacuum spacing through the no. of plane waves.
+
+    Parameters
+    ----------
+    cells (array): supercell sizes [n1,n2,n3], shape (n_jobs, 3)
+    vacs (array): vacuum spacings, shape (n_jobs,)
+
+    Returns
+    -------
+    (array) Relative cost of each calculation.
+
+    """
+
+    return np.prod(np.asarray(cells, dtype=float), axis=-1)**3 * np.asarray(vacs, dtype=float)
+
+
+def _rank(X):
+
+    return np.linalg.matrix_rank(X) if len(X) else 0
+
+
+def next_jobs(X_done, X_pending, X_cand, costs, sigma, tol, max_jobs):
+
+    """
+    Choose the most informative calculations to run next for one series of formation energies.
+    While the fit is underdetermined, the cheapest candidates that pin down a new parameter are added;
+    after that, candidates are added greedily by the reduction in the variance of
+    the extrapolated value per unit cost (using the Sherman-Morrison update),
+    until the predicted standard error is within tolerance.
+
+    Parameters
+    ----------
+    X_done (array): design matrix of the completed calculations, shape (n_done, n_params)
+    X_pending (array): design matrix of calculations that are set up but not finished yet
+    X_cand (array): design matrix of the candidate calculations, shape (n_cand, n_params)
+    costs (array): relative cost of each candidate, shape (n_cand,)
+    sigma (float): noise level of the formation energies (eV)
+    tol (float): target standard error of the extrapolated value (eV)
+    max_jobs (int): max. no. of calculations to choose
+
+    Returns
+    -------
+    (list of int) Indices of the chosen candidates.
+    (float) Predicted standard error of the extrapolated value once they are done
+            (inf if the fit is still underdetermined).
+
+    """
+
+    X = np.vstack([X_done, X_pending])
+    n_params = X_cand.shape[1]
+    chosen = []
+    left = list(np.argsort(costs, kind='stable'))
+
+    ## make sure every parameter is determined first, cheapest first
+    while _rank(X) < n_params and left and len(chosen) < max_jobs:
+        for i in left:
+            if _rank(np.vstack([X, X_cand[i]])) > _rank(X):
+                break
+        else:
+            break
+        chosen.append(i)
+        left.remove(i)
+        X = np.vstack([X, X_cand[i]])
+    if _rank(X) < n_params:
+        return chosen, np.inf
+
+    C = np.linalg.inv(X.T @ X)
+    while sigma*np.sqrt(C[0,0]) > tol and left and len(chosen) < max_jobs:
+        ## reduction in var(E_inf) for adding each candidate, all candidates at once
+        CX = X_cand[left] @ C
+        gain = CX[:,0]**2 / (1 + np.sum(CX*X_cand[left], axis=1))
+        best = left[int(np.argmax(gain/costs[left]))]
+        chosen.append(best)
+        left.remove(best)
+        Cx = C @ X_cand[best]
+        C = C - np.outer(Cx, Cx)/(1 + X_cand[best] @ Cx)
+
+    return chosen, sigma*np.sqrt(C[0,0])
+
+
+def _natoms(dir_def_main, vac):
+
+    ## no. of atoms in the unit cell, from the POSCAR used to set up the supercells
+    poscar = Poscar.from_file(os.path.join(dir_def_main,"POSCAR_vac_%d"%vac))
+    return int(np.sum(poscar.natoms))
+
+
+def plan(dir_def_main, xlfile, qs, cells, vacs, tol=0.02, sigma=0.01, max_jobs=4,
+         corrected=False, dir_ref=None, functional='PBE', kppa=440, dry_run=False, logfile=None):
+
+    """
+    Plan the next (supercell, vacuum, charge) calculations of a defect campaign
+    from the formation energies of the calculations that have already been completed,
+    and set them up. Charge states whose extrapolated formation energy
+    is already within tolerance get no new calculations.
+
+    Parameters
+    ----------
+    dir_def_main (str): path to the main defect directory
+    xlfile (str): excel filename to read the formation energies from
+                  (as written by calc_Eform_uncorr/calc_Eform_corr; it need not exist yet)
+    qs (list of ints): list of charge states
+    cells (list of tuples of ints): candidate [n1,n2,n3] supercell sizes
+    vacs (list of ints): candidate vacuum spacings
+    [optional] tol (float): target standard error of the extrapolated formation energy (eV).
+                            Default=0.02 eV.
+    [optional] sigma (float): minimum noise level assumed for the formation energies (eV).
+                              Default=0.01 eV.
+    [optional] max_jobs (int): max. no. of new calculations per charge state. Default=4.
+    [optional] corrected (bool): extrapolate the corrected formation energies of the charged defects
+                                 instead of the uncorrected ones. Default=False.
+    [optional] dir_ref (str): path to the main reference directory,
+                              to also set up any reference calculations that are needed
+    [optional] functional (str): type of function: PBE(default)/SCAN+rVV10
+    [optional] kppa (int): kpoint density per reciprocal atom. Default=440 pra.
+    [optional] dry_run (bool): only report the plan, don't set up anything. Default=False.
+    [optional] logfile (str): logfile to save output to
+
+    Returns
+    -------
+    (DataFrame) The planned calculations with the columns
+                charge, supercell, vacuum, cost, reason
+
+    """
+
+    ## set up logging
+    if logfile:
+        myLogger = logging.setup_logging(logfile)
+    else:
+        myLogger = logging.setup_logging()
+
+
+    ## completed calculations
+    if os.path.exists(os.path.join(dir_def_main,xlfile)):
+        data = extrapolate.read_energies([dir_def_main], xlfile)
+    else:
+        data = pd.DataFrame(columns=['charge','vacuum','supercell','N','Lz',
+                                     'E_form_uncorr','E_form_corr'])
+    ## calculations that have been set up already
+    manifest = campaign.index(dir_def_main)
+
+    ## candidate grid
+    cand_cells = ["%dx%dx%d"%tuple(cell) for cell in cells for vac in vacs]
+    cand_vacs = ["vac_%d"%vac for cell in cells for vac in vacs]
+    cand_N = np.array([np.prod(cell)*_natoms(dir_def_main,vac) for cell in cells for vac in vacs])
+    cand_Lz = np.array([float(vac) for cell in cells for vac in vacs])
+    cand_cost = cost([cell for cell in cells for vac in vacs], cand_Lz)
+
+    jobs = []
+    for q in qs:
+        if q == 0 or corrected:
+            form, colname = 'corrected', 'E_form_corr'
+        else:
+            form, colname = 'uncorrected', 'E_form_uncorr'
+
+        dfq = data[(data['charge'] == q) & data[colname].notna()]
+        done = set(zip(dfq['supercell'], dfq['vacuum']))
+        pending = set((leaf.supercell, leaf.vacuum) for leaf in manifest.leaves(charge=q)) - done
+        new = [i for i,key in enumerate(zip(cand_cells,cand_vacs))
+               if key not in done and key not in pending]
+
+        X_done = extrapolate.design_matrix(dfq['N'].values, dfq['Lz'].values, form)
+        X_cand = extrapolate.design_matrix(cand_N, cand_Lz, form)
+        pend = [i for i,key in enumerate(zip(cand_cells,cand_vacs)) if key in pending]
+        n_params = X_cand.shape[1]
+
+        ## estimate the noise from the fit residuals if there are enough points
+        noise = sigma
+        if len(dfq) > n_params:
+            out = extrapolate.fit(dfq['N'].values[None], dfq['Lz'].values[None],
+                                  dfq[colname].values[None], form, n_boot=200)
+            rss = out['rms'][0]**2 * len(dfq)
+            noise = max(np.sqrt(rss/(len(dfq)-n_params)), sigma)
+            myLogger.info("charge_%d: E_inf = %.4f eV, bootstrap error %.4f eV, noise %.4f eV"
+                          %(q,out['E_inf'][0],out['E_inf_err'][0],noise))
+
+        chosen, se = next_jobs(X_done, X_cand[pend], X_cand[new], cand_cost[new],
+                               noise, tol, max_jobs)
+        if not chosen:
+            myLogger.info("charge_%d: converged (predicted error %.4f eV)"%(q,se))
+        for i in chosen:
+            jobs.append({"charge": q, "supercell": cand_cells[new[i]],
+                         "vacuum": cand_vacs[new[i]], "cost": cand_cost[new[i]],
+                         "reason": "charge_%d, predicted error %.4f eV"%(q,se)})
+
+
+    ## every charged defect is lined up with the neutral defect (and pristine reference)
+    ## of the same supercell and vacuum, so those need to be calculated too
+    is_neutral = (data['charge'] == 0)
+    neutral = set(zip(data['supercell'][is_neutral], data['vacuum'][is_neutral]))
+    neutral |= set((leaf.supercell, leaf.vacuum) for leaf in manifest.leaves(charge=0))
+    neutral |= set((job["supercell"], job["vacuum"]) for job in jobs if job["charge"] == 0)
+    for job in list(jobs):
+        if (job["supercell"], job["vacuum"]) not in neutral:
+            neutral.add((job["supercell"], job["vacuum"]))
+            jobs.append({"charge": 0, "supercell": job["supercell"], "vacuum": job["vacuum"],
+                         "cost": job["cost"], "reason": "neutral reference for charged defects"})
+    jobs = pd.DataFrame(jobs, columns=["charge","supercell","vacuum","cost","reason"])
+
+    for job in jobs.itertuples():
+        myLogger.info("planned: charge_%d %s %s (cost %.3g; %s)"
+                      %(job.charge,job.supercell,job.vacuum,job.cost,job.reason))
+    myLogger.info("total cost of planned calculations: %.3g"%jobs['cost'].sum())
+
+
+    if not dry_run:
+        manifest_ref = campaign.index(dir_ref) if dir_ref else None
+        for job in jobs.itertuples():
+            cell = [int(n) for n in job.supercell.split('x')]
+            vac = int(job.vacuum.split('_')[-1])
+            setup_defect_calcs.setup(dir_def_main,[job.charge],[cell],[vac],functional,kppa,
+                                     myLogger=myLogger)
+            if manifest_ref and manifest_ref.get(0,job.supercell,job.vacuum) is None:
+                setup_defect_calcs.setup(dir_ref,[0],[cell],[vac],functional,kppa,bulkref=True,
+                                         myLogger=myLogger)
+                manifest_ref = campaign.index(dir_ref)
+
+    return jobs
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Plan and set up the next most informative \
+                                     defect calculations.')
+    parser.add_argument('dir_def_main', help='path to main defect directory')
+    parser.add_argument('xlfile',help='excel filename to read the formation energies from')
+    parser.add_argument('--qs', nargs='+', help='(required) charge states; \
+                        list each charge state separated by a space', type=int)
+    parser.add_argument('--cells', nargs='+', help='(required) candidate supercell sizes; \
+                        list each supercell size as n1xn2xn3 separated by a space')
+    parser.add_argument('--vacs', nargs='+', help='(required) candidate vacuum spacings; \
+                        list each vacuum spacing separated by a space', type=int)
+    parser.add_argument('--tol', type=float, default=0.02,
+                        help='target error of the extrapolated formation energy (eV)')
+    parser.add_argument('--sigma', type=float, default=0.01,
+                        help='minimum noise level of the formation energies (eV)')
+    parser.add_argument('--max_jobs', type=int, default=4,
+                        help='max. no. of new calculations per charge state')
+    parser.add_argument('--corrected',help='extrapolate the corrected formation energies',
+                        default=False,action='store_true')
+    parser.add_argument('--dir_ref', help='path to main reference directory')
+    parser.add_argument('--functional', default='PBE',
+                        help='type of function: PBE(default)/SCAN+rVV10')
+    parser.add_argument('--kppa', type=int, help='kpt density (pra)', default=440)
+    parser.add_argument('--dry_run',help='only report the plan',
+                        default=False,action='store_true')
+    parser.add_argument('--logfile',help='logfile to save output to')
+
+    ## parse the given arguments
+    args = parser.parse_args()
+
+
+    plan(args.dir_def_main, args.xlfile, args.qs,
+         [[int(n) for n in cell.split('x')] for cell in args.cells], args.vacs,
+         args.tol, args.sigma, args.max_jobs, args.corrected, args.dir_ref,
+         args.functional, args.kppa, args.dry_run, args.logfile)
+
@@ -2,12 +2,14 @@ import os
 import errno
 import shutil
 import argparse
-from qdef2d import osutils, logging
+from qdef2d import campaign, logging
 from qdef2d.io.vasp import incar, kpoints, submit
 from qdef2d.defects import gen_defect_supercell
+from qdef2d.defects.corrections import image_energy
 
 
-def setup(dir_def_main,qs,cells,vacs,functional='PBE',kppa=400,bulkref=False):
+def setup(dir_def_main,qs,cells,vacs,functional='PBE',kppa=400,bulkref=False,
+          image_tol=None,eps_slab=None,d_slab=None,dbentry=None,myLogger=None):
 
     """ 
     Generate input files for defect calulations.
@@ -21,20 +23,28 @@ def setup(dir_def_main,qs,cells,vacs,functional='PBE',kppa=400,bulkref=False):
     [optional] functional (str): type of function: PBE(default)/SCAN+rVV10
     [optional] kppa (int): kpoint density per reciprocal atom. Default=400 pra.
     [optional] bulkref (str): write files for reference calculations? Default=False.
+    [optional] image_tol (float): skip the charged defect calculations in supercells larger than 
+                                  the smallest one whose estimated image-interaction error 
+                                  is already below this tolerance (eV); 
+                                  requires eps_slab and d_slab, or dbentry (see image_energy). 
+                                  Default=None (set up all calculations).
+    [optional] eps_slab (float): ave. slab dielectric constant (only used with image_tol)
+    [optional] d_slab (float): slab thickness in Angstroms (only used with image_tol)
+    [optional] dbentry (str): path to the relevant database entry .json file (only used with image_tol)
+    [optional] myLogger (Logger): logger to report to, when called from another script;
+                                  setting up a new one would remove the handlers of the caller
     
     """
 
     ## set up logging
-    myLogger = logging.setup_logging()
+    if not myLogger:
+        myLogger = logging.setup_logging()
     
     
     ## check if initdef file is present in dir_def_main ?
     if not bulkref:
-        if osutils.check_file_exists(dir_def_main,"initdef") == True:
-            for file in os.listdir(dir_def_main): 
-                if file.startswith("initdef"):
-                    file_initdef = file
-        else:
+        file_initdef = campaign.find_initdef(dir_def_main)
+        if not file_initdef:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), 
                                     os.path.join(dir_def_main,"initdefect.json"))
             
@@ -52,6 +62,18 @@ def setup(dir_def_main,qs,cells,vacs,functional='PBE',kppa=400,bulkref=False):
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), pos_file)
     
     
+    ## pre-screen the charged defect calculations by their image-interaction error
+    skip = set()
+    if image_tol and not bulkref:
+        ## (the database entries label PBE as GGA)
+        estimates = image_energy.estimate(dir_def_main,qs,cells,vacs,eps_slab,d_slab,dbentry,
+                                          functional='GGA' if functional == 'PBE' else functional,
+                                          myLogger=myLogger)
+        keep = image_energy.select(estimates,image_tol)
+        skip = set(zip(estimates["charge"][~keep],estimates["supercell"][~keep],
+                       estimates["vacuum"][~keep]))
+    
+    
     for q in qs:
         dir_q = os.path.join(dir_def_main,"charge_%d"%q)
         ## create and enter charge subdirectory
@@ -68,6 +90,10 @@ def setup(dir_def_main,qs,cells,vacs,functional='PBE',kppa=400,bulkref=False):
             os.chdir(dir_cell)
             
             for vac in vacs:
+                if (q,cell_str,"vac_%d"%vac) in skip:
+                    myLogger.info("skipping charge_%d/%s/vac_%d: image interaction "%(q,cell_str,vac)
+                                  + "already below %.4f eV in a smaller supercell"%image_tol)
+                    continue
                 dir_vac = os.path.join(dir_cell,"vac_%d"%vac)
                 ## create and enter vacuum subdirectory
                 if not os.path.exists(dir_vac):
@@ -126,11 +152,20 @@ if __name__ == '__main__':
     parser.add_argument('--kppa', type=int, help='kpt density (pra)', default=440)
     parser.add_argument('--bulkref',help='write files for reference calculations?',
                         default=False,action='store_true')
+    parser.add_argument('--image_tol', type=float, help='skip charged defect calculations \
+                        in supercells larger than needed for an image interaction below this (eV)')
+    parser.add_argument('--eps_slab', type=float,
+                        help='average slab dielectric constant (with --image_tol)')
+    parser.add_argument('--d_slab', type=float,
+                        help='slab thickness in Angstroms (with --image_tol)')
+    parser.add_argument('--dbentry', help='path to the relevant database entry .json file \
+                        (with --image_tol, instead of --eps_slab and --d_slab)')
       
     ## parse the given arguments
     args = parser.parse_args()
     
 
     setup(args.dir_def_main,args.qs,[[int(n) for n in cell.split('x')] for cell in args.cells],
-          args.vacs,args.functional,args.kppa,args.bulkref)
+          args.vacs,args.functional,args.kppa,args.bulkref,
+          args.image_tol,args.eps_slab,args.d_slab,args.dbentry)
     
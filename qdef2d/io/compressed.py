@@ -0,0 +1,239 @@
+import os
+import re
+import bz2
+import gzip
+import lzma
+import struct
+import tempfile
+import contextlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+## compressed file extensions that we know how to read, in order of preference
+COMPRESSED_EXTS = ['.gz', '.bz2', '.xz', '.lzma']
+
+## magic bytes marking the start of a bzip2 stream followed by its first block
+re_bz2_stream = re.compile(rb'BZh[1-9]1AY&SY')
+
+
+def find_file(directory, filename):
+
+    """
+    Find a file in a given directory, or else its compressed counterpart
+    (e.g. vasprun.xml.gz, OUTCAR.xz, LOCPOT.bz2).
+
+    Parameters
+    ----------
+    directory (str): directory to look in
+    filename (str): name of the uncompressed file
+
+    Returns
+    -------
+    (str) Path to the (possibly compressed) file, or None if it can't be found.
+
+    """
+
+    for ext in [''] + COMPRESSED_EXTS:
+        path = os.path.join(directory, filename + ext)
+        if os.path.isfile(path):
+            return path
+
+    return None
+
+
+def is_compressed(path):
+
+    return os.path.splitext(path)[1] in COMPRESSED_EXTS
+
+
+def zopen(path, mode='rb'):
+
+    """
+    Open a file which may or may not be compressed.
+    The compression format is determined from the file extension
+    and the contents are decompressed on the fly as they are read.
+
+    Parameters
+    ----------
+    path (str): path to the file
+    [optional] mode (str): 'rb' (default) or 'rt'
+
+    Returns
+    -------
+    File object.
+
+    """
+
+    ext = os.path.splitext(path)[1]
+    if ext == '.gz':
+        return gzip.open(path, mode)
+    elif ext == '.bz2':
+        return bz2.open(path, mode)
+    elif ext in ['.xz', '.lzma']:
+        return lzma.open(path, mode)
+    else:
+        return open(path, mode)
+
+
+def _bz2_streams(f, chunksize):
+
+    ## split a multi-stream bzip2 file, as written by pbzip2, into its independent streams
+    buf = b''
+    start = 1
+    while True:
+        chunk = f.read(chunksize)
+        buf += chunk
+        ## don't match the stream header at the very start of the buffer
+        match = re_bz2_stream.search(buf, start)
+        while match:
+            yield buf[:match.start()]
+            buf = buf[match.start():]
+            match = re_bz2_stream.search(buf, 1)
+        if not chunk:
+            break
+        ## re-scan the last few bytes in case a stream header straddles two chunks
+        start = max(len(buf)-9, 1)
+    if buf:
+        yield buf
+
+
+def _is_multistream_bz2(path, nbytes=2**21):
+
+    ## pbzip2 writes one stream per 900k block,
+    ## so a second stream header should turn up within the first couple of MB
+    with open(path, 'rb') as f:
+        head = f.read(nbytes)
+    return re_bz2_stream.search(head, 1) is not None
+
+
+def _bgzf_blocks(f, batchsize):
+
+    ## split a BGZF file (blocked gzip, as written by bgzip) into its blocks;
+    ## the size of each block is stored in the 'BC' extra subfield of its header.
+    ## BGZF blocks are at most 64KB each, so batch them up a bit
+    batch = []
+    while True:
+        header = f.read(18)
+        if len(header) < 18:
+            break
+        bsize = struct.unpack('<H', header[16:18])[0]
+        batch.append(header + f.read(bsize - 17))
+        if len(batch) >= batchsize:
+            yield b''.join(batch)
+            batch = []
+    if batch:
+        yield b''.join(batch)
+
+
+def _is_bgzf(path):
+
+    with open(path, 'rb') as f:
+        header = f.read(18)
+    return (len(header) == 18 and header[:4] == b'\x1f\x8b\x08\x04'
+            and header[12:14] == b'BC')
+
+
+def _decompress_bz2(data):
+
+    return bz2.decompress(data)
+
+
+def _decompress_gzip(data):
+
+    return gzip.decompress(data)
+
+
+def _parallel_map(func, blocks, nthreads):
+
+    ## decompress blocks in a pool of threads (the zlib and bz2 modules release the GIL),
+    ## keeping a bounded number of blocks in flight and yielding them in order
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        queue = collections.deque()
+        for block in blocks:
+            queue.append(executor.submit(func, block))
+            if len(queue) >= 2*nthreads:
+                yield queue.popleft().result()
+        while queue:
+            yield queue.popleft().result()
+
+
+def iter_blocks(path, blocksize=2**22, nthreads=None):
+
+    """
+    Iterate over the decompressed contents of a (possibly compressed) file block by block.
+    Files which consist of independently compressed blocks
+    (multi-stream bzip2 as written by pbzip2, or BGZF as written by bgzip)
+    are decompressed in parallel threads.
+    Anything else is decompressed as a single stream.
+
+    Parameters
+    ----------
+    path (str): path to the file
+    [optional] blocksize (int): no. of bytes to read at a time. Default=4MB.
+    [optional] nthreads (int): no. of threads for parallel decompression.
+                               Default=no. of cpus.
+
+    Yields
+    ------
+    (bytes) Consecutive blocks of the decompressed file contents.
+
+    """
+
+    if nthreads is None:
+        nthreads = os.cpu_count() or 1
+    ext = os.path.splitext(path)[1]
+
+    if ext == '.bz2' and nthreads > 1 and _is_multistream_bz2(path):
+        with open(path, 'rb') as f:
+            for data in _parallel_map(_decompress_bz2, _bz2_streams(f, blocksize), nthreads):
+                yield data
+
+    elif ext == '.gz' and nthreads > 1 and _is_bgzf(path):
+        with open(path, 'rb') as f:
+            for data in _parallel_map(_decompress_gzip, _bgzf_blocks(f, max(blocksize//2**16,1)),
+                                      nthreads):
+                yield data
+
+    else:
+        with zopen(path, 'rb') as f:
+            while True:
+                data = f.read(blocksize)
+                if not data:
+                    break
+                yield data
+
+
+@contextlib.contextmanager
+def uncompressed(path, directory=None):
+
+    """
+    Context manager providing an uncompressed version of a file
+    for external programs that can't read compressed files themselves.
+    If the file is not compressed, its path is returned as is.
+    Otherwise, it is decompressed into a temporary file that is removed afterwards.
+
+    Parameters
+    ----------
+    path (str): path to the (possibly compressed) file
+    [optional] directory (str): where to put the temporary file.
+                                Default=same directory as the compressed file.
+
+    """
+
+    if not is_compressed(path):
+        yield path
+        return
+
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(path))
+    basename = os.path.splitext(os.path.basename(path))[0]
+    fd, tmpfile = tempfile.mkstemp(prefix=basename+'.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for data in iter_blocks(path):
+                f.write(data)
+        yield tmpfile
+    finally:
+        os.remove(tmpfile)
+
@@ -5,6 +5,7 @@ import json
 import argparse
 from pymatgen.io.vasp.outputs import Poscar, Vasprun
 from qdef2d import osutils, logging
+from qdef2d.io import compressed
 
 
 class DatabaseEntry(object):
@@ -71,8 +72,8 @@ class DatabaseEntry(object):
                         if func.split('+')[-1] == "soc":
                              dir_vac = os.path.join(dir_vac,"soc")
 
-                        vrfile = os.path.join(dir_vac,'vasprun.xml')
-                        if not os.path.exists(vrfile):
+                        vrfile = compressed.find_file(dir_vac,'vasprun.xml')
+                        if not vrfile:
                             self.log.info("vasprun.xml file does not exist")
                         else:
                             if vac not in mater[func]:
@@ -88,7 +89,7 @@ class DatabaseEntry(object):
                                 ## get mu = energy per formula unit
                                 ## usually vacuum spacing of 20 A is sufficiently well-converged
                                 ## so we'll use that energy...
-                                structure = Poscar.from_file(os.path.join(dir_vac,'POSCAR')).structure
+                                structure = Poscar.from_file(compressed.find_file(dir_vac,'POSCAR')).structure
                                 formula_units = (structure.composition.num_atoms /
                                                  structure.composition.reduced_composition.num_atoms)
                                 mater[func].update({"mu": vr.final_energy/formula_units})
@@ -104,12 +105,12 @@ class DatabaseEntry(object):
                
             else:
                 ## for bulk system, this should be a lot more straightforward
-                structure = Poscar.from_file(os.path.join(dir_func,'POSCAR')).structure
+                structure = Poscar.from_file(compressed.find_file(dir_func,'POSCAR')).structure
                 formula_units = (structure.composition.num_atoms /
                                  structure.composition.reduced_composition.num_atoms)
                 
-                vrfile = os.path.join(dir_func,'vasprun.xml')
-                if not os.path.exists(vrfile):
+                vrfile = compressed.find_file(dir_func,'vasprun.xml')
+                if not vrfile:
                     self.log.info("vasprun.xml file does not exist")
                 else:
                     vr = Vasprun(vrfile)
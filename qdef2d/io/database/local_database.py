@@ -0,0 +1,227 @@
+import os
+import json
+
+
+class LocalDatabase(object):
+
+    """
+    This class provides read access to all the simple database entries
+    (<system>.json files, as created by DatabaseEntry) in a database directory.
+    Every file is loaded only once and indexed by (system, functional, mu-limit, vacuum),
+    and files are only re-read when they have been modified.
+    If an entry has more than one key for the same mu-limit, the last one is indexed,
+    and only asking for the chemical potential at that limit (get_mu) raises an error.
+
+    """
+
+    def __init__(self, dir_db):
+
+        self.dir_db = dir_db
+        self._stamps = {}
+        self._entries = {}
+        self._index = {}
+        self._conflicts = {}
+        self.refresh()
+
+        return
+
+
+    def refresh(self):
+
+        """
+        Re-read any database entries which have been added or modified since the last refresh,
+        and forget about any which have been removed.
+
+        """
+
+        stamps = {}
+        with os.scandir(self.dir_db) as it:
+            for entry in it:
+                if entry.name.endswith('.json') and entry.is_file():
+                    stat = entry.stat()
+                    stamps[entry.name[:-5]] = (stat.st_mtime_ns, stat.st_size)
+
+        for system in set(self._stamps) - set(stamps):
+            self._drop(system)
+        for system,stamp in stamps.items():
+            if self._stamps.get(system) != stamp:
+                self._drop(system)
+                self._load(system)
+                self._stamps[system] = stamp
+
+        return
+
+
+    def _drop(self, system):
+
+        self._stamps.pop(system, None)
+        self._entries.pop(system, None)
+        for key in [key for key in self._index if key[0] == system]:
+            del self._index[key]
+        for key in [key for key in self._conflicts if key[0] == system]:
+            del self._conflicts[key]
+
+        return
+
+
+    def _load(self, system):
+
+        with open(os.path.join(self.dir_db, "%s.json"%system), 'r') as file:
+            mater = json.loads(file.read())
+        self._entries[system] = mater
+
+        ## entries have the format
+        ## {functional: {mu: xxx, mu_<mu-limit> (<formula>): xxx, vac_x: {VBM: xxx}, ...}}
+        for func,props in mater.items():
+            base = {}
+            for key,val in props.items():
+                if key.startswith('mu_'):
+                    mu_limit = key[3:].split(' (')[0]
+                    if (system, func, mu_limit, None) in self._index:
+                        ## keep the last one, but remember the clash for get_mu
+                        keys = self._conflicts.get((system, func, mu_limit),
+                                                   [self._index[(system, func, mu_limit, None)]['key']])
+                        self._conflicts[(system, func, mu_limit)] = keys + [key]
+                    self._index[(system, func, mu_limit, None)] = {'mu': val, 'key': key}
+                elif isinstance(val, dict):
+                    self._index[(system, func, None, key)] = val
+                else:
+                    base[key] = val
+            self._index[(system, func, None, None)] = base
+
+        return
+
+
+    def systems(self):
+
+        return sorted(self._entries)
+
+
+    def entry(self, system):
+
+        """
+        Get the full database entry for a system, or None if it doesn't exist.
+
+        """
+
+        return self._entries.get(system)
+
+
+    def lookup(self, system, functional, mu_limit=None, vacuum=None):
+
+        """
+        Get the properties stored for a given system and functional,
+        either for the system itself (e.g. mu, Egap, eps_slab, d_slab),
+        for a particular chemical potential limit (mu)
+        or for a particular vacuum spacing (e.g. VBM).
+
+        Parameters
+        ----------
+        system (str): the system e.g. MoS2, Mo, S
+        functional (str): functional e.g. GGA
+        [optional] mu_limit (str): chemical potential limit, e.g. Mo-rich
+        [optional] vacuum (str): vacuum subdirectory name, e.g. vac_20
+
+        Returns
+        -------
+        (dict) The properties, or None if there is no such entry.
+
+        """
+
+        return self._index.get((system, functional, mu_limit, vacuum))
+
+
+    def mu_limits(self, system, functional):
+
+        return sorted(key[2] for key in self._index
+                      if key[:2] == (system, functional) and key[2] is not None)
+
+
+    def get_mu(self, system, functional, mu_limit=None):
+
+        """
+        Get the chemical potential of a system at a given limit,
+        falling back to the plain mu (energy per formula unit)
+        if there is no entry for that limit.
+        Raises a ValueError if the entry has more than one key for that limit.
+
+        Returns
+        -------
+        (float) Chemical potential, or None if there is no entry at all.
+        (str) Name of the database key it came from.
+
+        """
+
+        if (system, functional, mu_limit) in self._conflicts:
+            raise ValueError("%s.json has more than one %s limit for %s: %s"
+                             %(system, mu_limit, functional,
+                               ", ".join(self._conflicts[(system, functional, mu_limit)])))
+        props = mu_limit and self.lookup(system, functional, mu_limit=mu_limit)
+        if props:
+            return props['mu'], props['key']
+        props = self.lookup(system, functional)
+        if props and 'mu' in props:
+            return props['mu'], 'mu'
+
+        return None, None
+
+
+    def get_vbm(self, system, functional, vacuum):
+
+        props = self.lookup(system, functional, vacuum=vacuum)
+        if props is None:
+            return None
+
+        return props.get('VBM')
+
+
+    def get_slab(self, system, functional):
+
+        """
+        Get the averaged slab dielectric constant and slab thickness of a system.
+
+        Returns
+        -------
+        (float) eps_slab (read from eps_ave or eps_slab), or None if not present
+        (float) d_slab, or None if not present
+
+        """
+
+        props = self.lookup(system, functional) or {}
+        eps_slab = props.get('eps_ave', props.get('eps_slab'))
+        d_slab = props.get('d_slab')
+
+        ## these may have been stored as strings straight from the command line
+        return (None if eps_slab is None else float(eps_slab),
+                None if d_slab is None else float(d_slab))
+
+
+## databases that have already been loaded in this process, keyed by directory
+_databases = {}
+
+
+def load(dir_db):
+
+    """
+    Get the LocalDatabase for a database directory.
+    The database is only loaded from disk the first time it is requested;
+    afterwards only entries which have changed on disk are re-read.
+
+    Parameters
+    ----------
+    dir_db (str): path to the database directory
+
+    Returns
+    -------
+    (LocalDatabase) The database.
+
+    """
+
+    key = os.path.abspath(dir_db)
+    if key in _databases:
+        _databases[key].refresh()
+    else:
+        _databases[key] = LocalDatabase(dir_db)
+
+    return _databases[key]
+
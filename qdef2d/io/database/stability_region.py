@@ -0,0 +1,289 @@
+import os
+import argparse
+import numpy as np
+from scipy.optimize import linprog
+from scipy.spatial import HalfspaceIntersection
+from pymatgen.core.composition import Composition
+from qdef2d import logging
+from qdef2d.io.database import local_database
+from qdef2d.io.database.database_entry import DatabaseEntry
+
+
+## tag used for the chemical potential limits derived from the stability region
+HULL_TAG = "hull"
+
+
+def _composition(system):
+
+    ## database entries are named after their formula, optionally followed by _<tag>,
+    ## e.g. MoS2, Mo, MoS2_bulk; anything else is not a phase
+    try:
+        return Composition(system.split('_')[0])
+    except ValueError:
+        return None
+
+
+def get_phases(main_system, dir_db, functional="GGA"):
+
+    """
+    Collect all the phases in the local database made up of the elements of the host,
+    together with their energies per formula unit.
+
+    Parameters
+    ----------
+    main_system (str): the host e.g. MoS2, WSe2
+    dir_db (str): path to the database directory
+    [optional] functional (str): functional to take the energies from. Default=GGA.
+
+    Returns
+    -------
+    (list of str) Elements of the host.
+    (list of str) Names of the phases (database entries).
+    (array) Composition of each phase (atoms per reduced formula unit), shape (n_phases, n_elements)
+    (array) Energy of each phase per reduced formula unit, shape (n_phases,)
+
+    """
+
+    db = local_database.load(dir_db)
+    host = _composition(main_system)
+    if host is None:
+        raise ValueError("can't parse the formula of the host %s"%main_system)
+    elements = sorted(str(el) for el in host.elements)
+
+    phases, X, E = [], [], []
+    for system in db.systems():
+        comp = _composition(system)
+        props = db.lookup(system, functional)
+        if comp is None or not props or "mu" not in props:
+            continue
+        amounts = comp.reduced_composition.get_el_amt_dict()
+        if not set(amounts).issubset(elements):
+            continue
+        phases.append(system)
+        X.append([amounts.get(el,0.) for el in elements])
+        E.append(props["mu"])
+
+    if main_system not in phases:
+        raise ValueError("can't find the %s energy of %s in %s"%(functional,main_system,dir_db))
+
+    return elements, phases, np.array(X), np.array(E, dtype=float)
+
+
+def _vertices_1d(A, b):
+
+    ## the region is an interval: every constraint bounds dmu from above or below
+    upper = np.min(b[A > 0]/A[A > 0])
+    lower = np.max(b[A < 0]/A[A < 0])
+    if upper < lower:
+        return np.zeros((0,1))
+
+    return np.array([[lower],[upper]])
+
+
+def _vertices_nd(A, b, tol):
+
+    ## find a point well inside the region (Chebyshev centre) to seed the half-space intersection
+    norms = np.linalg.norm(A, axis=1)
+    res = linprog(np.r_[np.zeros(A.shape[1]),-1.], A_ub=np.c_[A,norms], b_ub=b,
+                  bounds=[(None,None)]*A.shape[1] + [(0,None)])
+    if not res.success or res.x[-1] <= tol:
+        return np.zeros((0,A.shape[1]))
+
+    hs = HalfspaceIntersection(np.c_[A,-b], res.x[:-1])
+    ## several half-spaces may meet at the same vertex
+    return np.unique(np.round(hs.intersections/tol)*tol, axis=0)
+
+
+def stability_region(main_system, dir_db, functional="GGA", tol=1e-6):
+
+    """
+    Find the region of chemical potential space in which the host is stable
+    against decomposition into any of the other phases in the local database:
+    sum_i x_i(host) dmu_i = dH(host)
+    sum_i x_i(phase) dmu_i <= dH(phase) for every competing phase
+    dmu_i <= 0 for every element
+    where dmu_i is the chemical potential relative to the elemental phase
+    and dH the formation energy per formula unit.
+    One of the elements is eliminated using the host equality,
+    and the vertices of the remaining polytope are found
+    from the intersection of all the half-spaces at once.
+
+    Parameters
+    ----------
+    main_system (str): the host e.g. MoS2, WSe2
+    dir_db (str): path to the database directory
+    [optional] functional (str): functional to take the energies from. Default=GGA.
+    [optional] tol (float): tolerance (eV) for deciding which constraints are active. Default=1e-6.
+
+    Returns
+    -------
+    (dict) with the keys
+           elements (list): elements of the host
+           mu0 (array): chemical potentials of the elemental phases, shape (n_elements,)
+           vertices (array): dmu at each vertex of the stability region, shape (n_vertices, n_elements)
+           labels (list): name of each vertex, e.g. Mo-rich
+           phases (list): phases that were considered
+
+    """
+
+    elements, phases, X, E = get_phases(main_system, dir_db, functional)
+    n_el = len(elements)
+    if n_el < 2:
+        raise ValueError("%s has no chemical potential freedom"%main_system)
+
+    ## elemental references: lowest energy per atom among the pure phases of each element
+    mu0 = np.full(n_el, np.inf)
+    for x,e in zip(X,E):
+        if np.count_nonzero(x) == 1:
+            i = np.flatnonzero(x)[0]
+            mu0[i] = min(mu0[i], e/x[i])
+    for el,mu in zip(elements,mu0):
+        if np.isinf(mu):
+            raise ValueError("can't find an elemental reference for %s in %s"%(el,dir_db))
+    dH = E - X @ mu0
+
+    ## eliminate the most abundant element of the host using the equality constraint
+    h = phases.index(main_system)
+    xh, dHh = X[h], dH[h]
+    k = int(np.argmax(xh))
+    free = [i for i in range(n_el) if i != k]
+
+    ## half-spaces A dmu_free <= b, for every competing phase and every element
+    names = [p for p in phases if p != main_system] + elements
+    Xc = np.vstack([np.delete(X, h, axis=0), np.eye(n_el)])
+    bc = np.r_[np.delete(dH, h), np.zeros(n_el)]
+    A = Xc[:,free] - np.outer(Xc[:,k], xh[free]/xh[k])
+    b = bc - Xc[:,k]*dHh/xh[k]
+
+    ## other polymorphs of the host don't constrain the region, but they can make it empty
+    zero = np.all(np.abs(A) < tol, axis=1)
+    if np.any(b[zero] < -tol):
+        raise ValueError("%s is not the lowest energy polymorph in %s"%(main_system,dir_db))
+    A, b, names = A[~zero], b[~zero], [n for n,z in zip(names,zero) if not z]
+
+    if len(free) == 1:
+        vfree = _vertices_1d(A[:,0], b)
+    else:
+        vfree = _vertices_nd(A, b, tol)
+    if len(vfree) == 0:
+        raise ValueError("%s is not stable against the competing phases in %s"
+                         %(main_system,dir_db))
+
+    vertices = np.zeros((len(vfree),n_el))
+    vertices[:,free] = vfree
+    vertices[:,k] = (dHh - vfree @ xh[free])/xh[k]
+
+    ## label each vertex by its rich elements and the other phases it is in equilibrium with
+    active = np.abs(vfree @ A.T - b) < np.sqrt(tol)
+    labels = []
+    for v,act in zip(vertices,active):
+        rich = [el+"-rich" for el,dmu in zip(elements,v) if dmu > -np.sqrt(tol)]
+        coexist = [n for n,a in zip(names,act) if a and not _composition(n).is_element]
+        label = "_".join(rich + coexist) or "vertex"
+        if label in labels:
+            label += "_%d"%len(labels)
+        labels.append(label)
+
+    return {"elements": elements, "mu0": mu0, "vertices": vertices,
+            "labels": labels, "phases": phases}
+
+
+def write_limits(region, dir_db, functional="GGA", myLogger=None):
+
+    """
+    Store the chemical potentials at every vertex of the stability region
+    in the database entries of the elements, with the keys mu_<label>-hull,
+    so that they are picked up as mu limits by calc_Eform_uncorr and formation_energy.
+    The -hull suffix keeps them apart from any hand-written limits of the same name,
+    e.g. mu_Mo-rich (0.5*MoS2-0.5*Mo).
+    Any limits from a previous hull construction are replaced.
+
+    Parameters
+    ----------
+    region (dict): stability region as returned by stability_region()
+    dir_db (str): path to the database directory
+    [optional] functional (str): functional the energies were taken from. Default=GGA.
+    [optional] myLogger (Logger): logger to report to
+
+    """
+
+    for i,el in enumerate(region["elements"]):
+        entry = DatabaseEntry(el, False, None, dir_db, "%s.json"%el, [functional], myLogger)
+        if os.path.exists(os.path.join(dir_db,entry.dbentry)):
+            mater = entry.load_from_json()
+        else:
+            mater = {}
+
+        props = mater.setdefault(functional, {})
+        ## (older versions stored them as mu_<label> (hull))
+        for key in [key for key in props if key.startswith("mu_")
+                    and key.endswith(("-%s"%HULL_TAG, "(%s)"%HULL_TAG))]:
+            del props[key]
+        for label,v in zip(region["labels"],region["vertices"]):
+            props["mu_%s-%s"%(label,HULL_TAG)] = region["mu0"][i] + v[i]
+
+        entry.write_to_json(mater)
+        if myLogger:
+            myLogger.info("Updated chemical potential limits in " + entry.dbentry)
+
+    return
+
+
+def calc(main_system, dir_db, functional="GGA", write=True, logfile=None):
+
+    """
+    Evaluate the stability region of the host in chemical potential space
+    and (optionally) store its vertices as chemical potential limits in the database.
+
+    Parameters
+    ----------
+    main_system (str): the host e.g. MoS2, WSe2
+    dir_db (str): path to the database directory
+    [optional] functional (str): functional to take the energies from. Default=GGA.
+    [optional] write (bool): store the vertices in the database entries. Default=True.
+    [optional] logfile (str): logfile to save output to
+
+    Returns
+    -------
+    (dict) Stability region, as returned by stability_region().
+
+    """
+
+    ## set up logging
+    if logfile:
+        myLogger = logging.setup_logging(logfile)
+    else:
+        myLogger = logging.setup_logging()
+
+
+    region = stability_region(main_system, dir_db, functional)
+    myLogger.info("Competing phases: " + ", ".join(region["phases"]))
+    for label,v in zip(region["labels"],region["vertices"]):
+        myLogger.info("%s: "%label + ", ".join(["dmu_%s = %.4f"%(el,dmu)
+                                               for el,dmu in zip(region["elements"],v)]))
+
+    if write:
+        write_limits(region, dir_db, functional, myLogger)
+
+    return region
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Evaluate the stability region of the host \
+                                     in chemical potential space.')
+    parser.add_argument('main_system',help='the main system e.g. MoS2, WSe2')
+    parser.add_argument('dir_db',help='path to the database directory')
+    parser.add_argument('--functional',help='functional to take the energies from',
+                        default='GGA')
+    parser.add_argument('--nowrite',help='do not store the vertices in the database entries',
+                        default=False,action='store_true')
+    parser.add_argument('--logfile',help='logfile to save output to')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    calc(args.main_system, args.dir_db, args.functional, not args.nowrite, args.logfile)
+
@@ -0,0 +1,303 @@
+import os
+import argparse
+import tempfile
+import numpy as np
+from multiprocessing import shared_memory
+from qdef2d.io import compressed
+
+
+## suffix of the sidecar file holding the averages next to the LOCPOT
+SIDECAR = '.avg.npz'
+
+## averages that have already been loaded in this process: {path: (stamp, averages)}
+_memory = {}
+## shared memory blocks this process is attached to, kept open while their arrays are in use
+_attached = {}
+
+
+def _stamp(filename):
+
+    ## a LOCPOT is only ever rewritten by a new calculation,
+    ## so its modification time and size are enough to tell if it has changed
+    st = os.stat(filename)
+    return np.array([st.st_mtime_ns, st.st_size], dtype=np.int64)
+
+
+def _parse_header(lines):
+
+    ## the header is a POSCAR (with or without the line of species)
+    ## followed by a blank line and the grid dimensions
+    scale = float(lines[1].split()[0])
+    lattice = np.array([[float(x) for x in line.split()[:3]] for line in lines[2:5]])
+    lattice *= scale if scale > 0 else (-scale/abs(np.linalg.det(lattice)))**(1/3)
+
+    i = 5
+    if not lines[i].split()[0].isdigit():
+        i += 1
+    natoms = sum(int(n) for n in lines[i].split())
+    i += 1
+    if lines[i].strip()[0] in 'sS':
+        i += 1
+    i += 1 + natoms
+    while not lines[i].strip():
+        i += 1
+    grid = tuple(int(n) for n in lines[i].split()[:3])
+
+    return lattice, grid, i+1
+
+
+def _iter_values(filename, blocksize):
+
+    ## stream the file block by block: parse the header from the first block(s),
+    ## then yield the numbers that follow it block by block,
+    ## carrying over any number that straddles two blocks
+    buf = b''
+    header = None
+    for data in compressed.iter_blocks(filename, blocksize):
+        buf += data
+        if header is None:
+            lines = buf.split(b'\n')
+            try:
+                lattice, grid, nlines = _parse_header([l.decode() for l in lines[:-1]])
+            except (IndexError, ValueError):
+                ## not all of the header has been read in yet
+                continue
+            header = (lattice, grid)
+            yield header
+            buf = b'\n'.join(lines[nlines:])
+        end = max(buf.rfind(b' '), buf.rfind(b'\n'))
+        if end < 0:
+            continue
+        yield np.fromstring(buf[:end].decode(), dtype=np.float64, sep=' ')
+        buf = buf[end:]
+    if header is None:
+        raise ValueError("can't read the header of %s"%filename)
+    if buf.strip():
+        yield np.fromstring(buf.decode(), dtype=np.float64, sep=' ')
+
+
+def read_averages(filename, inplane=False, blocksize=2**22):
+
+    """
+    Read the planar averages of the potential in a LOCPOT along each of the lattice vectors,
+    without ever holding the full 3D grid in memory.
+    The file is streamed block by block (decompressing it on the fly if needed),
+    and each block of values is added into the averages with np.bincount.
+
+    Parameters
+    ----------
+    filename (str): path to (possibly compressed) LOCPOT file
+    [optional] inplane (bool): also average over the third lattice vector
+                               to get the in-plane (a,b) map. Default=False.
+    [optional] blocksize (int): no. of bytes to read at a time. Default=4MB.
+
+    Returns
+    -------
+    (dict) with the keys
+           lattice (array): lattice vectors (Angstroms), shape (3,3)
+           grid (array): no. of grid points along each lattice vector, shape (3,)
+           average_a, average_b, average_c (array): planar averages (eV)
+                                                    along each lattice vector
+           inplane (array): in-plane average (eV) as float32, shape (NGX,NGY)
+                            (only if inplane=True)
+
+    """
+
+    values = _iter_values(filename, blocksize)
+    lattice, grid = next(values)
+    nx, ny, nz = grid
+    ntot = nx*ny*nz
+
+    sums = [np.zeros(n) for n in grid]
+    sum_xy = np.zeros(nx*ny) if inplane else None
+    start = 0
+    for block in values:
+        ## VASP writes the grid with x running fastest;
+        ## anything after the first nx*ny*nz values (e.g. a second spin component) is ignored
+        block = block[:ntot-start]
+        idx = np.arange(start, start+len(block))
+        sums[0] += np.bincount(idx % nx, block, minlength=nx)
+        sums[1] += np.bincount((idx // nx) % ny, block, minlength=ny)
+        sums[2] += np.bincount(idx // (nx*ny), block, minlength=nz)
+        if inplane:
+            sum_xy += np.bincount(idx % (nx*ny), block, minlength=nx*ny)
+        start += len(block)
+        if start >= ntot:
+            break
+    values.close()
+    if start < ntot:
+        raise ValueError("%s ends after %d of %d grid points"%(filename,start,ntot))
+
+    out = {'lattice': lattice, 'grid': np.array(grid),
+           'average_a': sums[0]/(ny*nz),
+           'average_b': sums[1]/(nx*nz),
+           'average_c': sums[2]/(nx*ny)}
+    if inplane:
+        out['inplane'] = (sum_xy/nz).reshape(ny,nx).T.astype(np.float32)
+
+    return out
+
+
+def load_averages(filename, inplane=False, cache=True):
+
+    """
+    Planar averages of a LOCPOT (see read_averages), cached in memory (keyed by path)
+    and in a small .npz sidecar next to the LOCPOT. Either is only used if it is for
+    the current version of the LOCPOT (same modification time and size),
+    otherwise the LOCPOT is re-read.
+
+    Parameters
+    ----------
+    filename (str): path to (possibly compressed) LOCPOT file
+    [optional] inplane (bool): also return the in-plane average. Default=False.
+    [optional] cache (bool): use the in-memory and sidecar caches. Default=True.
+
+    Returns
+    -------
+    (dict) Averages, as returned by read_averages().
+
+    """
+
+    stamp = _stamp(filename)
+    sidecar = filename + SIDECAR
+    path = os.path.abspath(filename)
+
+    ## the same bulk reference is lined up with every charged defect in its supercell,
+    ## so keep whatever has been loaded in memory as well
+    if cache and path in _memory:
+        mstamp, out = _memory[path]
+        if np.array_equal(mstamp, stamp) and (not inplane or 'inplane' in out):
+            return out
+
+    if cache and os.path.exists(sidecar):
+        try:
+            with np.load(sidecar) as npz:
+                if np.array_equal(npz['stamp'], stamp) and (not inplane or 'inplane' in npz):
+                    out = {key: npz[key] for key in npz.files if key != 'stamp'}
+                    _memory[path] = (stamp, out)
+                    return out
+        except (OSError, ValueError, KeyError):
+            ## a corrupt or partially written sidecar is simply replaced
+            pass
+
+    out = read_averages(filename, inplane)
+
+    if cache:
+        ## write to a temporary file first so that other processes never see half a sidecar
+        directory = os.path.dirname(os.path.abspath(filename))
+        try:
+            fd, tmpfile = tempfile.mkstemp(suffix='.npz', dir=directory)
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, stamp=stamp, **out)
+            os.replace(tmpfile, sidecar)
+        except OSError:
+            ## e.g. a read-only directory; the averages are still returned
+            pass
+        _memory[path] = (stamp, out)
+
+    return out
+
+
+class SharedAverages(object):
+
+    """
+    Averages of a set of LOCPOTs (e.g. the bulk references of a correction sweep)
+    placed in a single shared memory block, so that worker processes can use them
+    without each re-reading them or receiving their own copy.
+    The parent process creates it, passes its (small, picklable) handle to the workers,
+    which call attach() on it; after that, load_averages() in the workers returns
+    views into the shared block. The block is released by close() or on leaving a with block.
+
+    Parameters
+    ----------
+    filenames (list of str): paths to the (possibly compressed) LOCPOT files
+    [optional] inplane (bool): include the in-plane averages. Default=False.
+
+    """
+
+    def __init__(self, filenames, inplane=False):
+
+        ## lay out every array of every LOCPOT one after the other
+        averages, layout, size = {}, {}, 0
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            if path in averages:
+                continue
+            averages[path] = load_averages(filename, inplane)
+            layout[path] = (_memory[path][0], {})
+            for key,arr in averages[path].items():
+                layout[path][1][key] = (size, arr.shape, arr.dtype.str)
+                size += arr.nbytes
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size,1))
+        for path,(stamp,arrays) in layout.items():
+            for key,(offset,shape,dtype) in arrays.items():
+                view = np.ndarray(shape, dtype, buffer=self.shm.buf, offset=offset)
+                view[...] = averages[path][key]
+        self.handle = (self.shm.name, layout)
+
+        return
+
+
+    def close(self):
+
+        self.shm.close()
+        self.shm.unlink()
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *args):
+
+        self.close()
+
+
+def attach(handle):
+
+    """
+    Make the averages in a shared memory block (see SharedAverages) available
+    to load_averages() in this process, e.g. as the initializer of a process pool.
+
+    Parameters
+    ----------
+    handle (tuple): SharedAverages.handle
+
+    """
+
+    name, layout = handle
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    buf = _attached[name].buf
+
+    for path,(stamp,arrays) in layout.items():
+        out = {}
+        for key,(offset,shape,dtype) in arrays.items():
+            out[key] = np.ndarray(shape, dtype, buffer=buf, offset=offset)
+            out[key].flags.writeable = False
+        _memory[path] = (stamp, out)
+
+    return
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Planar average of the potential in a LOCPOT.')
+    parser.add_argument('locpot',help='path to LOCPOT file')
+    parser.add_argument('--axis',type=int,default=2,help='lattice vector to average along: 0, 1, 2')
+    parser.add_argument('--nocache',help='do not read/write the sidecar file',
+                        default=False,action='store_true')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    out = load_averages(args.locpot, cache=not args.nocache)
+    length = np.linalg.norm(out['lattice'][args.axis])
+    average = out['average_'+'abc'[args.axis]]
+    for i,v in enumerate(average):
+        print("%12.6f %16.8f"%(i*length/len(average),v))
+
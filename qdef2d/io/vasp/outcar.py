@@ -0,0 +1,246 @@
+import os
+import re
+import mmap
+import argparse
+from qdef2d.io import compressed
+
+
+## markers that we look for in the OUTCAR
+ITERATION = b'Iteration'
+TOTEN = b'free  energy   TOTEN'
+SIGMA0 = b'energy  without entropy'
+EDIFF_REACHED = b'aborting loop because EDIFF is reached'
+EDIFFG_REACHED = b'reached required accuracy'
+TIMING = b'General timing and accounting'
+
+re_iteration = re.compile(rb'Iteration\s*(\d+)\s*\(\s*(\d+)\s*\)')
+re_toten = re.compile(rb'free  energy   TOTEN\s*=\s*(\S+)')
+re_sigma0 = re.compile(rb'energy  without entropy\s*=\s*(\S+)\s+energy\(sigma->0\)\s*=\s*(\S+)')
+re_header = {'NSW': re.compile(rb'NSW\s*=\s*(-?\d+)'),
+             'IBRION': re.compile(rb'IBRION\s*=\s*(-?\d+)'),
+             'NELM': re.compile(rb'NELM\s*=\s*(-?\d+)')}
+re_timing = {'cpu_time': re.compile(rb'Total CPU time used \(sec\):\s*(\S+)'),
+             'elapsed_time': re.compile(rb'Elapsed time \(sec\):\s*(\S+)'),
+             'max_memory': re.compile(rb'Maximum memory used \(kb\):\s*(\S+)')}
+
+
+def _to_float(s):
+
+    ## VASP prints N/A or ******** when it can't fill in a field
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def read_header(filename, nbytes=2**20):
+
+    """
+    Read the INCAR parameters relevant to convergence (NSW, IBRION, NELM)
+    from the start of an OUTCAR. These are all printed in the first part of the file,
+    so only the first nbytes are read.
+
+    Parameters
+    ----------
+    filename (str): path to (possibly compressed) OUTCAR file
+    [optional] nbytes (int): no. of bytes to read from the start of the file. Default=1MB.
+
+    Returns
+    -------
+    (dict) Dictionary of the header parameters that were found.
+
+    """
+
+    with compressed.zopen(filename, 'rb') as f:
+        head = f.read(nbytes)
+
+    header = {}
+    for key,pattern in re_header.items():
+        match = pattern.search(head)
+        if match:
+            header[key] = int(match.group(1))
+
+    return header
+
+
+def parse_tail(tail, header=None):
+
+    """
+    Extract the final energies, convergence markers and timings
+    from the tail of an OUTCAR, starting from the last electronic iteration.
+
+    Parameters
+    ----------
+    tail (bytes): tail end of the OUTCAR, containing at least the last 'Iteration' header
+    [optional] header (dict): header parameters as returned by read_header()
+
+    Returns
+    -------
+    (dict) Dictionary of the final energies, convergence and resource usage.
+
+    """
+
+    out = {'ionic_steps': None, 'electronic_steps': None,
+           'free_energy': None, 'energy_wo_entropy': None, 'energy_sigma0': None,
+           'converged_electronic': False, 'converged_ionic': False,
+           'cpu_time': None, 'elapsed_time': None, 'max_memory': None}
+
+    iterations = re_iteration.findall(tail)
+    if iterations:
+        out['ionic_steps'] = int(iterations[-1][0])
+        out['electronic_steps'] = int(iterations[-1][1])
+
+    ## the energies are printed once per ionic step, so take the last occurrence
+    toten = re_toten.findall(tail)
+    if toten:
+        out['free_energy'] = _to_float(toten[-1])
+    sigma0 = re_sigma0.findall(tail)
+    if sigma0:
+        out['energy_wo_entropy'] = _to_float(sigma0[-1][0])
+        out['energy_sigma0'] = _to_float(sigma0[-1][1])
+
+    ## electronic convergence is checked only for the final ionic step
+    last = tail.rfind(ITERATION)
+    out['converged_electronic'] = (EDIFF_REACHED in tail[last:])
+
+    ## ionic convergence: either EDIFFG was reached, or this was not a relaxation,
+    ## or the relaxation stopped before hitting NSW
+    if header is None:
+        header = {}
+    nsw, ibrion = header.get('NSW',0), header.get('IBRION',-1)
+    if EDIFFG_REACHED in tail[last:]:
+        out['converged_ionic'] = True
+    elif nsw <= 1 or ibrion not in [1,2,3]:
+        out['converged_ionic'] = True
+    elif out['ionic_steps'] is not None:
+        out['converged_ionic'] = (out['ionic_steps'] < nsw)
+
+    timing = max(tail.rfind(TIMING),0)
+    for key,pattern in re_timing.items():
+        match = pattern.search(tail,timing)
+        if match:
+            out[key] = _to_float(match.group(1))
+
+    return out
+
+
+def read_tail(filename):
+
+    """
+    Read the final energies, convergence markers and timings from an OUTCAR
+    without scanning through the whole file.
+    The file is memory-mapped and searched backwards from EOF
+    for the last electronic iteration, so only the tail of the file is ever touched.
+    Compressed files can't be memory-mapped, so they are decompressed on the fly
+    and only the part after the latest electronic iteration is kept in memory.
+
+    Parameters
+    ----------
+    filename (str): path to (possibly compressed) OUTCAR file
+
+    Returns
+    -------
+    (dict) Dictionary with the keys
+           ionic_steps, electronic_steps (int): no. of ionic steps,
+                                                no. of electronic steps in the last ionic step
+           free_energy, energy_wo_entropy, energy_sigma0 (float): final energies (eV)
+           converged_electronic, converged_ionic, converged (bool): convergence markers
+           cpu_time, elapsed_time (float): timings (sec)
+           max_memory (float): maximum memory used (kb)
+
+    """
+
+    header = read_header(filename)
+
+    ## the final energies are printed after the last electronic iteration
+    ## of the last ionic step; everything else we want comes after that
+    ## (an OUTCAR without any electronic iterations has nothing to report)
+    tail = b''
+    if compressed.is_compressed(filename):
+        found = False
+        for data in compressed.iter_blocks(filename):
+            ## keep a few bytes in case the marker straddles two blocks
+            offset = max(len(tail)-len(ITERATION),0)
+            tail += data
+            start = tail.rfind(ITERATION, offset)
+            if start >= 0:
+                tail = tail[start:]
+                found = True
+            elif not found:
+                tail = tail[-len(ITERATION):]
+        if not found:
+            tail = b''
+    elif os.path.getsize(filename) > 0:
+        ## empty files can't be memory-mapped
+        with open(filename, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = mm.rfind(ITERATION)
+                if start >= 0:
+                    tail = mm[start:]
+
+    out = parse_tail(tail, header)
+    out['converged'] = out['converged_electronic'] and out['converged_ionic']
+
+    return out
+
+
+def iter_ionic_steps(filename):
+
+    """
+    Stream through an OUTCAR from the start and yield the energies of each ionic step
+    as soon as it is completed. Only one line is held in memory at any time.
+
+    Parameters
+    ----------
+    filename (str): path to (possibly compressed) OUTCAR file
+
+    Yields
+    ------
+    (dict) Dictionary with the keys
+           ionic_step (int): ionic step number
+           electronic_steps (int): no. of electronic steps in this ionic step
+           free_energy, energy_wo_entropy, energy_sigma0 (float): energies (eV)
+
+    """
+
+    step = {}
+    with compressed.zopen(filename, 'rb') as f:
+        for line in f:
+            ## most lines contain none of the markers,
+            ## so do the cheap substring checks before any regex matching
+            if ITERATION in line:
+                match = re_iteration.search(line)
+                if match:
+                    step = {'ionic_step': int(match.group(1)),
+                            'electronic_steps': int(match.group(2))}
+            elif TOTEN in line:
+                step['free_energy'] = _to_float(re_toten.search(line).group(1))
+            elif SIGMA0 in line:
+                match = re_sigma0.search(line)
+                step['energy_wo_entropy'] = _to_float(match.group(1))
+                step['energy_sigma0'] = _to_float(match.group(2))
+                ## this is the last energy line that is printed for each ionic step
+                yield step
+                step = {}
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Read final energies and timings from an OUTCAR.')
+    parser.add_argument('outcar',help='path to OUTCAR file')
+    parser.add_argument('--history',help='print energies of every ionic step',
+                        default=False,action='store_true')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    if args.history:
+        for step in iter_ionic_steps(args.outcar):
+            print("%4d %4d %16.8f %16.8f"%(step['ionic_step'],step['electronic_steps'],
+                                           step['free_energy'],step['energy_sigma0']))
+    else:
+        for key,val in read_tail(args.outcar).items():
+            print("%s: %s"%(key,val))
+
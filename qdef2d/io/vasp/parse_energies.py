@@ -4,8 +4,57 @@ import argparse
 import numpy as np
 import pandas as pd
 from pymatgen.io.vasp.inputs import Poscar
-from pymatgen.io.vasp.outputs import Outcar, Vasprun
-from qdef2d import osutils, logging
+from pymatgen.io.vasp.outputs import Vasprun
+from qdef2d import campaign, logging
+from qdef2d.io.vasp import outcar
+
+
+def get_final_energy(leaf,myLogger):
+    
+    """ 
+    Get the final total energy (sigma->0) of a calculation.
+    The energy is read from the tail end of the OUTCAR if present,
+    otherwise (or if the OUTCAR is empty or truncated) we fall back to parsing the full vasprun.xml.
+    Compressed output files (e.g. OUTCAR.gz, vasprun.xml.xz) are read directly.
+    
+    Parameters
+    ----------
+    leaf (Leaf): the calculation, as indexed by campaign.index()
+    myLogger (Logger): logger to report missing/unconverged calculations to
+    
+    Returns
+    -------
+    (float) Final total energy, or None if no output files are found.
+    
+    """
+    
+    outcar_file = leaf.find('OUTCAR')
+    vr_file = leaf.find('vasprun.xml')
+    
+    energy = None
+    if outcar_file:
+        out = outcar.read_tail(outcar_file)
+        energy, converged = out['energy_sigma0'], out['converged']
+        myLogger.debug("Elapsed time (s): %s ; Maximum memory used (kb): %s"
+                       %(out['elapsed_time'],out['max_memory']))
+        if energy is None:
+            ## e.g. an empty or truncated OUTCAR
+            myLogger.warning("cannot find final energy in %s"%outcar_file)
+        
+    if energy is None and vr_file:
+        ## pymatgen decompresses on the fly, so we can pass it compressed files too
+        vr = Vasprun(vr_file)
+        energy, converged = vr.final_energy, vr.converged
+        
+    elif energy is None:
+        if not outcar_file:
+            myLogger.warning("%s file does not exist"%os.path.join(leaf.path,'OUTCAR'))
+        return None
+    
+    if not converged:
+        myLogger.warning("VASP calculation in %s may not be converged"%leaf.path)
+        
+    return energy
 
 
 def parse(path_def,path_ref,xlfile,soc=False,logfile=None):
@@ -19,7 +68,7 @@ def parse(path_def,path_ref,xlfile,soc=False,logfile=None):
     path_def (str): path to the directory containing all the defect output files
     path_ref (str): path to the directory containing all the reference output files
     xlfile (str): excel filename to save the dataframe to
-    [optional] soc (bool): whether or not to look in soc(dos) subdirectory. Default=False.
+    [optional] soc (bool): whether or not to look in the *soc* subdirectory. Default=False.
     [optional] logfile (str): logfile to save output to
     
     """
@@ -31,14 +80,19 @@ def parse(path_def,path_ref,xlfile,soc=False,logfile=None):
         myLogger = logging.setup_logging()
         
 
-    qs = osutils.listdironly(path_def)
+    ## index the defect and reference directory trees;
+    ## the soc energies are in the *soc* subdirectories
+    variant = 'soc' if soc else None
+    manifest_def = campaign.index(path_def)
+    manifest_ref = campaign.index(path_ref)
+    qs = manifest_def.charges()
     
     writer = pd.ExcelWriter(os.path.join(path_def,xlfile))
 
     time0 = time.time()    
 
     ## set up dataframe for neutral defect first
-    if 'charge_0' not in qs:
+    if 0 not in qs:
         myLogger.warning("can't find output files for neutral defect")
     else:
         df0 = pd.DataFrame(columns = ['vacuum',
@@ -48,98 +102,55 @@ def parse(path_def,path_ref,xlfile,soc=False,logfile=None):
                                       'E_def',
                                       'E_bulk'])
     
-        for cell in osutils.listdironly(os.path.join(path_def,'charge_0')):
-            for vac in osutils.listdironly(os.path.join(path_def,'charge_0',cell)):   
-                myLogger.info("parsing neutral %s %s"%(cell,vac))
+        for leaf in manifest_def.leaves(charge=0):
+            cell, vac = leaf.supercell, leaf.vacuum
+            myLogger.info("parsing neutral %s %s"%(cell,vac))
 
-                subdir_def = os.path.join(path_def,'charge_0',cell,vac)
-                subdir_ref = os.path.join(path_ref,'charge_0',cell,vac)
-
-                if soc:
-                    dir_soc = [dirname for dirname in osutils.listdironly(subdir_def) if "soc" in dirname]
-                    if len(dir_soc) == 0:
-                        myLogger.info("cannot find a soc subdirectory")
-                    if len(dir_soc) > 1:
-                        myLogger.info("multiple possible soc subdirectories found")
-                    if len(dir_soc) == 1:
-                        subdir_def = os.path.join(subdir_def,dir_soc[0])
-                        subdir_ref = os.path.join(subdir_ref,dir_soc[0])
-                        myLogger.info("parsing soc subdirectory")
-                    
-                if os.path.exists(subdir_def) and 'restart' in osutils.listdironly(subdir_def):
-                    subdir_def = os.path.join(subdir_def,'restart')
-                    myLogger.info("parsing restart subdirectory")
-                                        
-                vr_file = os.path.join(subdir_def,'vasprun.xml')
-                vr_ref_file = os.path.join(subdir_ref,'vasprun.xml')
+            leaf_def = campaign.get_leaf(manifest_def,0,cell,vac,variant,myLogger)
+            leaf_ref = campaign.get_leaf(manifest_ref,0,cell,vac,variant,myLogger)
+            if leaf_def is None or leaf_ref is None:
+                continue
+                                    
+            E_def = get_final_energy(leaf_def,myLogger)
+            E_bulk = get_final_energy(leaf_ref,myLogger)
+            
+            if E_def is not None and E_bulk is not None:
+                natoms = np.sum(Poscar.from_file(leaf_ref.find('POSCAR')).natoms)
                 
-                if not os.path.exists(vr_file):
-                    myLogger.warning("%s file does not exist"%vr_file)
-                    
-                elif not os.path.exists(vr_ref_file):
-                    myLogger.warning("%s file does not exist"%vr_ref_file)
-                    
-                else:
-                    natoms = np.sum(Poscar.from_file(os.path.join(subdir_ref,'POSCAR')).natoms)
-                    vr = Vasprun(vr_file)
-                    vr_ref = Vasprun(vr_ref_file)
-                    
-                    if not vr.converged:
-                        myLogger.warning("VASP calculation in %s may not be converged"%subdir_def)                    
-                    
-                    df0.loc[len(df0)] = [vac,
-                                         cell,
-                                         natoms,
-                                         1/natoms,
-                                         vr.final_energy,
-                                         vr_ref.final_energy]
+                df0.loc[len(df0)] = [vac,
+                                     cell,
+                                     natoms,
+                                     1/natoms,
+                                     E_def,
+                                     E_bulk]
                     
                     
         df0.sort_values(['vacuum','N'],inplace=True)
-        df0.to_excel(writer,'charge_0', index=False)
+        df0.to_excel(writer, sheet_name='charge_0', index=False)
     
 
     ## modify dataframe for charged defects
-    for q in [qi for qi in qs if qi != 'charge_0']:
+    for q in [qi for qi in qs if qi != 0]:
         df = df0.copy(deep=True)
 
-        for cell in osutils.listdironly(os.path.join(path_def,q)):
-            for vac in osutils.listdironly(os.path.join(path_def,q,cell)):   
-                myLogger.info("parsing %s %s %s"%(q,cell,vac))
-
-                subdir_def = os.path.join(path_def,q,cell,vac)
+        for leaf in manifest_def.leaves(charge=q):
+            cell, vac = leaf.supercell, leaf.vacuum
+            myLogger.info("parsing charge_%d %s %s"%(q,cell,vac))
 
-                if soc:
-                    dir_soc = [dirname for dirname in osutils.listdironly(subdir_def) if "soc" in dirname]
-                    if len(dir_soc) == 0:
-                        myLogger.info("cannot find a soc subdirectory")
-                    if len(dir_soc) > 1:
-                        myLogger.info("multiple possible soc subdirectories found")
-                    if len(dir_soc) == 1:
-                        subdir_def = os.path.join(subdir_def,dir_soc[0])
-                        myLogger.info("parsing soc subdirectory")
-                    
-                if os.path.exists(subdir_def) and 'restart' in osutils.listdironly(subdir_def):
-                    subdir_def = os.path.join(subdir_def,'restart')
-                    myLogger.info("parsing restart subdirectory")
-                                        
-                vr_file = os.path.join(subdir_def,'vasprun.xml')
-                
-                if not os.path.exists(vr_file):
-                    myLogger.warning("%s file does not exist"%vr_file)
-                    
-                else:
-                    vr = Vasprun(vr_file)
-                    
-                    if not vr.converged:
-                        myLogger.warning("VASP calculation in %s may not be converged"%subdir_def) 
-                        
-                    df.loc[(df['vacuum'] == vac) & 
-                           (df['supercell'] == cell),'E_def'] = vr.final_energy
+            leaf_def = campaign.get_leaf(manifest_def,q,cell,vac,variant,myLogger)
+            if leaf_def is None:
+                continue
+                                    
+            E_def = get_final_energy(leaf_def,myLogger)
+            
+            if E_def is not None:
+                ## bulk calculations have no vacuum level (an empty cell in the excel file)
+                same_vac = df['vacuum'].isna() if vac is None else (df['vacuum'] == vac)
+                df.loc[same_vac & (df['supercell'] == cell),'E_def'] = E_def
         
-        df.to_excel(writer, q, index=False)
+        df.to_excel(writer, sheet_name='charge_%d'%q, index=False)
 
-    writer.save()
+    writer.close()
     
     myLogger.debug("Total time taken (s): %.2f"%(time.time()-time0))
     
@@ -9,6 +9,8 @@ def setup_logging(logfile=None):
     logging.getLogger('matplotlib.font_manager').disabled = True
     
     if logfile:
+        ## the handlers filter by level themselves
+        logger.setLevel(logging.DEBUG)
         file = logging.FileHandler(logfile)
         file.setLevel(logging.DEBUG)
         file.setFormatter(logging.Formatter('%(levelname)s:%(message)s'))
@@ -0,0 +1,262 @@
+import os
+import bz2
+import csv
+import gzip
+import lzma
+import tarfile
+import argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from pymatgen.core import Structure
+from qdef2d import logging, slabutils
+from qdef2d.io import compressed
+
+
+## columns of the status table
+COLUMNS = ['name', 'status', 'formula', 'nlayers', 'slab_d']
+
+## decompressors for each of compressed.COMPRESSED_EXTS
+DECOMPRESS = {'.gz': gzip.decompress, '.bz2': bz2.decompress,
+              '.xz': lzma.decompress, '.lzma': lzma.decompress}
+
+
+def _strip_compressed(filename):
+
+    base, ext = os.path.splitext(filename)
+    return base if ext in compressed.COMPRESSED_EXTS else filename
+
+
+def _is_structure_file(filename):
+
+    ## POSCAR/CONTCAR-like files and cifs, possibly compressed
+    base = os.path.basename(_strip_compressed(filename))
+    return base.endswith(('.cif', '.vasp')) or base.startswith(('POSCAR', 'CONTCAR'))
+
+
+def _safe_name(name):
+
+    ## name of the output directory of a structure: its path in the input,
+    ## without the extension, flattened into a single directory name
+    name = _strip_compressed(name)
+    if name.endswith(('.cif', '.vasp')):
+        name = os.path.splitext(name)[0]
+    return name.strip('/').replace('/', '_').replace(os.sep, '_')
+
+
+def iter_inputs(source):
+
+    """
+    Iterate lazily over the structure files in a directory (searched recursively)
+    or a (possibly compressed) tar archive, reading one file at a time.
+    POSCAR*, CONTCAR*, *.vasp and *.cif files are picked up, and they may be compressed
+    themselves; they are returned as they are stored, and only decompressed (see decode)
+    by whoever processes them.
+
+    Parameters
+    ----------
+    source (str): path to the directory or tar archive
+
+    Returns
+    -------
+    (generator) of (name, data) of each structure file, with its path relative 
+                to the directory or in the archive as the name, and its contents as bytes
+
+    """
+
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for filename in sorted(files):
+                if _is_structure_file(filename):
+                    path = os.path.join(root, filename)
+                    with open(path, 'rb') as f:
+                        yield os.path.relpath(path, source), f.read()
+
+    elif os.path.isfile(source) and tarfile.is_tarfile(source):
+        ## stream through the archive, without reading its index first
+        with tarfile.open(source, 'r|*') as tar:
+            for member in tar:
+                if member.isfile() and _is_structure_file(member.name):
+                    yield member.name, tar.extractfile(member).read()
+
+    else:
+        raise ValueError("%s is neither a directory nor a tar archive"%source)
+
+
+def decode(name, data):
+
+    """
+    Contents of a structure file as returned by iter_inputs, decompressed if need be.
+
+    Parameters
+    ----------
+    name (str): name of the file
+    data (bytes): contents of the file as it is stored
+
+    Returns
+    -------
+    (str) The contents of the structure file.
+
+    """
+
+    ext = os.path.splitext(name)[1]
+    if ext in DECOMPRESS:
+        data = DECOMPRESS[ext](data)
+
+    return data.decode()
+
+
+def _screen(task):
+
+    ## generate the monolayer unit cells of a single structure and report how it went
+    row = {"name": task["name"], "formula": '', "nlayers": '', "slab_d": ''}
+    try:
+        fmt = 'cif' if _strip_compressed(task["filename"]).endswith('.cif') else 'poscar'
+        struct = Structure.from_str(decode(task["filename"], task["data"]), fmt=fmt)
+        row["formula"] = struct.composition.reduced_formula
+
+        struct = slabutils.align_axis(struct, axis=task["zaxis"])
+        if task["monolayer"]:
+            layers = [struct]
+        else:
+            layers = slabutils.find_layers(struct, method=task["method"])
+        row["nlayers"] = len(layers)
+
+        slab_d = slabutils.write_unitcells_2d(layers[0], task["vacuums"],
+                                              os.path.join(task["dir_out"], task["name"]))
+        row["slab_d"] = "%.4f"%slab_d
+        row["status"] = "done"
+
+    except Exception as err:
+        row["status"] = "failed: %s"%err
+
+    return row
+
+
+def _collect(pending, return_when, writer, f, myLogger):
+
+    ## write the rows of the finished structures to the status table as soon as they come in
+    finished, _ = wait(list(pending), return_when=return_when)
+    for future in finished:
+        name = pending.pop(future)
+        try:
+            row = future.result()
+        except BrokenProcessPool:
+            ## the worker died (e.g. ran out of memory) on this or another structure
+            row = {"name": name, "status": "failed: worker process died",
+                   "formula": '', "nlayers": '', "slab_d": ''}
+        writer.writerow(row)
+        myLogger.info("%s: %s"%(name, row["status"]))
+    f.flush()
+
+
+def screen(source, dir_out, vacuums, zaxis='c', monolayer=False, method='bonds',
+           nprocs=1, table='screening.csv', logfile=None):
+
+    """
+    Screen a directory (or tar archive) of bulk structures as hosts for 2D defect calculations:
+    extract a single layer from each one and generate its unit cells for a set of vacuum spacings,
+    in <dir_out>/<name>/vac_<vacuum>/POSCAR (see slabutils.gen_unitcells_2d).
+    The structures are read lazily and processed in a pool of processes;
+    a status row is appended to the status table as soon as each structure is done,
+    so that nothing is lost if the screening is interrupted.
+    Running it again skips the structures that were already done and retries the failed ones.
+
+    Parameters
+    ----------
+    source (str): path to the directory or tar archive of structure files (see iter_inputs)
+    dir_out (str): path to the output directory
+    vacuums (list of ints): vacuum spacings in Angstroms
+    [optional] zaxis (str): axis perpendicular to the layers: a/b/c(default)
+    [optional] monolayer (bool): the structures are single layers already. Default=False.
+    [optional] method (str): how to find the layers: bonds(default)/gap (see slabutils.find_layers)
+    [optional] nprocs (int): no. of structures to process in parallel. Default=1.
+    [optional] table (str): status table (csv) in dir_out. Default=screening.csv.
+    [optional] logfile (str): logfile to save output to
+
+    Returns
+    -------
+    (DataFrame) Status of every structure screened so far (the latest attempt at each),
+                with the columns name, status, formula, nlayers, slab_d (Angstroms)
+
+    """
+
+    ## set up logging
+    if logfile:
+        myLogger = logging.setup_logging(logfile)
+    else:
+        myLogger = logging.setup_logging()
+
+
+    if not os.path.exists(dir_out):
+        os.makedirs(dir_out)
+    path_table = os.path.join(dir_out, table)
+
+    ## structures that were already done in an earlier run
+    done = set()
+    if os.path.exists(path_table):
+        statuses = pd.read_csv(path_table, dtype=str).drop_duplicates('name', keep='last')
+        done = set(statuses['name'][statuses['status'] == 'done'])
+        myLogger.info("%d structures already done"%len(done))
+
+    new = not os.path.exists(path_table)
+    with open(path_table, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        if new:
+            writer.writeheader()
+
+        ## keep only a few structures per process in flight, so that the inputs are read lazily
+        executor = ProcessPoolExecutor(max_workers=nprocs)
+        pending = {}
+        try:
+            for name, data in iter_inputs(source):
+                task = {"name": _safe_name(name), "filename": name, "data": data,
+                        "vacuums": vacuums, "zaxis": zaxis, "monolayer": monolayer,
+                        "method": method, "dir_out": dir_out}
+                if task["name"] in done:
+                    continue
+                try:
+                    future = executor.submit(_screen, task)
+                except BrokenProcessPool:
+                    ## start over with a new pool once the structures in flight are reported
+                    _collect(pending, ALL_COMPLETED, writer, f, myLogger)
+                    executor.shutdown()
+                    executor = ProcessPoolExecutor(max_workers=nprocs)
+                    future = executor.submit(_screen, task)
+                pending[future] = task["name"]
+                if len(pending) >= 2*nprocs:
+                    _collect(pending, FIRST_COMPLETED, writer, f, myLogger)
+            _collect(pending, ALL_COMPLETED, writer, f, myLogger)
+        finally:
+            executor.shutdown()
+
+    statuses = pd.read_csv(path_table, dtype={'name': str}).drop_duplicates('name', keep='last')
+
+    return statuses.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+
+
+    ## this script can also be run directly from the command line
+    parser = argparse.ArgumentParser(description='Generate monolayer unit cells \
+                                     for a directory or tar archive of bulk structures.')
+    parser.add_argument('source', help='path to the directory or tar archive of structure files')
+    parser.add_argument('dir_out', help='path to the output directory')
+    parser.add_argument('--vacs', nargs='+', type=int, help='(required) vacuum spacings; \
+                        list each vacuum spacing separated by a space')
+    parser.add_argument('--zaxis', default='c', help='axis perpendicular to the layers: a/b/c(default)')
+    parser.add_argument('--monolayer', default=False, action='store_true',
+                        help='the structures are single layers already')
+    parser.add_argument('--method', default='bonds', help='how to find the layers: bonds(default)/gap')
+    parser.add_argument('--nprocs', type=int, default=1, help='no. of structures to process in parallel')
+    parser.add_argument('--table', default='screening.csv', help='status table (csv) in dir_out')
+    parser.add_argument('--logfile', help='logfile to save output to')
+
+    ## read in the above arguments from command line
+    args = parser.parse_args()
+
+    screen(args.source, args.dir_out, args.vacs, args.zaxis, args.monolayer, args.method,
+           args.nprocs, args.table, args.logfile)
+
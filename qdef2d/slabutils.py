@@ -1,8 +1,11 @@
 import os
 import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components, breadth_first_order
 from pymatgen.io.vasp.inputs import Poscar
-from pymatgen import Structure
+from pymatgen.core import Structure, Lattice
 from pymatgen.core.operations import SymmOp
+from pymatgen.analysis.molecule_structure_comparator import CovalentRadius
 
 
 ## A lot of the functions in here have been copied and only 
@@ -93,7 +96,23 @@ def align_axis(structure, axis='c', direction=(0, 0, 1)):
     return structure
 
 
-def center_slab(structure):
+def _center_shift(frac_z):
+    
+    ## shift along c that centers the slab around 0.5 fractional height,
+    ## for the fractional heights of all the sites at once
+    slab_center = np.mean(frac_z)
+    
+    ## attempt to catch literal edge cases
+    ## in which the layers are centered around 0.0, e.g. at ~0.1 and ~0.9
+    ## (the slab center is wrongly identified because of the PBC);
+    ## after shifting it by 0.5, it *should* be away from such edge cases
+    if np.any(np.abs(frac_z - slab_center) > 0.25):
+        return 0.5 + 0.5 - np.mean((frac_z + 0.5) % 1)
+    
+    return 0.5 - slab_center
+
+
+def center_slab(structure, in_place=True):
     
     """
     Copied from MPInterfaces with some modification.
@@ -102,6 +121,7 @@ def center_slab(structure):
     Parameters
     ----------
     structure (Structure): Structure to center
+    [optional] in_place (bool): modify structure itself instead of a copy. Default=True.
     
     Returns
     -------
@@ -109,17 +129,10 @@ def center_slab(structure):
         
     """
 
-    ## attempt to catch literal edge cases
-    ## in which the layers are centered around 0.0, e.g. at ~0.1 and ~0.9
-    slab_center = np.average([s.frac_coords[2] for s in structure.sites])
-    if any([abs(s.frac_coords[2]-slab_center) > 0.25 for s in structure.sites]):
-        structure.translate_sites(range(structure.num_sites), (0, 0, 0.5))
-
-    ## repeat this process to make sure it is properly centered
-    ## sometimes the slab center is wrongly identified the first time because of the PBC
-    ## after shifting it once, it *should* be away from such edge cases    
-    slab_center = np.average([s. frac_coords[2] for s in structure.sites])
-    structure.translate_sites(range(structure.num_sites), (0, 0, 0.5 - slab_center))
+    if not in_place:
+        structure = structure.copy()
+    shift = _center_shift(structure.frac_coords[:,2])
+    structure.translate_sites(range(structure.num_sites), (0, 0, shift))
 
     return structure
 
@@ -127,12 +140,13 @@ def center_slab(structure):
 def get_slab_thickness(structure):
     
     """
-    Returns the interlayer spacing for a 2D material or slab.
+    Returns the interlayer spacing for a 2D material or slab, 
+    with the layer spanned by the a and b lattice vectors.
+    The structure is left as it is.
         
     Parameters
     ----------
     structure (Structure): Structure to check spacing for.
-    cut (float): a fractional z-coordinate that must be within the vacuum region.
     
     Returns
     -------
@@ -140,15 +154,21 @@ def get_slab_thickness(structure):
     
     """
 
-    structure = align_axis(structure)
-    structure = center_slab(structure)
-    max_height = max([s.coords[2] for s in structure.sites])
-    min_height = min([s.coords[2] for s in structure.sites])
+    ## heights of the sites once centered, along the normal to the layer
+    frac_z = structure.frac_coords[:,2]
+    frac_z = (frac_z + _center_shift(frac_z)) % 1
     
-    return (max_height - min_height)
+    return (np.max(frac_z) - np.min(frac_z)) * _height(structure.lattice.matrix)
 
 
-def add_vacuum(structure, vacuum):
+def _height(lattice):
+    
+    ## height of the cell along the normal to the a,b plane
+    normal = np.cross(lattice[0], lattice[1])
+    return abs(np.dot(lattice[2], normal)) / np.linalg.norm(normal)
+
+
+def add_vacuum(structure, vacuum, in_place=False):
     
     """
     Copied from MPInterfaces with some slight modification.
@@ -158,6 +178,7 @@ def add_vacuum(structure, vacuum):
     ----------
     structure (Structure): Structure to add vacuum to
     vacuum (float): Vacuum thickness to add in Angstroms
+    [optional] in_place (bool): modify structure itself instead of a copy. Default=False.
     
     Returns
     -------
@@ -165,17 +186,22 @@ def add_vacuum(structure, vacuum):
     
     """
     
+    if not in_place:
+        structure = structure.copy()
     structure = align_axis(structure)
-    coords = [s.coords for s in structure.sites]
-    species = [s.specie for s in structure.sites]
+    
+    ## extend the cell along z, keeping the cartesian coords, and re-center
     lattice = structure.lattice.matrix.copy()
     lattice[2][2] += vacuum
-    structure = Structure(lattice, species, coords, coords_are_cartesian=True)
+    frac_coords = np.linalg.solve(lattice.T, structure.cart_coords.T).T
+    frac_coords[:,2] += _center_shift(frac_coords[:,2])
+    structure.lattice = Lattice(lattice)
+    structure.frac_coords = frac_coords % 1
     
-    return center_slab(structure)
+    return structure
 	
 
-def layer_from_bulk(struct_bulk,slabmin,slabmax):
+def layer_from_bulk(struct_bulk,slabmin,slabmax,in_place=False):
     
     """
     Extracts a layer from a layered bulk material.
@@ -185,6 +211,8 @@ def layer_from_bulk(struct_bulk,slabmin,slabmax):
     struct_bulk (Structure): Pymatgen Structure object of the layered bulk
     slabmin (float): fractional coord of the bottom of the layer to isolate
     slabmax (float): fractional coord of the top of the layer to isolate
+    [optional] in_place (bool): remove the other sites from struct_bulk itself 
+                                instead of a copy. Default=False.
     
     Returns
     -------
@@ -192,27 +220,156 @@ def layer_from_bulk(struct_bulk,slabmin,slabmax):
     
     """
 
-    struct_layer = struct_bulk.copy()    
-    not_in_layer = [i for i,site in enumerate(struct_layer.sites) \
-                          if site.c < slabmin or site.c > slabmax]    
-    struct_layer.remove_sites(not_in_layer)
+    struct_layer = struct_bulk if in_place else struct_bulk.copy()
+    frac_z = struct_layer.frac_coords[:,2]
+    not_in_layer = np.flatnonzero((frac_z < slabmin) | (frac_z > slabmax))
+    struct_layer.remove_sites(not_in_layer.tolist())
 
     return struct_layer
 
+
+def _layers_by_gap(structure, min_gap):
     
-def gen_unitcell_2d(path_poscar,vacuum,zaxis='c',from_bulk=False,slabmin=None,slabmax=None):
+    ## split the sites wherever there is a gap of more than min_gap along c, 
+    ## going around the cell once from just above the last gap
+    frac_z = structure.frac_coords[:,2] % 1
+    n = len(frac_z)
+    order = np.argsort(frac_z, kind='stable')
+    z_sorted = frac_z[order]
+    gaps = np.r_[z_sorted[1:] - z_sorted[:-1], z_sorted[0] + 1 - z_sorted[-1]] * _height(structure.lattice.matrix)
+    cuts = np.flatnonzero(gaps > min_gap)
+    if len(cuts) == 0:
+        raise ValueError('no gap larger than %.2f Angstroms along c'%min_gap)
+    
+    start = (cuts[-1] + 1) % n
+    order, gaps = np.roll(order, -start), np.roll(gaps, -start)
+    labels = np.zeros(n, dtype=int)
+    labels[order] = np.r_[0, np.cumsum(gaps[:-1] > min_gap)]
+    ## sites past the top of the cell belong to the layer that starts below it
+    unwrapped = frac_z.copy()
+    unwrapped[order[np.arange(n) + start >= n]] += 1
+    
+    return labels, unwrapped
+
+
+def _layers_by_bonds(structure, tol):
+    
+    ## bonded sites (closer than tol times the sum of their covalent radii)
+    ## form one layer, i.e. one connected component of the bond network
+    radii = np.array([CovalentRadius.radius[site.specie.symbol] for site in structure.sites])
+    i, j, images, dist = structure.get_neighbor_list(tol*2*np.max(radii))
+    bonded = dist < tol*(radii[i] + radii[j])
+    i, j, images = i[bonded], j[bonded], images[bonded].astype(int)
+    
+    n = len(structure)
+    graph = coo_matrix((np.ones(len(i)), (i, j)), shape=(n, n)).tocsr()
+    ncomp, labels = connected_components(graph, directed=False)
+    
+    ## follow the bonds through each layer to find which periodic image of every site 
+    ## belongs to it; a layer that is bonded to its own image along c isn't a layer at all
+    image_c = {}
+    for i_, j_, img in zip(i, j, images[:,2]):
+        image_c.setdefault((i_, j_), img)
+    shift = np.zeros(n, dtype=int)
+    for comp in range(ncomp):
+        root = np.flatnonzero(labels == comp)[0]
+        nodes, pred = breadth_first_order(graph, root, directed=False)
+        for node in nodes[1:]:
+            shift[node] = shift[pred[node]] + image_c[(pred[node], node)]
+    if np.any(shift[j] - shift[i] != images[:,2]):
+        raise ValueError('the structure is bonded along c, it is not a layered structure')
+    
+    return labels, structure.frac_coords[:,2] + shift
+
+
+def find_layers(struct_bulk, method='bonds', tol=1.2, min_gap=2.4):
+    
+    """
+    Identify the individual (van der Waals) layers stacked along c in a layered bulk material.
+    
+    Parameters
+    ----------
+    struct_bulk (Structure): Pymatgen Structure object of the layered bulk,
+                             with the layers spanned by the a and b lattice vectors
+    [optional] method (str): 'bonds' (default) to find the layers as the connected groups of 
+                             atoms closer than tol times the sum of their covalent radii, or
+                             'gap' to split the atoms wherever there is a gap of more than
+                             min_gap between their heights
+    [optional] tol (float): bond length tolerance for method='bonds'. Default=1.2.
+    [optional] min_gap (float): smallest vdW gap (Angstroms) for method='gap'. Default=2.4.
+    
+    Returns
+    -------
+    (list of Structures) Structure object of each single layer, in the same cell
+                         and in the order they are stacked along c; the sites of a layer 
+                         that crosses the top of the cell are kept together,
+                         above it.
+    
+    """
+    
+    if method == 'bonds':
+        labels, frac_z = _layers_by_bonds(struct_bulk, tol)
+    elif method == 'gap':
+        labels, frac_z = _layers_by_gap(struct_bulk, min_gap)
+    else:
+        raise ValueError('unknown method %s: bonds/gap'%method)
+    
+    ## bring every layer's center into the cell
+    nlayers = np.max(labels) + 1
+    centers = np.bincount(labels, frac_z, nlayers) / np.bincount(labels, minlength=nlayers)
+    frac_z = frac_z - np.floor(centers)[labels]
+    
+    frac_coords = struct_bulk.frac_coords.copy()
+    frac_coords[:,2] = frac_z
+    species = struct_bulk.species
+    layers = []
+    for label in np.argsort(centers % 1, kind='stable'):
+        idx = np.flatnonzero(labels == label)
+        layers.append(Structure(struct_bulk.lattice, [species[k] for k in idx], frac_coords[idx]))
+    
+    return layers
+
+
+def _write_poscar(filename, comment, lattice, symbols, frac_coords):
+    
+    ## write a POSCAR straight from the arrays, in the same layout as pymatgen:
+    ## consecutive sites of the same species are grouped together
+    symbols = np.asarray(symbols)
+    starts = np.flatnonzero(np.r_[True, symbols[1:] != symbols[:-1]])
+    counts = np.diff(np.r_[starts, len(symbols)])
+    
+    lines = [comment, "1.0"]
+    lines += ["%21.16f %21.16f %21.16f"%tuple(v) for v in lattice]
+    lines += [" ".join(symbols[starts]), " ".join(str(n) for n in counts), "direct"]
+    coords = np.char.mod("%21.16f", frac_coords)
+    lines += [" ".join(row) + " " + sym for row,sym in zip(coords, symbols)]
+    
+    with open(filename, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def gen_unitcells_2d(path_poscar,vacuums,zaxis='c',from_bulk=False,slabmin=None,slabmax=None):
         
     """ 
-    Generate 2D unitcell.
+    Generate 2D unitcells for a set of vacuum spacings.
+    The POSCAR is only parsed, aligned (and the layer extracted) once;
+    each vacuum spacing then only changes the height of the cell and
+    the position of the slab in it, which are applied to the coordinate arrays directly.
     
     Parameters
     ----------
     path_poscar (str): path to unitcell POSCAR
-    vacuum (int): vacuum spacing in Angstroms
+    vacuums (list of ints): vacuum spacings in Angstroms
     [optional] zaxis (str): axis perpendicular to layer: a/b/c(default)
     [optional] from_bulk (bool): extract layer from bulk? Default=False.
     [optional] slabmin (float): fractional coord of the bottom of the layer to isolate
     [optional] slabmax (float): fractional coord of the top of the layer to isolate
+                                (if neither is given, the layers are found automatically
+                                with find_layers, and the first one is used)
+    
+    Returns
+    -------
+    (float) Slab thickness in Angstroms.
        
     """
 
@@ -224,20 +381,81 @@ def gen_unitcell_2d(path_poscar,vacuum,zaxis='c',from_bulk=False,slabmin=None,sl
     
     struct = align_axis(poscar.structure,axis=zaxis)
     if from_bulk:
-        if slabmin == None or slabmax == None:
+        if slabmin == None and slabmax == None:
+            ## find the layers automatically and take the first one
+            struct = find_layers(struct)[0]
+        elif slabmin == None or slabmax == None:
             raise ValueError('missing slabmin and/or slabmax argument')
         else:
             if slabmin > slabmax:
                 raise ValueError('incorrect slabmin and/or slabmax argument')
             else:
-                struct = layer_from_bulk(struct,slabmin,slabmax)       
-    slab_d = get_slab_thickness(struct)
-    struct = add_vacuum(struct, vacuum - (struct.lattice.c - slab_d))
-    struct = center_slab(struct)
+                struct = layer_from_bulk(struct,slabmin,slabmax,in_place=True)       
+    
+    return write_unitcells_2d(struct,vacuums,dir_main)
 
 
-    dir_sub = os.path.join(dir_main,"vac_%d"%vacuum)
-    if not os.path.exists(dir_sub):
-        os.makedirs(dir_sub)
-    Poscar.write_file(Poscar(struct),os.path.join(dir_sub,"POSCAR"))
+def write_unitcells_2d(struct,vacuums,dir_main):
+        
+    """ 
+    Write the 2D unitcells of a single layer for a set of vacuum spacings 
+    (see gen_unitcells_2d), to the vac_<vacuum>/POSCAR files in a directory.
+    
+    Parameters
+    ----------
+    struct (Structure): Structure object of the single layer, aligned with the layer
+                        spanned by the a and b lattice vectors (see align_axis);
+                        it is centered in place
+    vacuums (list of ints): vacuum spacings in Angstroms
+    dir_main (str): directory to create the vac_<vacuum> subdirectories in
+    
+    Returns
+    -------
+    (float) Slab thickness in Angstroms.
+       
+    """
+    
+    struct = center_slab(struct)
+    slab_d = get_slab_thickness(struct)
+    
+    ## everything that is the same for all vacuum spacings
+    lattice = struct.lattice.matrix.copy()
+    cart_coords = struct.cart_coords
+    symbols = [site.specie.symbol for site in struct.sites]
+    comment = struct.formula
+    
+    for vacuum in vacuums:
+        ## as add_vacuum followed by center_slab: 
+        ## extend the cell along z, keeping the cartesian coords, and re-center
+        lattice_vac = lattice.copy()
+        lattice_vac[2,2] += vacuum - (struct.lattice.c - slab_d)
+        frac_coords = np.linalg.solve(lattice_vac.T, cart_coords.T).T
+        frac_coords[:,2] += _center_shift(frac_coords[:,2])
+        
+        dir_sub = os.path.join(dir_main,"vac_%d"%vacuum)
+        if not os.path.exists(dir_sub):
+            os.makedirs(dir_sub)
+        _write_poscar(os.path.join(dir_sub,"POSCAR"),comment,lattice_vac,symbols,frac_coords)
+    
+    return slab_d
+
+    
+def gen_unitcell_2d(path_poscar,vacuum,zaxis='c',from_bulk=False,slabmin=None,slabmax=None):
+        
+    """ 
+    Generate 2D unitcell (see gen_unitcells_2d to generate many vacuum spacings at once).
     
+    Parameters
+    ----------
+    path_poscar (str): path to unitcell POSCAR
+    vacuum (int): vacuum spacing in Angstroms
+    [optional] zaxis (str): axis perpendicular to layer: a/b/c(default)
+    [optional] from_bulk (bool): extract layer from bulk? Default=False.
+    [optional] slabmin (float): fractional coord of the bottom of the layer to isolate
+    [optional] slabmax (float): fractional coord of the top of the layer to isolate
+                                (if neither is given, the layers are found automatically
+                                with find_layers, and the first one is used)
+       
+    """
+
+    gen_unitcells_2d(path_poscar,[vacuum],zaxis,from_bulk,slabmin,slabmax)
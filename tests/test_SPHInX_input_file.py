@@ -0,0 +1,85 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from pymatgen.core.lattice import Lattice
+from qdef2d import campaign
+from qdef2d.defects.corrections import SPHInX_input_file
+
+
+class TestGenerateAll(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.lattice = Lattice.from_parameters(6.4,6.4,20.,90,90,120)
+        for leaf in ['charge_1/2x2x1/vac_20','charge_-1/2x2x1/vac_20','charge_0/2x2x1/vac_20',
+                     'charge_1/2x2x1/vac_20/dos']:
+            self._defprop(leaf)
+        ## a charged calculation without its defectproperty.json file
+        os.makedirs(os.path.join(self.dir,'charge_1','3x3x1','vac_20'))
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def _defprop(self, leaf):
+
+        q = int(leaf.split('/')[0].split('_')[-1])
+        os.makedirs(os.path.join(self.dir,leaf))
+        with open(os.path.join(self.dir,leaf,'defectproperty.json'),'w') as f:
+            json.dump({"lattice": self.lattice.as_dict(), "defect_site": [[0.,0.,0.5]],
+                       "charge": q},f)
+
+
+    def _sxfile(self, leaf):
+
+        return os.path.join(self.dir,leaf,'correction','system.sx')
+
+
+    def test_generate_all(self):
+
+        ## every charged calculation gets a status, and a failure doesn't stop the others
+        statuses = SPHInX_input_file.generate_all(campaign.index(self.dir),5.,6.)
+        paths = {leaf: os.path.join(self.dir,leaf)
+                 for leaf in ['charge_1/2x2x1/vac_20','charge_-1/2x2x1/vac_20','charge_1/3x3x1/vac_20']}
+        self.assertEqual(sorted(statuses),sorted(paths.values()))
+        self.assertEqual(statuses[paths['charge_1/2x2x1/vac_20']],'written')
+        self.assertEqual(statuses[paths['charge_-1/2x2x1/vac_20']],'written')
+        self.assertTrue(statuses[paths['charge_1/3x3x1/vac_20']].startswith('failed: '))
+        self.assertIn('defectproperty.json',statuses[paths['charge_1/3x3x1/vac_20']])
+        self.assertFalse(os.path.exists(self._sxfile('charge_0/2x2x1/vac_20')))
+
+        with open(self._sxfile('charge_-1/2x2x1/vac_20')) as f:
+            self.assertIn('Q = +1;',f.read())
+
+        ## a second run leaves the files that are up to date untouched
+        sxfile = self._sxfile('charge_1/2x2x1/vac_20')
+        os.utime(sxfile,ns=(0,0))
+        statuses = SPHInX_input_file.generate_all(campaign.index(self.dir),5.,6.)
+        self.assertEqual(statuses[paths['charge_1/2x2x1/vac_20']],'unchanged')
+        self.assertEqual(statuses[paths['charge_-1/2x2x1/vac_20']],'unchanged')
+        self.assertEqual(os.stat(sxfile).st_mtime_ns,0)
+
+        ## but rewrites those that have changed
+        statuses = SPHInX_input_file.generate_all(campaign.index(self.dir),6.,6.)
+        self.assertEqual(statuses[paths['charge_1/2x2x1/vac_20']],'written')
+        self.assertNotEqual(os.stat(sxfile).st_mtime_ns,0)
+
+
+    def test_soc(self):
+
+        ## with soc, the input files go in the dos subdirectories
+        statuses = SPHInX_input_file.generate_all(campaign.index(self.dir),5.,6.,soc=True)
+        self.assertEqual(statuses,{os.path.join(self.dir,'charge_1','2x2x1','vac_20','dos'): 'written'})
+        self.assertTrue(os.path.exists(self._sxfile('charge_1/2x2x1/vac_20/dos')))
+
+
+if __name__ == '__main__':
+
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestGenerateAll)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,317 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+import numpy as np
+from pymatgen.core import Structure, Lattice
+from pymatgen.io.vasp.outputs import Locpot
+from qdef2d.defects.corrections import alignment_correction_2d, SPHInX_input_file
+from qdef2d.defects.corrections.gaussian_model_2d import GaussianModel2D
+
+
+def synthetic_profile(z, root, C, q):
+
+    ## synthetic profiles: the short-range potential in the vacuum is a straight line
+    ## whose slope depends nonlinearly on the shift, and vanishes at root
+    def profile(shift):
+        x = shift - root
+        slope = -np.sign(q)*0.01*(x + 0.5*x**3)
+        V = C + slope*(z - z.mean())
+        return np.column_stack([z, np.zeros_like(V), V, V])
+
+    return profile
+
+
+class TestShiftSearch(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.z = np.linspace(0.,40.,401)
+        self.root = 3.3
+        self.C = 0.25
+        self.myLogger = logging.getLogger()
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def _run(self, q, start=0., bracket=(-1.,1.), max_iter=20):
+
+        ## run the search, keeping track of every profile evaluated and the result;
+        ## the saved state of an earlier run is only reused for the same synthetic profiles
+        self.shifts, self.finished = [], []
+        synthetic = synthetic_profile(self.z, self.root, self.C, q)
+        def profile(shift):
+            self.shifts.append(shift)
+            return synthetic(shift)
+        def finish(shift,C_ave):
+            self.finished.append((shift,C_ave))
+
+        state = alignment_correction_2d.AlignmentState(os.path.join(self.dir,'alignment.json'),
+                                                       {"q": q, "root": self.root})
+        done = alignment_correction_2d._calc(profile,finish,q,1e-6,1e-6,max_iter,True,False,
+                                             start,bracket,state,self.dir,self.myLogger)
+        return done, state
+
+
+    def test_bracket_expansion(self):
+
+        ## the bracket is moved out by its width until the slopes change sign
+        done, state = self._run(1)
+        self.assertTrue(done)
+        self.assertEqual(self.shifts[:4], [0.,1.,3.,5.])
+        self.assertTrue(all(3. <= shift <= 5. for shift in self.shifts[4:]))
+
+        ## on the other side
+        self.root = -2.5
+        done, state = self._run(1)
+        self.assertTrue(done)
+        self.assertEqual(self.shifts[:3], [0.,-1.,-3.])
+
+
+    def test_converged(self):
+
+        ## converged within max_iter, and the correction is only evaluated once, at the root
+        done, state = self._run(1)
+        self.assertTrue(done)
+        self.assertLessEqual(len(self.shifts), 20+1)
+        self.assertEqual(len(self.finished), 1)
+        shift, C_ave = self.finished[0]
+        self.assertAlmostEqual(shift, self.root, places=4)
+        self.assertAlmostEqual(C_ave, self.C, places=6)
+        self.assertEqual((state.shift,state.C_ave), (shift,C_ave))
+
+        ## starting at the root needs a single evaluation
+        done, state = self._run(1, start=self.root, bracket=(self.root-1,self.root+1))
+        self.assertTrue(done)
+        self.assertEqual(len(self.shifts), 1)
+
+
+    def test_not_converged(self):
+
+        ## too few tries: the correction is not evaluated, and nothing is saved as converged
+        done, state = self._run(1, max_iter=3)
+        self.assertFalse(done)
+        self.assertEqual(len(self.shifts), 3+1)
+        self.assertEqual(self.finished, [])
+        self.assertIsNone(state.shift)
+        saved = alignment_correction_2d.load_state(self.dir)
+        self.assertFalse(saved["converged"])
+        self.assertEqual(len(saved["evaluations"]), 3+1)
+
+
+    def test_negative_charge(self):
+
+        ## the slopes of a negative charge have the opposite sign
+        for root in [3.3,-2.5]:
+            self.root = root
+            done, state = self._run(-1)
+            self.assertTrue(done)
+            self.assertAlmostEqual(self.finished[0][0], root, places=4)
+            self.assertEqual(self.shifts[1], np.sign(root))
+
+
+    def test_initial_bracket(self):
+
+        ## the slab boundaries relative to the defect position bound the shift
+        sxfile = os.path.join(self.dir,'system.sx')
+        self.assertEqual(alignment_correction_2d._bracket(sxfile), (-1.,1.))
+
+        lattice = np.array([[9.6,0.,0.],[-4.8,8.313843,0.],[0.,0.,20.]])
+        defprop = {"lattice": {"matrix": lattice.tolist()}, "defect_site": [[0.,0.,0.55]],
+                   "charge": 1}
+        with open(sxfile,'w') as f:
+            f.write(SPHInX_input_file.render(defprop,8.,6.))
+        bracket = alignment_correction_2d._bracket(sxfile)
+        ## the slab is 6 Angstroms thick around the middle of the cell, the defect 1 Angstrom above
+        np.testing.assert_allclose(bracket, SPHInX_input_file.Ang_to_bohr(np.array([-4.,2.])),
+                                   atol=1e-6)
+
+
+class TestAlignmentState(unittest.TestCase):
+
+    def setUp(self):
+
+        ## the LOCPOTs and SPHInX input file are only looked at, not read, by _inputs
+        self.dir = tempfile.mkdtemp()
+        self.vref = os.path.join(self.dir,'LOCPOT_ref')
+        self.vdef = os.path.join(self.dir,'LOCPOT_def.gz')
+        self.sxfile = os.path.join(self.dir,'system.sx')
+        for filename,s in [(self.vref,'ref'),(self.vdef,'def'),(self.sxfile,'slab {}')]:
+            with open(filename,'w') as f:
+                f.write(s)
+        self.filename = os.path.join(self.dir,alignment_correction_2d.STATEFILE)
+        self.z = np.linspace(0.,40.,401)
+        self.myLogger = logging.getLogger()
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def _state(self, encut=400, q=1):
+
+        return alignment_correction_2d.AlignmentState(self.filename,
+            alignment_correction_2d._inputs(self.vref,self.vdef,self.sxfile,encut,q,'native'))
+
+
+    def _run(self, state, max_iter):
+
+        shifts = []
+        synthetic = synthetic_profile(self.z, 3.3, 0.25, 1)
+        def profile(shift):
+            shifts.append(shift)
+            return synthetic(shift)
+        done = alignment_correction_2d._calc(profile,lambda shift,C_ave: None,1,1e-6,1e-6,
+                                             max_iter,True,False,0.,(-1.,1.),state,
+                                             self.dir,self.myLogger)
+        return done, shifts
+
+
+    def test_resume(self):
+
+        ## an interrupted search picks up where it left off, without redoing any shift
+        done, shifts1 = self._run(self._state(), 3)
+        self.assertFalse(done)
+        saved = alignment_correction_2d.load_state(self.dir)
+        self.assertEqual([e[0] for e in saved["evaluations"]], shifts1)
+
+        state = self._state()
+        self.assertEqual(len(state.evaluations), len(shifts1))
+        done, shifts2 = self._run(state, 20)
+        self.assertTrue(done)
+        self.assertFalse(set(shifts1) & set(shifts2))
+        self.assertLessEqual(len(shifts1) + len(shifts2), 20+1)
+
+        ## the converged shift is kept for the next run
+        state = self._state()
+        self.assertAlmostEqual(state.shift, 3.3, places=4)
+        self.assertAlmostEqual(state.C_ave, 0.25, places=6)
+        self.assertEqual(alignment_correction_2d.load_state(self.dir)["shift"], state.shift)
+
+        ## a missing or unreadable state file is no saved state at all
+        with open(self.filename,'w') as f:
+            f.write('{"inputs": ')
+        self.assertIsNone(alignment_correction_2d.load_state(self.dir))
+        self.assertIsNone(alignment_correction_2d.load_state(self.dir,'other.json'))
+        self.assertEqual(self._state().evaluations, {})
+
+
+    def test_changed_inputs(self):
+
+        ## anything saved for other inputs is discarded
+        self._run(self._state(), 20)
+        self.assertIsNotNone(self._state().shift)
+
+        for state in [self._state(encut=520), self._state(q=-1)]:
+            self.assertEqual(state.evaluations, {})
+            self.assertIsNone(state.shift)
+
+        ## a rewritten LOCPOT (or SPHInX input file) is new input, even with the same name
+        for filename,s in [(self.vdef,'def2'),(self.vref,'ref'),(self.sxfile,'slab {};')]:
+            self._run(self._state(), 20)
+            self.assertIsNotNone(self._state().shift)
+            st = os.stat(filename)
+            with open(filename,'w') as f:
+                f.write(s)
+            os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            state = self._state()
+            self.assertEqual(state.evaluations, {})
+            self.assertIsNone(state.shift)
+
+
+class TestScan(unittest.TestCase):
+
+    def setUp(self):
+
+        ## the DFT potential is that of the model charge 0.3 bohr above the defect, plus a constant
+        self.dir = tempfile.mkdtemp()
+        self.lattice = Lattice.from_parameters(6.4,6.4,20.,90,90,120)
+        defprop = {"lattice": self.lattice.as_dict(), "defect_site": [[0.,0.,0.5]], "charge": 1}
+        self.sxfile = os.path.join(self.dir,'system.sx')
+        with open(self.sxfile,'w') as f:
+            f.write(SPHInX_input_file.render(defprop,5.,6.))
+        self.model = GaussianModel2D.from_sphinx(self.sxfile,300)
+        self.nz = 100
+        self.z = np.arange(self.nz)*SPHInX_input_file.Ang_to_bohr(20.)/self.nz
+        self.dV = self.model.model_on_grid(0.3,self.z) + 0.05
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def test_scan(self):
+
+        ## the batched scan agrees with the profile of each shift
+        shifts = np.linspace(-1.,1.,9)
+        out = alignment_correction_2d.scan(self.model,self.z,self.dV,shifts)
+        np.testing.assert_array_equal(out["shift"],shifts)
+        for i,shift in enumerate(shifts):
+            data = self.model.profile(shift,self.z,self.dV)
+            ref = alignment_correction_2d._vacuum_fit(data[:,0],data[:,-1])
+            np.testing.assert_allclose([out[key][i] for key in ['m1','m2','C1','C2']],ref,
+                                       rtol=1e-10,atol=1e-12)
+
+
+    def test_scan_root(self):
+
+        ## start from the interpolated root, bracketed by the grid points on either side of it
+        shifts = np.linspace(-1.,1.,9)
+        out = alignment_correction_2d.scan(self.model,self.z,self.dV,shifts)
+        start, bracket = alignment_correction_2d._scan_root(out,1,0.,(-1.,1.))
+        self.assertEqual(bracket,(0.25,0.5))
+        self.assertAlmostEqual(start,0.3,places=6)
+
+        ## with the root outside the scanned range, start from the closest end
+        out = alignment_correction_2d.scan(self.model,self.z,self.dV,np.linspace(-1.,0.,5))
+        self.assertEqual(alignment_correction_2d._scan_root(out,1,0.,(-1.,0.)),(0.,(-1.,0.)))
+        out = alignment_correction_2d.scan(self.model,self.z,self.dV,np.linspace(0.5,1.,5))
+        self.assertEqual(alignment_correction_2d._scan_root(out,1,0.,(0.5,1.)),(0.5,(0.5,1.)))
+
+
+    def test_calc_nscan(self):
+
+        ## the search started from the root of the scan stays within its bracket
+        struct = Structure(self.lattice,['Mo','S','S'],[[0,0,.5],[1/3,2/3,.42],[1/3,2/3,.58]])
+        vref, vdef = os.path.join(self.dir,'LOCPOT_ref'), os.path.join(self.dir,'LOCPOT_def')
+        ref = np.zeros((4,4,self.nz))
+        Locpot(struct,{'total': ref}).write_file(vref)
+        Locpot(struct,{'total': ref + self.dV[None,None,:]}).write_file(vdef)
+
+        done = alignment_correction_2d.calc(vref,vdef,300,1,threshold_slope=1e-9,threshold_C=1e-6,
+                                            noplots=True,solver='native',dir_corr=self.dir,
+                                            nscan=9)
+        self.assertTrue(done)
+        ## the scan covers the initial bracket from the slab boundaries
+        scan = np.loadtxt(os.path.join(self.dir,'shift_scan.dat'))
+        self.assertEqual(scan.shape,(9,5))
+        np.testing.assert_allclose(scan[[0,-1],0],alignment_correction_2d._bracket(self.sxfile))
+        i = np.searchsorted(scan[:,0],0.3)
+
+        state = alignment_correction_2d.load_state(self.dir)
+        shifts = [e[0] for e in state["evaluations"]]
+        self.assertLessEqual(len(shifts),3)
+        self.assertTrue(all(scan[i-1,0]-1e-8 <= shift <= scan[i,0]+1e-8 for shift in shifts))
+        self.assertAlmostEqual(state["shift"],0.3,places=4)
+        self.assertAlmostEqual(state["C_ave"],0.05,places=4)
+        self.assertTrue(os.path.exists(os.path.join(self.dir,'correction')))
+
+
+if __name__ == '__main__':
+
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestShiftSearch)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestAlignmentState)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestScan)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,188 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import subprocess
+import tempfile
+import unittest
+import numpy as np
+from pymatgen.core import Structure, Lattice
+from pymatgen.io.vasp.outputs import Locpot
+from qdef2d.defects.corrections import apply_corrections_2d, alignment_correction_2d, plot_alignment, \
+                                      SPHInX_input_file
+from qdef2d.defects.corrections.gaussian_model_2d import GaussianModel2D
+
+
+class TestApplyAll(unittest.TestCase):
+
+    def setUp(self):
+
+        ## toy campaign, with the defect potentials those of the model charge, shifted by 0.3*q bohr
+        self.dir = tempfile.mkdtemp()
+        self.dir_def = os.path.join(self.dir,'def')
+        self.dir_ref = os.path.join(self.dir,'ref')
+        lattice = Lattice.from_parameters(6.4,6.4,20.,90,90,120)
+        struct = Structure(lattice,['Mo','S','S'],[[0,0,.5],[1/3,2/3,.42],[1/3,2/3,.58]])
+        nz = 100
+        z = np.arange(nz)*SPHInX_input_file.Ang_to_bohr(20.)/nz
+        self.eps_slab, self.d_slab = 5., 6.
+
+        ## calculations with both LOCPOTs, and with either of them missing or unreadable
+        self.good = ['charge_1/2x2x1/vac_20','charge_-1/2x2x1/vac_20']
+        self.no_locpot = 'charge_1/2x2x1/vac_25'
+        self.no_ref = 'charge_1/3x3x1/vac_20'
+        self.bad_locpot = 'charge_-1/3x3x1/vac_25'
+        for leaf in self.good + [self.no_locpot,self.no_ref,self.bad_locpot,'charge_0/2x2x1/vac_20']:
+            os.makedirs(os.path.join(self.dir_def,leaf))
+            q = int(leaf.split('/')[0].split('_')[-1])
+            defprop = {"lattice": lattice.as_dict(), "defect_site": [[0.,0.,0.5]], "charge": q}
+            with open(os.path.join(self.dir_def,leaf,'defectproperty.json'),'w') as f:
+                json.dump(defprop,f)
+            if leaf in self.good:
+                sx = os.path.join(self.dir,'system.sx')
+                with open(sx,'w') as f:
+                    f.write(SPHInX_input_file.render(defprop,self.eps_slab,self.d_slab))
+                dV = GaussianModel2D.from_sphinx(sx,300).model_on_grid(0.3*q,z) + 0.05
+                Locpot(struct,{'total': np.zeros((4,4,nz)) + dV}).write_file(
+                        os.path.join(self.dir_def,leaf,'LOCPOT'))
+        with open(os.path.join(self.dir_def,self.bad_locpot,'LOCPOT'),'w') as f:
+            f.write('not a LOCPOT\n')
+        Locpot(struct,{'total': np.zeros((4,4,nz))}).write_file(
+                os.path.join(self.dir_def,self.no_ref,'LOCPOT'))
+
+        for cell,vac in [('2x2x1','vac_20'),('2x2x1','vac_25'),('3x3x1','vac_25')]:
+            os.makedirs(os.path.join(self.dir_ref,'charge_0',cell,vac))
+            Locpot(struct,{'total': np.zeros((4,4,nz))}).write_file(
+                    os.path.join(self.dir_ref,'charge_0',cell,vac,'LOCPOT'))
+        os.makedirs(os.path.join(self.dir_ref,'charge_0','3x3x1','vac_20'))
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def _statuses(self, **kwargs):
+
+        statuses = apply_corrections_2d.apply_all(self.dir_def,self.dir_ref,
+                                                  self.eps_slab,self.d_slab,encut=300,native=True,
+                                                  plots=False,**kwargs)
+        return {'charge_%d/%s/%s'%(row.charge,row.supercell,row.vacuum): row.status
+                for row in statuses.itertuples()}
+
+
+    def test_failures(self):
+
+        ## every charged calculation has a status, and a failure in one doesn't stop the others
+        statuses = self._statuses(nprocs=2)
+        self.assertEqual(sorted(statuses), sorted(self.good + [self.no_locpot,self.no_ref,
+                                                               self.bad_locpot]))
+        for leaf in self.good:
+            self.assertEqual(statuses[leaf],'done')
+            state = alignment_correction_2d.load_state(os.path.join(self.dir_def,leaf,'correction'))
+            q = int(leaf.split('/')[0].split('_')[-1])
+            self.assertAlmostEqual(state["shift"],0.3*q,places=4)
+            self.assertTrue(os.path.exists(os.path.join(self.dir_def,leaf,'correction','correction')))
+        self.assertEqual(statuses[self.no_locpot],
+                         'missing ' + os.path.join(self.dir_def,self.no_locpot,'LOCPOT'))
+        self.assertEqual(statuses[self.no_ref],
+                         'missing ' + os.path.join(self.dir_ref,'charge_0','3x3x1','vac_20','LOCPOT'))
+        self.assertTrue(statuses[self.bad_locpot].startswith('failed: '))
+
+        ## once the missing file is there, the next run corrects it too;
+        ## the converged ones start from (and stop at) their saved shift
+        dir_corr = os.path.join(self.dir_def,self.good[0],'correction')
+        n_eval = len(alignment_correction_2d.load_state(dir_corr)["evaluations"])
+        shutil.copy(os.path.join(self.dir_def,self.good[0],'LOCPOT'),
+                    os.path.join(self.dir_def,self.no_locpot,'LOCPOT'))
+        statuses = self._statuses()
+        self.assertEqual(statuses[self.no_locpot],'done')
+        self.assertEqual(statuses[self.good[0]],'done')
+        self.assertEqual(len(alignment_correction_2d.load_state(dir_corr)["evaluations"]),n_eval)
+
+
+    def test_nscan(self):
+
+        ## nscan is passed on to each alignment, which scans the shifts before the search
+        statuses = self._statuses(nscan=5)
+        for leaf in self.good:
+            self.assertEqual(statuses[leaf],'done')
+            scan = np.loadtxt(os.path.join(self.dir_def,leaf,'correction','shift_scan.dat'))
+            self.assertEqual(scan.shape,(5,5))
+
+
+    def test_deferred_plots(self):
+
+        ## with --noplots, matplotlib isn't even imported: run the command line in a fresh
+        ## interpreter in which it can't be imported, neither there nor in the (forked) workers
+        argv = ['apply_corrections_2d',self.dir_def,self.dir_ref,'--eps_slab',str(self.eps_slab),
+                '--d_slab',str(self.d_slab),'--encut','300','--native','--noplots']
+        code = ("import sys, runpy; sys.modules['matplotlib'] = None; sys.argv = %r; "
+                "runpy.run_module('qdef2d.defects.corrections.apply_corrections_2d',"
+                "run_name='__main__',alter_sys=True)"%argv)
+        out = subprocess.run([sys.executable,'-c',code],capture_output=True,text=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(out.returncode,0,out.stderr)
+        for leaf in self.good:
+            self.assertIn('%s: done'%leaf,out.stderr)
+
+        ## the profiles of every iteration are saved, and plotted all at once afterwards
+        dirs_corr = [os.path.join(self.dir_def,leaf,'correction') for leaf in self.good]
+        profiles = [glob.glob(os.path.join(d,'alignment_*.npz')) for d in dirs_corr]
+        self.assertTrue(all(profiles))
+        self.assertEqual(glob.glob(os.path.join(self.dir_def,'*','*','*','correction','*.png')),[])
+
+        self.assertEqual(plot_alignment.render_all(dirs_corr,nprocs=2),sum(map(len,profiles)))
+        for filename in sum(profiles,[]):
+            self.assertTrue(os.path.exists(os.path.splitext(filename)[0] + '.png'))
+        ## only new or changed profiles are plotted again
+        self.assertEqual(plot_alignment.render_all(dirs_corr),0)
+
+
+    def test_missing_slab(self):
+
+        ## the SPHInX input files can't be generated without the slab properties
+        with self.assertRaisesRegex(ValueError,'eps_slab and d_slab'):
+            apply_corrections_2d.apply_all(self.dir_def,self.dir_ref,encut=300,native=True)
+
+
+class TestNearest(unittest.TestCase):
+
+    def test_nearest(self):
+
+        ## converged shifts as (charge, supercell, vacuum, shift)
+        done = [(1,'3x3x1','vac_20',0.1), (1,'5x5x1','vac_20',0.2),
+                (1,'4x4x1','vac_30',0.3), (-1,'4x4x1','vac_20',0.4),
+                (1,'4x4x4',None,0.5), (-1,'3x3x3',None,0.6)]
+        nearest = lambda q,cell,vac: apply_corrections_2d._nearest(done,q,cell,vac)
+
+        self.assertIsNone(apply_corrections_2d._nearest([],1,'4x4x1','vac_20'))
+        ## itself, e.g. from an earlier run
+        self.assertEqual(nearest(1,'5x5x1','vac_20'), 0.2)
+        ## the same charge state comes first, even if another one is closer
+        self.assertEqual(nearest(-1,'4x4x1','vac_30'), 0.4)
+        ## then the closest supercell size and vacuum spacing (on a log scale)
+        self.assertEqual(nearest(1,'3x3x1','vac_25'), 0.1)
+        self.assertEqual(nearest(1,'4x4x1','vac_28'), 0.3)
+        self.assertEqual(nearest(1,'4x4x1','vac_20'), 0.3)
+        self.assertEqual(nearest(1,'6x6x1','vac_20'), 0.2)
+        ## a charge state with nothing converged yet takes the closest of any other
+        self.assertEqual(nearest(2,'5x5x1','vac_21'), 0.2)
+
+        ## bulk calculations (no vacuum level) are only paired with each other
+        self.assertEqual(nearest(1,'3x3x3',None), 0.5)
+        self.assertEqual(nearest(-1,'6x6x6',None), 0.6)
+        self.assertEqual(nearest(2,'3x3x3',None), 0.6)
+        self.assertEqual(nearest(-1,'3x3x1','vac_20'), 0.4)
+        self.assertEqual(nearest(1,'5x5x1','vac_15'), 0.2)
+
+
+if __name__ == '__main__':
+
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestApplyAll)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestNearest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
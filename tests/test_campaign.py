@@ -0,0 +1,143 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from qdef2d import campaign
+
+
+class TestCampaign(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        ## toy campaign: 2D calculations with vac_<n> subdirectories next to stray ones,
+        ## a bulk calculation with no vacuum level, soc/dos calculations and restarts
+        self._touch('initdef_MoS2.json')
+        self._touch('charge_0/4x4x1/vac_20/OUTCAR')
+        self._touch('charge_0/4x4x1/vac_20/soc_ncl/OUTCAR.gz')
+        self._touch('charge_0/4x4x1/vac_20/dos/OUTCAR')
+        self._touch('charge_0/4x4x1/vac_25/OUTCAR')
+        self._touch('charge_0/4x4x1/vac_25/restart/restart/OUTCAR')
+        self._touch('charge_0/4x4x1/correction/vac_20/LOCPOT')
+        self._touch('charge_0/4x4x1/vac_20_old/OUTCAR')
+        self._touch('charge_-1/4x4x1/vac_20/restart/OUTCAR.bz2')
+        self._touch('charge_-1/4x4x1/vac_20/soc/OUTCAR')
+        self._touch('charge_-1/4x4x1/vac_20/soc_old/OUTCAR')
+        self._touch('charge_1/3x3x3/OUTCAR')
+        self._touch('charge_1/3x3x3/dos/OUTCAR')
+        self._touch('charge_1/3x3x3/restart/OUTCAR')
+        self._touch('charge_x/4x4x1/vac_20/OUTCAR')
+        self._touch('notes/4x4x1/vac_20/OUTCAR')
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def _touch(self, filename):
+
+        path = os.path.join(self.dir,filename)
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        open(path,'w').close()
+
+
+    def test_index(self):
+
+        manifest = campaign.index(self.dir)
+        self.assertEqual(manifest.initdef,'initdef_MoS2.json')
+        self.assertEqual(manifest.charges(),[-1,0,1])
+        self.assertEqual(len(manifest),9)
+
+        ## only vac_<n> subdirectories are vacuum levels, stray ones are left out
+        self.assertEqual(sorted((leaf.charge,leaf.vacuum) for leaf in manifest.leaves()),
+                         [(-1,'vac_20'),(0,'vac_20'),(0,'vac_25'),(1,None)])
+        self.assertEqual(manifest.leaves(charge=0,vacuum='vac_25')[0].path,
+                         os.path.join(self.dir,'charge_0','4x4x1','vac_25','restart','restart'))
+        self.assertIsNone(manifest.get(0,'4x4x1','vac_20_old'))
+        self.assertIsNone(manifest.get(0,'4x4x1',None))
+
+        ## a bulk calculation is the supercell directory itself
+        leaf = manifest.get(1,'3x3x3',None)
+        self.assertEqual(leaf.base,os.path.join(self.dir,'charge_1','3x3x3'))
+        self.assertEqual(leaf.path,os.path.join(leaf.base,'restart'))
+        self.assertEqual(leaf.restart,1)
+        self.assertEqual(manifest.get(1,'3x3x3',None,'dos').base,os.path.join(leaf.base,'dos'))
+
+
+    def test_variants(self):
+
+        manifest = campaign.index(self.dir)
+        base = os.path.join(self.dir,'charge_0','4x4x1','vac_20')
+
+        ## 'soc' matches any *soc* subdirectory, 'dos' only dos itself
+        leaf = manifest.get(0,'4x4x1','vac_20','soc')
+        self.assertEqual((leaf.variant,leaf.path),('soc_ncl',os.path.join(base,'soc_ncl')))
+        self.assertEqual(leaf.find('OUTCAR'),os.path.join(base,'soc_ncl','OUTCAR.gz'))
+        leaf = manifest.get(0,'4x4x1','vac_20','dos')
+        self.assertEqual((leaf.variant,leaf.path),('dos',os.path.join(base,'dos')))
+        self.assertIsNone(manifest.get(0,'4x4x1','vac_20','ncl'))
+        self.assertIsNone(manifest.get(0,'4x4x1','vac_25','dos'))
+        self.assertEqual(manifest.get(0,'4x4x1','vac_20').path,base)
+
+        ## two *soc* subdirectories: neither is picked
+        self.assertIsNone(manifest.get(-1,'4x4x1','vac_20','soc'))
+        self.assertEqual([leaf.base for leaf in manifest.leaves(variant='soc')],
+                         [os.path.join(base,'soc_ncl')])
+        self.assertEqual(len(manifest.leaves(variant='dos')),2)
+
+
+    def test_restart(self):
+
+        manifest = campaign.index(self.dir)
+        leaf = manifest.get(0,'4x4x1','vac_25')
+        self.assertEqual(leaf.restart,2)
+        self.assertEqual(leaf.files,{'OUTCAR'})
+        leaf = manifest.get(-1,'4x4x1','vac_20')
+        self.assertEqual(leaf.restart,1)
+        self.assertEqual(leaf.find('OUTCAR'),os.path.join(leaf.base,'restart','OUTCAR.bz2'))
+        self.assertTrue(leaf.has('OUTCAR'))
+        self.assertFalse(leaf.has('LOCPOT'))
+
+
+    def test_get_leaf(self):
+
+        manifest = campaign.index(self.dir)
+        logger = logging.getLogger('test_campaign')
+
+        with self.assertLogs(logger,'INFO') as logs:
+            leaf = campaign.get_leaf(manifest,0,'4x4x1','vac_25',None,logger)
+        self.assertEqual(leaf.restart,2)
+        self.assertEqual(logs.output,['INFO:test_campaign:parsing restart subdirectory'])
+
+        with self.assertLogs(logger,'INFO') as logs:
+            leaf = campaign.get_leaf(manifest,0,'4x4x1','vac_20','soc',logger)
+        self.assertEqual(leaf.variant,'soc_ncl')
+        self.assertEqual(logs.output,['INFO:test_campaign:parsing soc_ncl subdirectory'])
+
+        with self.assertLogs(logger,'WARNING') as logs:
+            self.assertIsNone(campaign.get_leaf(manifest,-1,'4x4x1','vac_20','soc',logger))
+            self.assertIsNone(campaign.get_leaf(manifest,2,'4x4x1','vac_20',None,logger))
+        self.assertEqual(logs.output,
+                         ['WARNING:test_campaign:cannot find a (unique) soc subdirectory in %s'
+                          %os.path.join(self.dir,'charge_-1','4x4x1','vac_20'),
+                          'WARNING:test_campaign:cannot find %s'
+                          %os.path.join(self.dir,'charge_2','4x4x1','vac_20')])
+
+
+    def test_find_initdef(self):
+
+        self.assertEqual(campaign.find_initdef(self.dir),'initdef_MoS2.json')
+        ## none, or more than one
+        self.assertIsNone(campaign.find_initdef(os.path.join(self.dir,'charge_0')))
+        self._touch('initdef_WSe2.json')
+        self.assertIsNone(campaign.find_initdef(self.dir))
+        self.assertIsNone(campaign.index(self.dir).initdef)
+
+
+if __name__ == '__main__':
+
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCampaign)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,106 @@
+import os
+import bz2
+import gzip
+import zlib
+import shutil
+import struct
+import tempfile
+import unittest
+import numpy as np
+from qdef2d.io import compressed
+
+
+def _bgzf_block(data):
+
+    ## a single BGZF block: a gzip member with the block size in its 'BC' extra subfield
+    deflate = zlib.compressobj(6, zlib.DEFLATED, -15)
+    cdata = deflate.compress(data) + deflate.flush()
+    header = struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0, 255, 6,
+                         ord('B'), ord('C'), 2, 18 + len(cdata) + 8 - 1)
+    return header + cdata + struct.pack('<2I', zlib.crc32(data), len(data))
+
+
+class TestCompressed(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        ## a few hundred kB of OUTCAR-like text, large enough to span several blocks
+        rng = np.random.RandomState(0)
+        self.data = b''.join([b'  Iteration %4d( %3d)  energy = %.8f\n'%(i, i%40, x)
+                              for i,x in enumerate(rng.normal(size=8000))])
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def _path(self, filename):
+
+        return os.path.join(self.dir, filename)
+
+
+    def _files(self):
+
+        ## the same contents as a plain file, and in every compressed format we read,
+        ## including the blocked formats that are decompressed in parallel
+        with open(self._path('OUTCAR'), 'wb') as f:
+            f.write(self.data)
+        with gzip.open(self._path('OUTCAR.gz'), 'wb') as f:
+            f.write(self.data)
+        with open(self._path('OUTCAR.bz2'), 'wb') as f:
+            f.write(bz2.compress(self.data))
+
+        ## multi-stream bzip2, as written by pbzip2
+        with open(self._path('pbzip2.bz2'), 'wb') as f:
+            for i in range(0, len(self.data), 50000):
+                f.write(bz2.compress(self.data[i:i+50000]))
+
+        ## BGZF, as written by bgzip, with its empty end-of-file block
+        with open(self._path('bgzip.gz'), 'wb') as f:
+            for i in range(0, len(self.data), 2**16-1024):
+                f.write(_bgzf_block(self.data[i:i+2**16-1024]))
+            f.write(_bgzf_block(b''))
+
+        return ['OUTCAR', 'OUTCAR.gz', 'OUTCAR.bz2', 'pbzip2.bz2', 'bgzip.gz']
+
+
+    def test_iter_blocks(self):
+
+        ## the blocks add up to the original contents, whether read serially or in parallel
+        self.assertTrue(compressed._is_multistream_bz2(self._path(self._files()[3])))
+        self.assertTrue(compressed._is_bgzf(self._path('bgzip.gz')))
+        self.assertFalse(compressed._is_bgzf(self._path('OUTCAR.gz')))
+
+        for filename in self._files():
+            for nthreads in [1, 4]:
+                for blocksize in [2**16, 2**22]:
+                    blocks = compressed.iter_blocks(self._path(filename), blocksize, nthreads)
+                    self.assertEqual(b''.join(blocks), self.data)
+
+
+    def test_uncompressed(self):
+
+        ## compressed files are decompressed into a temporary file that is removed afterwards,
+        ## plain files are passed through
+        for filename in self._files():
+            path = self._path(filename)
+            with compressed.uncompressed(path) as tmpfile:
+                with open(tmpfile, 'rb') as f:
+                    self.assertEqual(f.read(), self.data)
+            if filename == 'OUTCAR':
+                self.assertEqual(tmpfile, path)
+            else:
+                self.assertFalse(os.path.exists(tmpfile))
+
+        self.assertEqual(compressed.find_file(self.dir, 'OUTCAR'), self._path('OUTCAR'))
+        os.remove(self._path('OUTCAR'))
+        self.assertEqual(compressed.find_file(self.dir, 'OUTCAR'), self._path('OUTCAR.gz'))
+
+
+if __name__ == '__main__':
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCompressed)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from qdef2d.defects import extrapolate
+
+
+class TestExtrapolate(unittest.TestCase):
+
+    def setUp(self):
+
+        ## toy data: 3x3x1 to 6x6x1 supercells of a 3-atom unit cell, at 3 vacuum spacings
+        n = np.array([3,4,5,6])
+        self.N = np.repeat(3*n**2, 3).astype(float)
+        self.Lz = np.tile([15.,20.,25.], len(n))
+
+
+    def test_fit(self):
+
+        ## the fits recover the parameters of noise-free synthetic data, for every set at once
+        params = {'corrected': np.array([[1.2,3.0],[2.5,-8.0]]),
+                  'uncorrected': np.array([[1.2,0.8,5.0],[2.5,-1.5,12.0],[0.3,0.,0.]])}
+        for form,p in params.items():
+            X = extrapolate.design_matrix(self.N, self.Lz, form)
+            y = p @ X.T
+            N, Lz = np.tile(self.N,(len(p),1)), np.tile(self.Lz,(len(p),1))
+            out = extrapolate.fit(N, Lz, y, form, n_boot=50, seed=0)
+            np.testing.assert_allclose(out["params"], p, atol=1e-8)
+            np.testing.assert_allclose(out["E_inf"], p[:,0], atol=1e-8)
+            np.testing.assert_allclose(out["rms"], 0., atol=1e-8)
+            np.testing.assert_allclose(out["E_inf_err"], 0., atol=1e-6)
+            np.testing.assert_array_equal(out["n_points"], len(self.N))
+
+
+    def test_fit_missing(self):
+
+        ## missing points are left out of the fit, and the residuals of the rest are returned
+        rng = np.random.RandomState(0)
+        X = extrapolate.design_matrix(self.N, self.Lz, 'uncorrected')
+        y = X @ [1.2,0.8,5.0] + rng.normal(scale=1e-3, size=len(self.N))
+        y[[1,5]] = np.nan
+        out = extrapolate.fit(self.N[None], self.Lz[None], y[None], 'uncorrected',
+                              n_boot=200, seed=0)
+        self.assertEqual(out["n_points"][0], len(self.N)-2)
+        self.assertTrue(np.all(np.isnan(out["residuals"][0,[1,5]])))
+        self.assertAlmostEqual(out["E_inf"][0], 1.2, places=1)
+        self.assertTrue(0 < out["E_inf_err"][0] < 0.1)
+
+
+    def test_underdetermined(self):
+
+        ## fits without enough distinct points for every parameter give NaN, not a guess;
+        ## here: 2 points for 3 parameters, 2 distinct points repeated, a single point, no points
+        nan = np.nan
+        N = np.array([[27.,48.,nan,nan],[27.,27.,48.,48.],[27.,nan,nan,nan],[nan,nan,nan,nan]])
+        Lz = np.array([[15.,20.,nan,nan],[20.,20.,20.,20.],[15.,nan,nan,nan],[nan,nan,nan,nan]])
+        y = np.where(np.isnan(N), nan, 1.)
+        out = extrapolate.fit(N, Lz, y, 'uncorrected', n_boot=20, seed=0)
+        self.assertTrue(np.all(np.isnan(out["params"])))
+        self.assertTrue(np.all(np.isnan(out["rms"])))
+        self.assertTrue(np.all(np.isnan(out["E_inf_err"])))
+        np.testing.assert_array_equal(out["n_points"], [2,4,1,0])
+
+        ## the corrected form only needs 2 distinct supercells
+        out = extrapolate.fit(N, Lz, y, 'corrected', n_boot=20, seed=0)
+        np.testing.assert_allclose(out["E_inf"][:2], 1.)
+        self.assertTrue(np.all(np.isnan(out["E_inf"][2:])))
+
+
+    def test_read_energies(self):
+
+        ## one row per calculation of every charge state of every defect;
+        ## the neutral sheets only have corrected energies
+        tmpdir = tempfile.mkdtemp()
+        try:
+            dirs_def = []
+            for defect in ['vac_1_S', 'sub_1_W_on_S']:
+                dirs_def.append(os.path.join(tmpdir, defect))
+                os.makedirs(dirs_def[-1])
+                with pd.ExcelWriter(os.path.join(dirs_def[-1], 'eform.xlsx')) as writer:
+                    pd.DataFrame({'vacuum': ['vac_15','vac_20'], 'supercell': ['3x3x1','4x4x1'],
+                                  'N': [27,48], 'E_form_corr': [1.,1.1]}
+                                 ).to_excel(writer, sheet_name='charge_0', index=False)
+                    pd.DataFrame({'vacuum': ['vac_15','vac_20'], 'supercell': ['3x3x1','4x4x1'],
+                                  'N': [27,48], 'E_form_uncorr': [2.,2.1], 'E_form_corr': [1.5,1.6]}
+                                 ).to_excel(writer, sheet_name='charge_1', index=False)
+
+            data = extrapolate.read_energies(dirs_def, 'eform.xlsx')
+            self.assertEqual(len(data), 8)
+            self.assertEqual(sorted(set(data['defect'])), ['sub_1_W_on_S', 'vac_1_S'])
+            np.testing.assert_array_equal(data['Lz'].values[:2], [15.,20.])
+            neutral = data[data['charge'] == 0]
+            np.testing.assert_array_equal(neutral['E_form_uncorr'], neutral['E_form_corr'])
+            charged = data[data['charge'] == 1]
+            np.testing.assert_array_equal(charged['E_form_uncorr'], [2.,2.1,2.,2.1])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+    def test_calc(self):
+
+        ## extrapolate a defect with noise-free synthetic energies, and read the workbook back
+        tmpdir = tempfile.mkdtemp()
+        try:
+            dir_def = os.path.join(tmpdir, 'vac_1_S')
+            os.makedirs(dir_def)
+            rows = {'vacuum': ['vac_%d'%Lz for Lz in self.Lz],
+                    'supercell': ['%dx%dx1'%(n,n) for n in np.repeat([3,4,5,6],3)], 'N': self.N}
+            y_corr = [1.2,3.0] @ extrapolate.design_matrix(self.N, self.Lz, 'corrected').T
+            y_uncorr = [1.5,0.8,5.0] @ extrapolate.design_matrix(self.N, self.Lz, 'uncorrected').T
+            with pd.ExcelWriter(os.path.join(dir_def, 'eform.xlsx')) as writer:
+                pd.DataFrame(dict(rows, E_form_corr=y_corr)
+                             ).to_excel(writer, sheet_name='charge_0', index=False)
+                pd.DataFrame(dict(rows, E_form_uncorr=y_uncorr, E_form_corr=y_corr)
+                             ).to_excel(writer, sheet_name='charge_1', index=False)
+
+            outfile = os.path.join(tmpdir, 'extrapolated.xlsx')
+            results = extrapolate.calc([dir_def], 'eform.xlsx', outfile, n_boot=20, seed=0)
+            sheets = pd.read_excel(outfile, sheet_name=None)
+            self.assertEqual(list(sheets), ['corrected','uncorrected','residuals'])
+            for sheet,df in sheets.items():
+                self.assertEqual(list(df.columns), list(results[sheet].columns))
+                self.assertEqual(len(df), len(results[sheet]))
+
+            np.testing.assert_allclose(sheets['corrected']['E_inf'], [1.2,1.2], atol=1e-8)
+            np.testing.assert_array_equal(sheets['corrected']['n_points'], [12,12])
+            ## the neutral sheet has no uncorrected energies, the corrected ones are fit instead
+            charged = sheets['uncorrected']['charge'] == 1
+            np.testing.assert_allclose(sheets['uncorrected'][charged][['E_inf','a','b']],
+                                       [[1.5,0.8,5.0]], atol=1e-8)
+            residuals = sheets['residuals'][sheets['residuals']['charge'] == 1]
+            np.testing.assert_allclose(residuals['res_uncorrected'], 0., atol=1e-8)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestExtrapolate)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
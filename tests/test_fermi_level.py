@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from scipy.optimize import brentq
+from qdef2d.defects import fermi_level
+
+
+class TestFermiLevel(unittest.TestCase):
+
+    def setUp(self):
+
+        ## toy data: 3 defects with charge states -2..2, 10 sets of formation energies
+
+        self.host = fermi_level.EffectiveMassModel(1.8,0.5,0.6)
+        self.q = np.array([-2,-1,0,1,2])
+        self.nsites = np.array([1e15,2e15,1e14])
+        self.T = np.array([300.,700.,1200.])
+        rng = np.random.RandomState(0)
+        self.eform = rng.uniform(0.5,3.0,(10,3,5))
+        ## not every charge state has been calculated
+        self.eform[:,0,0] = np.nan
+
+
+    def test_intrinsic(self):
+
+        ## without defects the Fermi level is at midgap + kT/2 ln(m_h/m_e)
+
+        results = fermi_level.solve(np.zeros((0,1)),[0],self.T,self.host,np.zeros(0),tol=1e-9)
+        ref = 0.9 + 0.5*fermi_level.KB*self.T*np.log(0.6/0.5)
+        np.testing.assert_allclose(results["efermi"],ref,atol=1e-6)
+
+
+    def test_solve_loop(self):
+
+        ## compare the vectorized solver against a scalar root finder at every point
+
+        results = fermi_level.solve(self.eform,self.q,self.T,self.host,self.nsites,tol=1e-9)
+        self.assertEqual(results["efermi"].shape,(3,10))
+        self.assertEqual(results["conc"].shape,(3,10,3,5))
+
+        for i,T in enumerate(self.T):
+            kT = np.array([fermi_level.KB*T])
+            for j in range(10):
+                def net_charge(ef):
+                    conc = fermi_level.defect_concentrations(self.eform[j][None],self.q,
+                                                             np.array([ef]),kT,self.nsites)
+                    n, p = self.host.carriers(np.array([ef]),kT)
+                    return np.sum(self.q*conc) + p[0] - n[0]
+                ref = brentq(net_charge,-3,5,xtol=1e-12)
+                self.assertAlmostEqual(results["efermi"][i,j],ref,places=7)
+
+
+class TestCalc(unittest.TestCase):
+
+    def setUp(self):
+
+        ## two toy defects, with formation energies (as written by calc_Eform_corr)
+        ## for two supercells; the second defect has no -1 charge state
+        self.dir = tempfile.mkdtemp()
+        self.dirs_def = [os.path.join(self.dir,name) for name in ['vS','vMo']]
+        eforms = [{-1: [2.0,2.1], 0: [1.5,1.6], 1: [1.8,1.9]},
+                  {0: [3.0,3.1], 1: [2.5,2.6]}]
+        for dir_def,eform in zip(self.dirs_def,eforms):
+            os.makedirs(dir_def)
+            with pd.ExcelWriter(os.path.join(dir_def,'eform.xlsx')) as writer:
+                for q,E in eform.items():
+                    pd.DataFrame({'vacuum': ['vac_20']*2, 'supercell': ['4x4x1','5x5x1'],
+                                  'E_form_corr': E}
+                                 ).to_excel(writer, sheet_name='charge_%d'%q, index=False)
+        self.host = dict(Egap=1.8, m_e=0.5, m_h=0.6)
+        self.nsites = [1e15,1e14]
+        self.T = np.array([500.,1000.])
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def test_calc_outfile(self):
+
+        ## the formation energies of the chosen supercell go into the solver,
+        ## and the workbook read back holds the returned results
+        outfile = os.path.join(self.dir,'fermi.xlsx')
+        results = fermi_level.calc(self.dirs_def,'eform.xlsx','5x5x1','vac_20',self.nsites,self.T,
+                                   outfile=outfile,**self.host)
+        self.assertEqual(results['charges'],[-1,0,1])
+
+        eform = np.array([[2.1,1.6,1.9],[np.nan,3.1,2.6]])
+        ref = fermi_level.solve(eform,[-1,0,1],self.T,
+                                fermi_level.EffectiveMassModel(**self.host),self.nsites)
+        np.testing.assert_allclose(results['efermi'],ref['efermi'])
+
+        df = pd.read_excel(outfile,sheet_name='fermi_level')
+        self.assertEqual(list(df.columns),['T','E_Fermi','n','p','vS_charge_-1','vS_charge_0',
+                                           'vS_charge_1','vMo_charge_0','vMo_charge_1'])
+        np.testing.assert_allclose(df['T'],self.T)
+        np.testing.assert_allclose(df['E_Fermi'],results['efermi'])
+        np.testing.assert_allclose(df['vMo_charge_1'],results['conc'][:,1,2])
+
+
+if __name__ == '__main__':
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFermiLevel)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCalc)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
@@ -0,0 +1,141 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from qdef2d.defects import formation_energy
+
+
+class TestFormationEnergy(unittest.TestCase):
+
+    def setUp(self):
+        
+        ## toy data: 3 charge states, 2 supercell/vacuum rows, 2 species, 2 mu limits
+        
+        self.q = np.array([-1,0,1])
+        self.E_def = np.array([[-99.0,-99.5],
+                               [-100.0,-100.2],
+                               [-101.5,-101.6]])
+        self.E_bulk = np.array([-103.0,-103.1])
+        self.ni = np.array([-1,1])
+        self.mu = np.array([[-4.0,-6.0],
+                            [-3.0,-7.0]])
+        self.vbm = np.array([-5.5,-5.6])
+        self.efermi = np.linspace(0,2,5)
+        self.E_corr = np.array([[0.2,0.1],[0.0,0.0],[0.3,0.15]])
+        
+
+    def test_eform_loop(self):
+        
+        ## compare the vectorized evaluation against an explicit loop
+
+        eform = formation_energy.eform(self.E_def,self.E_bulk,self.q,self.ni,self.mu,
+                                       self.vbm,self.efermi,self.E_corr)
+        self.assertEqual(eform.shape,(2,3,2,5))
+        
+        for imu in range(2):
+            for iq,q in enumerate(self.q):
+                for irow in range(2):
+                    for ief,ef in enumerate(self.efermi):
+                        ref = (self.E_def[iq,irow] - self.E_bulk[irow]
+                               - np.dot(self.ni,self.mu[imu])
+                               + q*(self.vbm[irow]+ef) + self.E_corr[iq,irow])
+                        self.assertAlmostEqual(eform[imu,iq,irow,ief],ref,places=10)
+
+
+    def test_transition_levels(self):
+        
+        ## formation energies of both charge states should be equal at the transition level
+        
+        eform0 = formation_energy.eform(self.E_def,self.E_bulk,self.q,self.ni,
+                                        self.mu,self.vbm)[0,:,:,0]
+        pairs, ctl = formation_energy.transition_levels(eform0,self.q)
+        self.assertEqual(len(pairs),3)
+        
+        for (q1,q2),level in zip(pairs,ctl):
+            self.assertGreater(q1,q2)
+            i1, i2 = list(self.q).index(q1), list(self.q).index(q2)
+            np.testing.assert_allclose(eform0[i1]+q1*level,eform0[i2]+q2*level)
+
+
+    def test_stable_charge(self):
+        
+        ## missing energies should never be picked as the most stable charge state
+        
+        eform = np.array([[1.0,np.nan],[2.0,0.5],[0.5,3.0]])
+        qstable, emin = formation_energy.stable_charge(eform,self.q,axis=0)
+        np.testing.assert_array_equal(qstable,[1,0])
+        np.testing.assert_allclose(emin,[0.5,0.5])
+        
+
+class TestCalcAll(unittest.TestCase):
+
+    def setUp(self):
+
+        ## toy S vacancy in MoS2: database entries, initdefect.json and the energies
+        self.dir = tempfile.mkdtemp()
+        self.dir_db = os.path.join(self.dir,'db')
+        self.dir_def = os.path.join(self.dir,'MoS2_vS')
+        os.makedirs(self.dir_db)
+        os.makedirs(self.dir_def)
+
+        entries = {'MoS2': {'GGA': {'mu': -22.0, 'Egap': 1.6,
+                                    'vac_15': {'VBM': -6.0}, 'vac_20': {'VBM': -6.1}}},
+                   'S': {'GGA': {'mu': -4.1, 'mu_Mo-rich (MoS2)': -5.0,
+                                 'mu_S-rich (S)': -4.1}}}
+        for system,entry in entries.items():
+            with open(os.path.join(self.dir_db,'%s.json'%system),'w') as f:
+                json.dump(entry,f)
+        with open(os.path.join(self.dir_def,'initdefect.json'),'w') as f:
+            json.dump({'def1': {'type': 'vacancy', 'species': 'S', 'index': 0}},f)
+
+        rows = {'vacuum': ['vac_15','vac_20'], 'supercell': ['4x4x1','4x4x1']}
+        with pd.ExcelWriter(os.path.join(self.dir_def,'energies.xlsx')) as writer:
+            pd.DataFrame(dict(rows, E_def=[-300.0,-300.1], E_bulk=[-306.0,-306.1])
+                         ).to_excel(writer, sheet_name='charge_0', index=False)
+            pd.DataFrame(dict(rows, E_def=[-293.0,-293.2], E_corr=[0.2,0.1])
+                         ).to_excel(writer, sheet_name='charge_1', index=False)
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def test_calc_all_outfile(self):
+
+        ## the summary tables read back from the workbook match the returned results
+        results = formation_energy.calc_all('MoS2',self.dir_db,self.dir_def,'energies.xlsx',
+                                            efermi=np.array([0.,0.5]),outfile='eform')
+        self.assertEqual(results['mu_limits'],['Mo-rich','S-rich'])
+        self.assertEqual(results['eform'].shape,(2,2,2,2))
+
+        ## neutral vacancy at the Mo-rich limit, charged one with its correction
+        self.assertAlmostEqual(results['eform'][0,0,0,0],-300.0+306.0-5.0,places=10)
+        self.assertAlmostEqual(results['eform'][0,1,1,1],
+                               -293.2+306.1-5.0+(-6.1+0.5)+0.1,places=10)
+
+        sheets = pd.read_excel(os.path.join(self.dir_def,'eform.xlsx'),sheet_name=None)
+        self.assertEqual(list(sheets),['transition_levels','Mo-rich','S-rich'])
+        np.testing.assert_allclose(sheets['transition_levels']['e(+1/+0)'],results['ctl'][0])
+        for imu,mu_limit in enumerate(results['mu_limits']):
+            self.assertEqual(list(sheets[mu_limit]['vacuum']),['vac_15','vac_20'])
+            for iq,q in enumerate(results['charges']):
+                np.testing.assert_allclose(sheets[mu_limit]['charge_%d'%q],
+                                           results['eform'][imu,iq,:,0])
+
+        npz = np.load(os.path.join(self.dir_def,'eform.npz'))
+        np.testing.assert_allclose(npz['eform'],results['eform'])
+
+
+if __name__ == '__main__':
+
+  
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFormationEnergy)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCalcAll)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+    
@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+from qdef2d.defects.corrections import gaussian_model_2d
+
+
+class TestGaussianModel2D(unittest.TestCase):
+
+    def test_isolated_vacuum(self):
+
+        ## a Gaussian charge in vacuum has the self-energy Q^2/(2 sqrt(pi) beta)
+
+        for beta in [1.0,1.5]:
+            model = gaussian_model_2d.GaussianModel2D(np.diag([30.,30.,40.]),[],20.,-1.,520,
+                                                      beta=beta,dz=0.05)
+            ref = 1/(2*np.sqrt(np.pi)*beta)*gaussian_model_2d.HARTREE
+            self.assertAlmostEqual(model.energy_isolated(),ref,places=3)
+
+
+    def test_cyclic_thomas(self):
+
+        ## compare the batched periodic tridiagonal solver against a dense solve
+
+        rng = np.random.RandomState(0)
+        n = 12
+        a, c = rng.uniform(1,2,(3,n)), rng.uniform(1,2,(3,n))
+        b = -(a+c) - rng.uniform(0.1,1,(3,n))
+        d = rng.normal(size=(3,n))
+        x = gaussian_model_2d._cyclic_thomas(a,b,c,d)
+        for i in range(3):
+            A = np.diag(b[i]) + np.diag(a[i,1:],-1) + np.diag(c[i,:-1],1)
+            A[0,-1], A[-1,0] = a[i,0], c[i,-1]
+            np.testing.assert_allclose(A @ x[i],d[i],atol=1e-10)
+
+
+    def test_periodic_supercells(self):
+
+        ## the batched supercell energies agree with a model set up in each supercell
+
+        cell = np.array([[6.,0.,0.],[-3.,5.196,0.],[0.,0.,30.]])
+        slabs = [(12.,18.,5.,2.)]
+        model = gaussian_model_2d.GaussianModel2D(cell,slabs,15.,-1.,300)
+        ns = [[1,1],[2,2],[2,3]]
+        E = model.energy_periodic_supercells(ns)
+        for (n1,n2),E_n in zip(ns,E):
+            supercell = cell*np.array([[n1],[n2],[1]])
+            ref = gaussian_model_2d.GaussianModel2D(supercell,slabs,15.,-1.,300).energy_periodic()
+            self.assertAlmostEqual(E_n,ref,places=8)
+
+
+if __name__ == '__main__':
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestGaussianModel2D)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pymatgen.core.lattice import Lattice
+from qdef2d.defects.corrections import image_energy, SPHInX_input_file
+from qdef2d.defects.corrections.gaussian_model_2d import GaussianModel2D
+
+
+class TestImageEnergy(unittest.TestCase):
+
+    def test_image_energies(self):
+
+        ## the estimate for a supercell matches the model of the SPHInX input file
+        ## that would be generated for it, with the defect off the middle of the slab
+        unit = np.array([[3.2,0.,0.],[-1.6,2.771281,0.],[0.,0.,20.]])
+        eps, d_slab, z = 8., 6., 0.55
+        lattice = Lattice(unit*np.array([[3],[3],[1]]))
+        defprop = {"lattice": lattice.as_dict(), "defect_site": [[0.,0.,z]], "charge": 1}
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            sxfile = os.path.join(tmpdir,'system.sx')
+            with open(sxfile,'w') as f:
+                f.write(SPHInX_input_file.render(defprop,eps,d_slab))
+            model = GaussianModel2D.from_sphinx(sxfile,300)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        E = image_energy.image_energies(unit, eps, d_slab, [[3,3,1]], (z-0.5)*lattice.c, 300)
+        self.assertAlmostEqual(E[0], model.energy_isolated() - model.energy_periodic(), places=6)
+
+
+    def test_select(self):
+
+        ## supercells larger than the one from which on the error stays below tolerance are dropped,
+        ## per charge state and vacuum spacing; the error may change sign on the way
+        rows = [(1,'2x2x1','vac_20',0.30), (1,'3x3x1','vac_20',-0.04), (1,'4x4x1','vac_20',0.08),
+                (1,'5x5x1','vac_20',0.03), (1,'6x6x1','vac_20',-0.01),
+                (1,'2x2x1','vac_30',0.50), (1,'3x3x1','vac_30',0.20), (1,'6x6x1','vac_30',0.10),
+                (-1,'2x2x1','vac_20',0.04), (-1,'3x3x1','vac_20',0.01),
+                (0,'2x2x1','vac_20',0.), (0,'3x3x1','vac_20',0.)]
+        estimates = pd.DataFrame(rows, columns=["charge","supercell","vacuum","E_image"])
+
+        keep = image_energy.select(estimates, 0.05)
+        np.testing.assert_array_equal(keep, [True, True, True, True, False,
+                                             True, True, True,
+                                             True, False,
+                                             True, True])
+
+        ## the order of the rows doesn't matter
+        shuffled = estimates.sample(frac=1, random_state=0)
+        np.testing.assert_array_equal(image_energy.select(shuffled, 0.05),
+                                      keep[shuffled.index.values])
+
+
+if __name__ == '__main__':
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestImageEnergy)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
@@ -0,0 +1,114 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from qdef2d.io.database import local_database
+
+
+class TestLocalDatabase(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self._write('MoS2', {'GGA': {'mu': -22.0, 'Egap': 1.6, 'eps_ave': '7.5', 'd_slab': 3.1,
+                                     'vac_15': {'VBM': -6.0}, 'vac_20': {'VBM': -6.1}},
+                             'HSE': {'mu': -25.0, 'vac_20': {'VBM': -6.5}}})
+        self._write('S', {'GGA': {'mu': -4.1, 'mu_Mo-rich (MoS2)': -5.0, 'mu_S-rich (S)': -4.1}})
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def _write(self, system, entry):
+
+        with open(os.path.join(self.dir,'%s.json'%system),'w') as f:
+            json.dump(entry,f)
+
+
+    def test_index(self):
+
+        ## every property is found under its (system, functional, mu-limit, vacuum) key
+        db = local_database.LocalDatabase(self.dir)
+        self.assertEqual(db.systems(), ['MoS2','S'])
+        self.assertEqual(db.lookup('MoS2','GGA'), {'mu': -22.0, 'Egap': 1.6,
+                                                   'eps_ave': '7.5', 'd_slab': 3.1})
+        self.assertEqual(db.lookup('MoS2','GGA',vacuum='vac_15'), {'VBM': -6.0})
+        self.assertEqual(db.lookup('S','GGA',mu_limit='Mo-rich'),
+                         {'mu': -5.0, 'key': 'mu_Mo-rich (MoS2)'})
+        self.assertIsNone(db.lookup('MoS2','PBE'))
+        self.assertIsNone(db.lookup('Se','GGA'))
+
+        self.assertEqual(db.get_vbm('MoS2','GGA','vac_20'), -6.1)
+        self.assertEqual(db.get_vbm('MoS2','HSE','vac_20'), -6.5)
+        self.assertIsNone(db.get_vbm('MoS2','HSE','vac_15'))
+        self.assertEqual(db.get_slab('MoS2','GGA'), (7.5,3.1))
+        self.assertEqual(db.get_slab('MoS2','HSE'), (None,None))
+
+        ## the chemical potential limits, falling back to the plain mu
+        self.assertEqual(db.mu_limits('S','GGA'), ['Mo-rich','S-rich'])
+        self.assertEqual(db.mu_limits('MoS2','GGA'), [])
+        self.assertEqual(db.get_mu('S','GGA','S-rich'), (-4.1,'mu_S-rich (S)'))
+        self.assertEqual(db.get_mu('MoS2','GGA','Mo-rich'), (-22.0,'mu'))
+        self.assertEqual(db.get_mu('MoS2','PBE','Mo-rich'), (None,None))
+
+
+    def test_refresh(self):
+
+        ## only new and modified entries are re-read, and removed ones are forgotten
+        db = local_database.LocalDatabase(self.dir)
+        entry_mos2 = db.entry('MoS2')
+
+        self._write('S', {'GGA': {'mu': -4.2, 'mu_S-rich (S)': -4.2}})
+        self._write('Mo', {'GGA': {'mu': -10.8}})
+        db.refresh()
+        self.assertIs(db.entry('MoS2'), entry_mos2)
+        self.assertEqual(db.systems(), ['Mo','MoS2','S'])
+        self.assertEqual(db.mu_limits('S','GGA'), ['S-rich'])
+        self.assertIsNone(db.lookup('S','GGA',mu_limit='Mo-rich'))
+
+        ## a change of size alone is picked up, even if the mtime is the same
+        stat = os.stat(os.path.join(self.dir,'Mo.json'))
+        self._write('Mo', {'GGA': {'mu': -10.85}})
+        os.utime(os.path.join(self.dir,'Mo.json'), ns=(stat.st_atime_ns,stat.st_mtime_ns))
+        db.refresh()
+        self.assertEqual(db.get_mu('Mo','GGA'), (-10.85,'mu'))
+
+        os.remove(os.path.join(self.dir,'Mo.json'))
+        db.refresh()
+        self.assertEqual(db.systems(), ['MoS2','S'])
+        self.assertIsNone(db.lookup('Mo','GGA'))
+
+        ## load keeps one database per directory, refreshing it each time
+        self.assertIs(local_database.load(self.dir), local_database.load(self.dir + os.sep))
+        self._write('Mo', {'GGA': {'mu': -10.8}})
+        self.assertEqual(local_database.load(self.dir).get_mu('Mo','GGA'), (-10.8,'mu'))
+
+
+    def test_duplicate_limits(self):
+
+        ## two keys for the same limit: only asking for that limit fails,
+        ## everything else in the database can still be used
+        self._write('S', {'GGA': {'mu': -4.1, 'mu_Mo-rich (MoS2)': -5.0,
+                                  'mu_Mo-rich (Mo)': -5.1, 'mu_S-rich (S)': -4.1},
+                          'HSE': {'mu_Mo-rich (MoS2)': -5.5}})
+        db = local_database.LocalDatabase(self.dir)
+        with self.assertRaisesRegex(ValueError,r'mu_Mo-rich \(MoS2\), mu_Mo-rich \(Mo\)'):
+            db.get_mu('S','GGA','Mo-rich')
+        self.assertEqual(db.get_mu('S','GGA','S-rich'), (-4.1,'mu_S-rich (S)'))
+        self.assertEqual(db.get_mu('S','HSE','Mo-rich'), (-5.5,'mu_Mo-rich (MoS2)'))
+        self.assertEqual(db.get_slab('MoS2','GGA'), (7.5,3.1))
+
+        ## fixing the entry clears the error
+        self._write('S', {'GGA': {'mu': -4.1, 'mu_Mo-rich (MoS2)': -5.0}})
+        db.refresh()
+        self.assertEqual(db.get_mu('S','GGA','Mo-rich'), (-5.0,'mu_Mo-rich (MoS2)'))
+
+
+if __name__ == '__main__':
+
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestLocalDatabase)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,130 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from qdef2d.io.vasp import locpot
+
+
+HEADER = """MoS2
+   1.00000000000000
+     3.200000    0.000000    0.000000
+    -1.600000    2.771281    0.000000
+     0.000000    0.000000   20.000000
+   Mo   S
+     1     2
+Direct
+  0.000000  0.000000  0.500000
+  0.333333  0.666667  0.420000
+  0.333333  0.666667  0.580000
+
+   %d   %d   %d
+"""
+
+
+def _load_shared(filenames):
+
+    ## in a worker attached to the shared averages: what load_averages() gives it
+    out = [locpot.load_averages(filename) for filename in filenames]
+    return ([{key: np.array(arr) for key,arr in averages.items()} for averages in out],
+            [arr.flags.writeable for averages in out for arr in averages.values()])
+
+
+class TestLocpot(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir,'LOCPOT')
+        self.data = np.random.RandomState(0).normal(size=(5,6,7))
+        self._write(self.data)
+
+
+    def _write(self, data):
+
+        ## write a small LOCPOT, 5 values per line with x running fastest
+        values = data.flatten(order='F')
+        with open(self.filename,'w') as f:
+            f.write(HEADER%data.shape)
+            for i in range(0,len(values),5):
+                f.write(" ".join(["%.11E"%v for v in values[i:i+5]]) + "\n")
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def test_averages(self):
+
+        ## compare against the averages of the full grid, for plain and compressed files
+        ## and for blocks small enough to split the header and the numbers
+        with open(self.filename,'rb') as f, gzip.open(self.filename+'.gz','wb') as g:
+            shutil.copyfileobj(f,g)
+
+        for filename in [self.filename,self.filename+'.gz']:
+            for blocksize in [64,2**22]:
+                out = locpot.read_averages(filename,inplane=True,blocksize=blocksize)
+                np.testing.assert_array_equal(out['grid'],self.data.shape)
+                np.testing.assert_allclose(out['average_a'],self.data.mean(axis=(1,2)))
+                np.testing.assert_allclose(out['average_b'],self.data.mean(axis=(0,2)))
+                np.testing.assert_allclose(out['average_c'],self.data.mean(axis=(0,1)))
+                np.testing.assert_allclose(out['inplane'],self.data.mean(axis=2),rtol=1e-6)
+
+
+    def test_sidecar(self):
+
+        ## the sidecar is reused until the LOCPOT changes
+        out = locpot.load_averages(self.filename)
+        self.assertTrue(os.path.exists(self.filename+locpot.SIDECAR))
+        np.testing.assert_allclose(locpot.load_averages(self.filename)['average_c'],
+                                   out['average_c'])
+
+        ## a new calculation overwrites the LOCPOT
+        self._write(self.data+1.)
+        os.utime(self.filename,ns=(0,0))
+        np.testing.assert_allclose(locpot.load_averages(self.filename)['average_c'],
+                                   out['average_c']+1.)
+
+
+    def test_shared(self):
+
+        ## workers attached to the shared block get read-only views of the same averages,
+        ## without reading the LOCPOTs (or their sidecars) again
+        filename2 = os.path.join(self.dir,'LOCPOT2.gz')
+        with open(self.filename,'rb') as f, gzip.open(filename2,'wb') as g:
+            g.write(f.read().replace(b'E+00',b'E+01'))
+        filenames = [self.filename,filename2,self.filename]
+        ref = [locpot.load_averages(filename,cache=False) for filename in filenames]
+
+        shared = locpot.SharedAverages(filenames)
+        for filename in set(filenames):
+            os.remove(filename+locpot.SIDECAR)
+        try:
+            with ProcessPoolExecutor(max_workers=2, initializer=locpot.attach,
+                                     initargs=(shared.handle,)) as executor:
+                out, writeable = executor.submit(_load_shared,filenames).result()
+        finally:
+            shared.close()
+
+        self.assertFalse(any(writeable))
+        for averages,averages_ref in zip(out,ref):
+            self.assertEqual(sorted(averages),sorted(averages_ref))
+            for key in averages:
+                np.testing.assert_array_equal(averages[key],averages_ref[key])
+        self.assertFalse(np.allclose(out[0]['average_c'],out[1]['average_c']))
+        self.assertFalse(any(os.path.exists(filename+locpot.SIDECAR) for filename in filenames))
+
+        ## the block is gone once it is closed
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=shared.handle[0])
+
+
+if __name__ == '__main__':
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestLocpot)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
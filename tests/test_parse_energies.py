@@ -0,0 +1,96 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+import pandas as pd
+from qdef2d.io.vasp import parse_energies
+from qdef2d.defects.corrections import parse_corrections
+
+
+OUTCAR = """   NSW    =      0
+   IBRION =     -1
+--------------------------------------- Iteration      1(  12)  ---------------------------------------
+ aborting loop because EDIFF is reached
+  free  energy   TOTEN  =      %.8f eV
+  energy  without entropy=      %.8f  energy(sigma->0) =      %.8f
+"""
+
+POSCAR = """Si
+   1.00000000000000
+     5.430000    0.000000    0.000000
+     0.000000    5.430000    0.000000
+     0.000000    0.000000    5.430000
+   Si
+     %d
+Direct
+%s
+"""
+
+
+class TestParseEnergies(unittest.TestCase):
+
+    def setUp(self):
+
+        ## a bulk campaign: charge_<q>/<supercell>, without vacuum subdirectories
+        self.dir = tempfile.mkdtemp()
+        self.dir_def = os.path.join(self.dir,'def')
+        self.dir_ref = os.path.join(self.dir,'ref')
+        self.energies = {(0,'2x2x2'): -40.5, (0,'3x3x3'): -140.2,
+                         (1,'2x2x2'): -35.1, (1,'3x3x3'): -134.9}
+        self.corrections = {'2x2x2': 0.35, '3x3x3': 0.21}
+
+        for (q,cell),energy in self.energies.items():
+            path = os.path.join(self.dir_def,'charge_%d'%q,cell)
+            self._write(path, 'OUTCAR', OUTCAR%(energy,energy,energy))
+            if q != 0:
+                self._write(os.path.join(path,'correction'), 'correction',
+                            "iso - periodic energy = %.8f eV\n"%self.corrections[cell])
+        for cell in ['2x2x2','3x3x3']:
+            n = int(cell[0])
+            path = os.path.join(self.dir_ref,'charge_0',cell)
+            energy = -5.4*8*n**3
+            self._write(path, 'OUTCAR', OUTCAR%(energy,energy,energy))
+            self._write(path, 'POSCAR', POSCAR%(8*n**3, "\n".join(["  0.0 0.0 0.0"]*8*n**3)))
+
+
+    def _write(self, path, filename, text):
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        with open(os.path.join(path,filename),'w') as f:
+            f.write(text)
+
+
+    def tearDown(self):
+
+        for handler in logging.getLogger().handlers:
+            handler.close()
+        logging.getLogger().handlers = []
+        shutil.rmtree(self.dir)
+
+
+    def test_bulk_round_trip(self):
+
+        ## bulk calculations have no vacuum level, which is an empty cell in the excel file;
+        ## the charged energies and the corrections still have to find their rows
+        parse_energies.parse(self.dir_def,self.dir_ref,'energies.xlsx')
+        parse_corrections.parse(self.dir_def,'energies.xlsx')
+
+        df = pd.read_excel(os.path.join(self.dir_def,'energies.xlsx'),sheet_name=None)
+        self.assertEqual(sorted(df.keys()), ['charge_0','charge_1'])
+        for q in [0,1]:
+            dfq = df['charge_%d'%q].set_index('supercell')
+            self.assertTrue(dfq['vacuum'].isna().all())
+            for cell in ['2x2x2','3x3x3']:
+                self.assertAlmostEqual(dfq.loc[cell,'E_def'], self.energies[(q,cell)])
+                self.assertEqual(dfq.loc[cell,'N'], 8*int(cell[0])**3)
+                if q != 0:
+                    self.assertAlmostEqual(dfq.loc[cell,'E_corr'], self.corrections[cell])
+
+
+if __name__ == '__main__':
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestParseEnergies)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
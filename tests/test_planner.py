@@ -0,0 +1,116 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+import numpy as np
+from qdef2d.defects import planner, extrapolate
+
+
+POSCAR = """MoS2
+   1.00000000000000
+     3.190000    0.000000    0.000000
+    -1.595000    2.762621    0.000000
+     0.000000    0.000000   %.6f
+   Mo   S
+     1     2
+Direct
+  0.000000  0.000000  0.500000
+  0.333333  0.666667  0.420000
+  0.333333  0.666667  0.580000
+"""
+
+
+class TestPlanner(unittest.TestCase):
+
+    def setUp(self):
+
+        ## candidate grid: 3x3x1 to 6x6x1 supercells of a 3-atom unit cell, at 2 vacuum spacings
+        self.cells = [[n,n,1] for n in [3,4,5,6]]
+        self.vacs = [15,20]
+        self.N = np.array([3.*n**2 for n in [3,4,5,6] for vac in self.vacs])
+        self.Lz = np.array([float(vac) for n in [3,4,5,6] for vac in self.vacs])
+        self.costs = planner.cost([cell for cell in self.cells for vac in self.vacs], self.Lz)
+
+
+    def test_next_jobs_underdetermined(self):
+
+        ## with nothing done yet, the cheapest candidates that fix a new parameter come first,
+        ## and a candidate that adds nothing new (same supercell, other vacuum) is passed over
+        X = extrapolate.design_matrix(self.N, self.Lz, 'corrected')
+        chosen, se = planner.next_jobs(X[:0], X[:0], X, self.costs, 0.01, 1e3, 4)
+        self.assertEqual(chosen, [0,2])
+        self.assertTrue(np.isfinite(se))
+
+        ## not enough jobs allowed to fix every parameter
+        X = extrapolate.design_matrix(self.N, self.Lz, 'uncorrected')
+        chosen, se = planner.next_jobs(X[:0], X[:0], X, self.costs, 0.01, 1e3, 2)
+        self.assertEqual(len(chosen), 2)
+        self.assertEqual(se, np.inf)
+
+
+    def test_next_jobs_variance(self):
+
+        ## the predicted error is that of the fit with the chosen calculations added,
+        ## and it goes down until it is within tolerance (or we run out of jobs)
+        X = extrapolate.design_matrix(self.N, self.Lz, 'uncorrected')
+        done, cand = [0,1,2], [3,4,5,6,7]
+        sigma = 0.05
+        se0 = sigma*np.sqrt(np.linalg.inv(X[done].T @ X[done])[0,0])
+
+        for tol,max_jobs in [(se0/2,5),(0.,2)]:
+            chosen, se = planner.next_jobs(X[done], X[:0], X[cand], self.costs[cand],
+                                           sigma, tol, max_jobs)
+            self.assertTrue(0 < len(chosen) <= max_jobs)
+            X_all = np.vstack([X[done], X[cand][chosen]])
+            self.assertAlmostEqual(se, sigma*np.sqrt(np.linalg.inv(X_all.T @ X_all)[0,0]))
+            self.assertTrue(se < se0)
+            if len(chosen) < max_jobs:
+                self.assertTrue(se <= tol)
+
+        ## already within tolerance, and pending calculations count as done
+        chosen, se = planner.next_jobs(X[done], X[:0], X[cand], self.costs[cand], sigma, se0, 5)
+        self.assertEqual(chosen, [])
+        chosen, se = planner.next_jobs(X[:2], X[2:3], X[cand], self.costs[cand], sigma, se0, 5)
+        self.assertEqual(chosen, [])
+
+
+    def test_plan_dry_run(self):
+
+        ## plan a campaign from scratch without setting anything up
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for vac in self.vacs:
+                with open(os.path.join(tmpdir, "POSCAR_vac_%d"%vac), 'w') as f:
+                    f.write(POSCAR%(vac+6.))
+            logfile = os.path.join(tmpdir, "plan.log")
+
+            jobs = planner.plan(tmpdir, 'eform.xlsx', [0,1], self.cells, self.vacs,
+                                max_jobs=3, dry_run=True, logfile=logfile)
+            self.assertEqual(list(jobs.columns), ["charge","supercell","vacuum","cost","reason"])
+            ## at least 2 calculations to fix the neutral fit, 3 for the charged one
+            self.assertGreaterEqual(np.sum(jobs["charge"] == 0), 2)
+            self.assertEqual(np.sum(jobs["charge"] == 1), 3)
+            ## every charged calculation has its neutral counterpart
+            neutral = set(zip(jobs["supercell"][jobs["charge"] == 0],
+                              jobs["vacuum"][jobs["charge"] == 0]))
+            charged = set(zip(jobs["supercell"][jobs["charge"] == 1],
+                              jobs["vacuum"][jobs["charge"] == 1]))
+            self.assertTrue(charged <= neutral)
+
+            ## nothing is set up, and the plan is in the logfile
+            self.assertFalse([d for d in os.listdir(tmpdir) if d.startswith("charge_")])
+            with open(logfile) as f:
+                self.assertEqual(f.read().count("planned:"), len(jobs))
+        finally:
+            for handler in logging.getLogger().handlers:
+                handler.close()
+            logging.getLogger().handlers = []
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestPlanner)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
@@ -0,0 +1,101 @@
+import os
+import io
+import shutil
+import tarfile
+import tempfile
+import unittest
+import numpy as np
+from pymatgen.core import Structure
+from qdef2d import screen_hosts
+
+
+## 2H-WSe2 bulk, two layers per cell
+POSCAR = """WSe2
+   1.00000000000000
+     3.325612    0.000000    0.000000
+    -1.662806    2.880065    0.000000
+     0.000000    0.000000   17.527085
+   W   Se
+     2     4
+Direct
+  0.000000  0.000000  0.750000
+  0.333333  0.666667  0.250000
+  0.000000  0.000000  0.345876
+  0.333333  0.666667  0.845876
+  0.333333  0.666667  0.654124
+  0.000000  0.000000  0.154124
+"""
+
+
+class TestScreenHosts(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.dir_out = os.path.join(self.dir,'out')
+        self.vacs = [15,20]
+        self.inputs = {'WSe2/POSCAR': POSCAR.encode(), 'bad.vasp': b'not a structure\n'}
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def _check(self, statuses):
+
+        ## one status row per structure, with the layers found in the valid one
+        statuses = statuses.set_index('name')
+        self.assertEqual(sorted(statuses.index), ['WSe2_POSCAR','bad'])
+        self.assertEqual(statuses.loc['WSe2_POSCAR','status'], 'done')
+        self.assertEqual(statuses.loc['WSe2_POSCAR','formula'], 'WSe2')
+        self.assertEqual(int(statuses.loc['WSe2_POSCAR','nlayers']), 2)
+        self.assertTrue(statuses.loc['bad','status'].startswith('failed'))
+
+        ## a single layer of the valid structure, with the vacuum spacing asked for
+        slab_d = float(statuses.loc['WSe2_POSCAR','slab_d'])
+        for vac in self.vacs:
+            struct = Structure.from_file(os.path.join(self.dir_out,'WSe2_POSCAR',
+                                                      'vac_%d'%vac,'POSCAR'))
+            self.assertEqual(struct.composition.reduced_formula, 'WSe2')
+            self.assertEqual(len(struct), 3)
+            self.assertAlmostEqual(struct.lattice.c - slab_d, vac, places=3)
+            self.assertAlmostEqual(np.mean(struct.frac_coords[:,2]), 0.5, places=6)
+        self.assertFalse(os.path.exists(os.path.join(self.dir_out,'bad')))
+
+
+    def test_screen_directory(self):
+
+        ## screen a directory, then again: only the failed structure is retried
+        source = os.path.join(self.dir,'in')
+        for name,data in self.inputs.items():
+            os.makedirs(os.path.dirname(os.path.join(source,name)), exist_ok=True)
+            with open(os.path.join(source,name),'wb') as f:
+                f.write(data)
+
+        self._check(screen_hosts.screen(source, self.dir_out, self.vacs))
+        statuses = screen_hosts.screen(source, self.dir_out, self.vacs)
+        self._check(statuses)
+        with open(os.path.join(self.dir_out,'screening.csv')) as f:
+            rows = f.read().splitlines()
+        self.assertEqual(len(rows), 1+3)
+
+
+    def test_screen_tar(self):
+
+        ## screen a compressed tar archive
+        source = os.path.join(self.dir,'in.tar.gz')
+        with tarfile.open(source,'w:gz') as tar:
+            for name,data in self.inputs.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+        self._check(screen_hosts.screen(source, self.dir_out, self.vacs, nprocs=2))
+
+
+if __name__ == '__main__':
+
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestScreenHosts)
+    unittest.TextTestRunner(verbosity=2).run(suite)
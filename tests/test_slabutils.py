@@ -0,0 +1,258 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import unittest
+from pymatgen.core import Structure, Lattice
+from pymatgen.io.vasp.inputs import Poscar
+from qdef2d import slabutils
+
+
+class TestFindLayers(unittest.TestCase):
+
+    def setUp(self):
+
+        ## simple toy structure: two layers of two (unbonded) O atoms each,
+        ## so only the gap method applies
+        self.a0 = 3.0
+        self.c = 20.0
+
+        self.structure_bulk = Structure(
+                Lattice.from_parameters(a=self.a0, b=self.a0, c=self.c,
+                                        alpha=90, beta=90, gamma=90),
+                ["O","O","O","O"],
+                [[0.0, 0.0, 0.15],
+                 [0.5, 0.5, 0.35],
+                 [0.0, 0.0, 0.65],
+                 [0.5, 0.5, 0.85]])
+        self.slabmin = 0.0
+        self.slabmax = 0.5
+        self.min_gap = 5.0
+        self.methods = ['gap']
+
+
+    def _check_layers(self, layers):
+
+        ## two layers, together holding every site, one of which is the layer
+        ## between slabmin and slabmax (both layers are equivalent in some structures)
+        struct_layer = slabutils.layer_from_bulk(self.structure_bulk,self.slabmin,self.slabmax)
+        self.assertEqual(len(layers),2)
+        self.assertEqual(sum(len(layer) for layer in layers),len(self.structure_bulk))
+        matches = [layer for layer in layers
+                   if len(layer) == len(struct_layer) and
+                   np.allclose(slabutils.center_slab(layer.copy()).frac_coords%1%1,
+                               slabutils.center_slab(struct_layer.copy()).frac_coords%1%1)]
+        self.assertTrue(matches)
+        ## the layers are in the order they are stacked along c
+        centers = [np.mean(layer.frac_coords[:,2]) for layer in layers]
+        self.assertTrue(np.all(np.diff(np.array(centers)%1) > 0))
+
+
+    def test_find_layers_gap(self):
+
+        ## test find_layers function against layer_from_bulk, splitting at the vdW gaps
+        self._check_layers(slabutils.find_layers(self.structure_bulk,method='gap',
+                                                 min_gap=self.min_gap))
+
+
+    def test_find_layers_bonds(self):
+
+        ## test find_layers function against layer_from_bulk, following the bonds (the default)
+        if 'bonds' in self.methods:
+            self._check_layers(slabutils.find_layers(self.structure_bulk))
+
+
+    def test_no_layers(self):
+
+        ## no gap anywhere along c
+        with self.assertRaisesRegex(ValueError,'no gap'):
+            slabutils.find_layers(self.structure_bulk,method='gap',min_gap=self.c)
+
+        ## diamond Si is bonded along c all the way through
+        struct_si = Structure(Lattice.cubic(5.43),["Si"]*8,
+                              [[0.,0.,0.],[0.,0.5,0.5],[0.5,0.,0.5],[0.5,0.5,0.],
+                               [0.25,0.25,0.25],[0.25,0.75,0.75],[0.75,0.25,0.75],[0.75,0.75,0.25]])
+        with self.assertRaisesRegex(ValueError,'bonded along c'):
+            slabutils.find_layers(struct_si)
+
+
+class TestFindLayers_WSe2(TestFindLayers):
+
+    def setUp(self):
+
+        ## 2H-WSe2 bulk
+        self.a0 = 3.325612
+        self.c = 17.527085
+
+        self.structure_bulk = Structure(
+                Lattice.from_parameters(a=self.a0, b=self.a0, c=self.c,
+                                        alpha=90, beta=90, gamma=120),
+                ["W","W","Se","Se","Se","Se"],
+                [[0.0, 0.0, 0.75],
+                 [0.333333, 0.666667, 0.25],
+                 [0.0, 0.0, 0.345876],
+                 [0.333333, 0.666667, 0.845876],
+                 [0.333333, 0.666667, 0.654124],
+                 [0.0, 0.0, 0.154124]])
+        self.slabmin = 0.5
+        self.slabmax = 1.0
+        self.min_gap = 2.4
+        self.methods = ['gap','bonds']
+
+
+class TestFindLayers_SnS(TestFindLayers):
+
+    def setUp(self):
+
+        ## SnS bulk, with puckered layers
+        self.a0 = 4.442511
+        self.a1 = 4.023972
+        self.c = 11.432652
+
+        self.structure_bulk = Structure(
+                Lattice.from_parameters(a=self.a0, b=self.a1, c=self.c,
+                                        alpha=90, beta=90, gamma=90),
+                ["Sn","Sn","Sn","Sn","S","S","S","S"],
+                [[0.873976, 0.250000, 0.121238],
+                 [0.126024, 0.750000, 0.878762],
+                 [0.373976, 0.750000, 0.378762],
+                 [0.626024, 0.250000, 0.621238],
+                 [0.480133, 0.750000, 0.150170],
+                 [0.519867, 0.250000, 0.849830],
+                 [0.980133, 0.250000, 0.349830],
+                 [0.019867, 0.750000, 0.650170]])
+        self.slabmin = 0.0
+        self.slabmax = 0.5
+        self.min_gap = 2.4
+        self.methods = ['gap','bonds']
+
+
+class TestUnitcells2D(unittest.TestCase):
+
+    def setUp(self):
+
+        ## MoS2 monolayer off the middle of a 14 Angstrom cell, and the 2H-WSe2 bulk
+        self.dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.dir)
+        self.vacuums = [15,20,25]
+        self.structure = Structure(
+                Lattice.from_parameters(a=3.19, b=3.19, c=14.0, alpha=90, beta=90, gamma=120),
+                ["Mo","S","S"],
+                [[0.0, 0.0, 0.3],
+                 [0.333333, 0.666667, 0.188],
+                 [0.333333, 0.666667, 0.412]])
+        self.structure_bulk = Structure(
+                Lattice.from_parameters(a=3.325612, b=3.325612, c=17.527085,
+                                        alpha=90, beta=90, gamma=120),
+                ["W","W","Se","Se","Se","Se"],
+                [[0.0, 0.0, 0.75],
+                 [0.333333, 0.666667, 0.25],
+                 [0.0, 0.0, 0.345876],
+                 [0.333333, 0.666667, 0.845876],
+                 [0.333333, 0.666667, 0.654124],
+                 [0.0, 0.0, 0.154124]])
+        self.slabmin = 0.5
+        self.slabmax = 1.0
+        self.structure.to(filename='POSCAR_layer',fmt='poscar')
+        self.structure_bulk.to(filename='POSCAR_bulk',fmt='poscar')
+
+
+    def tearDown(self):
+
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+
+    def _reference(self, struct, vacuum):
+
+        ## one vacuum spacing at a time, with the structure operations (as gen_unitcell_2d used to)
+        struct = slabutils.center_slab(struct.copy())
+        slab_d = slabutils.get_slab_thickness(struct)
+        struct = slabutils.add_vacuum(struct, vacuum - (struct.lattice.c - slab_d))
+        return slabutils.center_slab(struct), slab_d
+
+
+    def _check(self, dir_main, struct):
+
+        for vacuum in self.vacuums:
+            ref, slab_d = self._reference(struct, vacuum)
+            poscar = Poscar.from_file(os.path.join(dir_main,'vac_%d'%vacuum,'POSCAR'))
+            self.assertEqual([site.specie.symbol for site in poscar.structure],
+                             [site.specie.symbol for site in ref])
+            np.testing.assert_allclose(poscar.structure.lattice.matrix,ref.lattice.matrix,atol=1e-12)
+            np.testing.assert_allclose(poscar.structure.frac_coords,ref.frac_coords%1,atol=1e-12)
+            self.assertAlmostEqual(ref.lattice.c - slab_d, vacuum, places=10)
+
+
+    def test_gen_unitcells_2d(self):
+
+        ## all the vacuum spacings at once, and one at a time, match the structure operations
+        slab_d = slabutils.gen_unitcells_2d('POSCAR_layer',self.vacuums)
+        self.assertAlmostEqual(slab_d, 0.224*14.0, places=10)
+        self._check(self.dir, self.structure)
+
+        os.makedirs('single')
+        os.chdir('single')
+        for vacuum in self.vacuums:
+            slabutils.gen_unitcell_2d('../POSCAR_layer',vacuum)
+        self._check('.', self.structure)
+
+
+    def test_from_bulk(self):
+
+        ## the layer between slabmin and slabmax of the bulk, or the first one found
+        struct_layer = slabutils.layer_from_bulk(self.structure_bulk,self.slabmin,self.slabmax)
+        slabutils.gen_unitcells_2d('POSCAR_bulk',self.vacuums,from_bulk=True,
+                                   slabmin=self.slabmin,slabmax=self.slabmax)
+        self._check(self.dir, struct_layer)
+
+        struct_layer = slabutils.find_layers(self.structure_bulk)[0]
+        slabutils.gen_unitcells_2d('POSCAR_bulk',self.vacuums,from_bulk=True)
+        self._check(self.dir, struct_layer)
+
+
+    def test_write_unitcells_2d(self):
+
+        ## the structure passed in is centered in place, and written to the given directory
+        struct = self.structure.copy()
+        os.makedirs('out')
+        slabutils.write_unitcells_2d(struct,self.vacuums,os.path.join(self.dir,'out'))
+        np.testing.assert_allclose(struct.frac_coords,
+                                   slabutils.center_slab(self.structure.copy()).frac_coords,atol=1e-12)
+        self.assertEqual(sorted(os.listdir('out')),['vac_15','vac_20','vac_25'])
+        self._check(os.path.join(self.dir,'out'), self.structure)
+
+
+    def test_add_vacuum(self):
+
+        ## in place or on a copy, the result is the same
+        struct = self.structure.copy()
+        added = slabutils.add_vacuum(struct, 6.)
+        np.testing.assert_allclose(struct.frac_coords,self.structure.frac_coords)
+        self.assertAlmostEqual(struct.lattice.c, 14.0)
+        self.assertAlmostEqual(added.lattice.c, 20.0)
+        self.assertAlmostEqual(slabutils.get_slab_thickness(added), 0.224*14.0, places=10)
+        np.testing.assert_allclose(added.cart_coords[:,2] - added.cart_coords[0,2],
+                                   self.structure.cart_coords[:,2] - self.structure.cart_coords[0,2],
+                                   atol=1e-12)
+
+        self.assertIs(slabutils.add_vacuum(struct, 6., in_place=True), struct)
+        np.testing.assert_allclose(struct.lattice.matrix,added.lattice.matrix,atol=1e-15)
+        np.testing.assert_allclose(struct.frac_coords,added.frac_coords,atol=1e-15)
+
+
+if __name__ == '__main__':
+
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFindLayers)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFindLayers_WSe2)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFindLayers_SnS)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestUnitcells2D)
+    unittest.TextTestRunner(verbosity=2).run(suite)
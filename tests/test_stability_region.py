@@ -0,0 +1,96 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from qdef2d.io.database import stability_region, local_database
+
+
+class TestStabilityRegion(unittest.TestCase):
+
+    def setUp(self):
+
+        ## toy Mo/S/MoS2 database, with energies per formula unit
+        self.dir = tempfile.mkdtemp()
+        self.mu0 = {'Mo': -10.85, 'S': -4.13}
+        self.dH = -2.89
+        self._write('Mo', {'GGA': {'mu': self.mu0['Mo']}})
+        ## an older hull limit and a hand-written limit are already there
+        self._write('S', {'GGA': {'mu': self.mu0['S'], 'mu_S-rich (hull)': -4.2,
+                                  'mu_Mo-rich (0.5*MoS2-0.5*Mo)': -5.57}})
+        self._write('MoS2', {'GGA': {'mu': self.dH + self.mu0['Mo'] + 2*self.mu0['S'],
+                                     'vac_20': {'VBM': -6.0}}})
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+
+    def _write(self, system, entry):
+
+        with open(os.path.join(self.dir,'%s.json'%system),'w') as f:
+            json.dump(entry,f)
+
+
+    def test_vertices(self):
+
+        ## MoS2 is stable from the S-rich (dmu_S = 0) to the Mo-rich (dmu_Mo = 0) limit
+        region = stability_region.stability_region('MoS2',self.dir)
+        self.assertEqual(region['elements'],['Mo','S'])
+        self.assertEqual(region['phases'],['Mo','MoS2','S'])
+        np.testing.assert_allclose(region['mu0'],[self.mu0['Mo'],self.mu0['S']])
+        self.assertEqual(region['labels'],['S-rich','Mo-rich'])
+        np.testing.assert_allclose(region['vertices'],[[self.dH,0.],[0.,self.dH/2]],atol=1e-10)
+
+
+    def test_competing_phase(self):
+
+        ## Mo2S3 cuts off the Mo-rich end: that vertex is now where MoS2 and Mo2S3 coexist
+        self._write('Mo2S3', {'GGA': {'mu': -4.5 + 2*self.mu0['Mo'] + 3*self.mu0['S']}})
+        region = stability_region.stability_region('MoS2',self.dir)
+        self.assertEqual(region['labels'],['S-rich','Mo2S3'])
+        ## 2 dmu_Mo + 3 dmu_S = dH(Mo2S3) and dmu_Mo + 2 dmu_S = dH(MoS2)
+        dmu_Mo = 2*(-4.5 - 1.5*self.dH)
+        np.testing.assert_allclose(region['vertices'][1],[dmu_Mo,(self.dH-dmu_Mo)/2],atol=1e-10)
+
+        ## a host that is less stable than its competitors has no stability region
+        self._write('MoS3', {'GGA': {'mu': -5. + self.mu0['Mo'] + 3*self.mu0['S']}})
+        with self.assertRaisesRegex(ValueError,'not stable'):
+            stability_region.stability_region('MoS2',self.dir)
+
+
+    def test_write_limits(self):
+
+        ## the vertices are stored as mu_<label>-hull in the entries of the elements,
+        ## replacing the older hull limits and leaving the hand-written ones alone
+        region = stability_region.calc('MoS2',self.dir)
+        with open(os.path.join(self.dir,'S.json')) as f:
+            props = json.load(f)['GGA']
+        self.assertEqual(sorted(props),['mu','mu_Mo-rich (0.5*MoS2-0.5*Mo)',
+                                        'mu_Mo-rich-hull','mu_S-rich-hull'])
+
+        db = local_database.load(self.dir)
+        self.assertEqual(db.mu_limits('S','GGA'),['Mo-rich','Mo-rich-hull','S-rich-hull'])
+        self.assertEqual(db.mu_limits('Mo','GGA'),['Mo-rich-hull','S-rich-hull'])
+        for label,v in zip(region['labels'],region['vertices']):
+            for i,el in enumerate(region['elements']):
+                mu, key = db.get_mu(el,'GGA',label+'-hull')
+                self.assertEqual(key,'mu_%s-hull'%label)
+                self.assertAlmostEqual(mu,self.mu0[el]+v[i],places=10)
+        self.assertEqual(db.get_mu('S','GGA','Mo-rich'),(-5.57,'mu_Mo-rich (0.5*MoS2-0.5*Mo)'))
+
+        ## writing them again replaces them
+        self._write('MoS2', {'GGA': {'mu': -0.5 + self.mu0['Mo'] + 2*self.mu0['S']}})
+        stability_region.calc('MoS2',self.dir)
+        db = local_database.LocalDatabase(self.dir)
+        self.assertEqual(db.mu_limits('S','GGA'),['Mo-rich','Mo-rich-hull','S-rich-hull'])
+        self.assertAlmostEqual(db.get_mu('S','GGA','Mo-rich-hull')[0],self.mu0['S']-0.25,places=10)
+
+
+if __name__ == '__main__':
+
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStabilityRegion)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,98 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from qdef2d.defects.corrections import sxdefectalign_output
+
+
+## a short sxdefectalign2d output, with the preamble that is printed before the energies
+CORRECTION_2D = b"""Reading potentials...
+cell = [[11.93, 0, 0], [-5.96, 10.33, 0], [0, 0, 37.79]]
+--- Isolated energies ---
+isolated energy = 0.027126 Hartree
+  eps = 4.5
+periodic energy = 0.038211 Hartree
+iso - periodic energy = -0.30164 eV
+"""
+
+## the equivalent lines of an sxdefectalign output
+CORRECTION_3D = b"""=== Intermediate results (unscreened) ===
+Isolated energy       : 0.1265
+Periodic energy       : 0.0810
+Difference (Hartree)  : 0.0455
+Difference (eV)       : 1.2381D+00
+Defect correction (eV): 0.2752 (incl. screening & alignment)
+"""
+
+
+class TestSxdefectalignOutput(unittest.TestCase):
+
+    def test_parse_terms(self):
+
+        terms = sxdefectalign_output.parse_terms(CORRECTION_2D)
+        self.assertAlmostEqual(terms['isolated energy'], 0.027126)
+        self.assertAlmostEqual(terms['periodic energy'], 0.038211)
+        self.assertAlmostEqual(terms['iso - periodic energy'], -0.30164)
+        self.assertAlmostEqual(terms['eps'], 4.5)
+        ## the cell is not an energy term
+        self.assertNotIn('cell', terms)
+
+        terms = sxdefectalign_output.parse_terms(CORRECTION_3D)
+        self.assertAlmostEqual(terms['Difference'], 1.2381)
+        self.assertAlmostEqual(terms['Defect correction'], 0.2752)
+
+
+    def test_read_correction(self):
+
+        ## the total correction is picked out from either output, and is None without it
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filenames = []
+            for i,text in enumerate([CORRECTION_2D, CORRECTION_3D, CORRECTION_2D[:-30]]):
+                filenames.append(os.path.join(tmpdir, 'correction_%d'%i))
+                with open(filenames[-1], 'wb') as f:
+                    f.write(text)
+            E_corr = [terms['E_corr'] for terms in sxdefectalign_output.read_corrections(filenames)]
+            self.assertEqual(E_corr, [-0.30164, 0.2752, None])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+    def test_read_vline(self):
+
+        ## sxdefectalign separates its data sets with '&' lines; the last one is returned by default
+        rng = np.random.RandomState(0)
+        data = [rng.normal(size=(20,3)), rng.normal(size=(20,3))]
+        text = '&\n'.join(['\n'.join(['%.6f %.6f %.6f'%tuple(row) for row in d]) + '\n'
+                           for d in data])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'vline-eV.dat.gz')
+            with gzip.open(filename, 'wt') as f:
+                f.write(text)
+            np.testing.assert_allclose(sxdefectalign_output.read_vline(filename), data[1], atol=1e-6)
+            np.testing.assert_allclose(sxdefectalign_output.read_vline(filename, 0), data[0], atol=1e-6)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+    def test_vacuum_windows(self):
+
+        z = np.linspace(0., 40., 81)
+        bottom, top = sxdefectalign_output.vacuum_windows(z, 2.)
+        np.testing.assert_array_equal(z[bottom], [0., 0.5, 1., 1.5, 2.])
+        np.testing.assert_array_equal(z[top], [38.5, 39., 39.5, 40.])
+
+        ## a window wider than the cell covers everything
+        bottom, top = sxdefectalign_output.vacuum_windows(z, 50.)
+        self.assertEqual(len(z[bottom]), len(z))
+        self.assertEqual(len(z[top]), len(z))
+
+
+if __name__ == '__main__':
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSxdefectalignOutput)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+